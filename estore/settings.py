@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import sys
 from django.utils.translation import gettext_lazy as _
 import dj_database_url
 
@@ -15,6 +16,8 @@ SECRET_KEY = 'django-insecure-$(0=*8=!$i(@qx#_gjk=16#(7f-)-44y#11_ep#e$x3apc5cr_
 
 DEBUG = True
 
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 ALLOWED_HOSTS = ['*']
 
 
@@ -99,6 +102,34 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',  # chemin absolu
     }
 }
+# Cache (données de catalogue assemblées, compteurs, versions, verrous de reconstruction)
+# Partagé entre workers et commandes de gestion: les invalidations (compute_trending,
+# generate_coupon_codes...) doivent atteindre tous les processus.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif TESTING:
+    # Tests: un seul processus, pas de requête SQL de cache dans les comptages de requêtes
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'universepro',
+        }
+    }
+else:
+    # Sans Redis: cache en base, table créée par `manage.py createcachetable`
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'universepro_cache',
+        }
+    }
+CATALOG_CACHE_TIMEOUT = 60 * 60  # 1 heure, invalidé dès que le catalogue change
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -238,6 +269,7 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 FREE_SHIPPING_THRESHOLD = 100000  # 100,000 FCFA
 DEFAULT_SHIPPING_COST = 5000  # 5,000 FCFA
 CART_SESSION_ID = 'cart'
+COUNTER_FLUSH_INTERVAL = 30  # Secondes entre deux écritures groupées des vues/clics produits
 WHATSAPP_ENABLED = True
 WHATSAPP_PHONE = '+22893020525'
 WHATSAPP_MESSAGE = "Bonjour, j'ai une question sur votre boutique en ligne."
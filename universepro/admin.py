@@ -1,6 +1,10 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import *
+from .coupons import generate_campaign
+
+# Codes générés par l'action d'administration (campagnes plus grandes: commande)
+CAMPAIGN_ADMIN_COUNT = 1000
 
 # SiteSetting Admin
 @admin.register(SiteSetting)
@@ -60,7 +64,7 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('name', 'description', 'sku')
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ('price', 'original_price', 'in_stock', 'stock_quantity', 'is_active', 'featured')
-    readonly_fields = ('created_at', 'updated_at', 'rating', 'reviews_count')
+    readonly_fields = ('created_at', 'updated_at', 'rating', 'reviews_count', 'sales_count')
     inlines = [ProductImageInline, ProductFeatureInline]
     fieldsets = (
         (None, {
@@ -73,7 +77,7 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('description', 'short_description', 'colors', 'weight', 'dimensions')
         }),
         ('Évaluations', {
-            'fields': ('rating', 'reviews_count')
+            'fields': ('rating', 'reviews_count', 'sales_count')
         }),
         ('Statut', {
             'fields': ('featured', 'is_active')
@@ -111,15 +115,33 @@ class ProductReviewAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('product', 'user')
 
 # Coupon Admin
+class CouponRedemptionInline(admin.TabularInline):
+    model = CouponRedemption
+    extra = 0
+    can_delete = False
+    readonly_fields = ('user', 'order', 'use_number', 'redeemed_at')
+
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
-    list_display = ('code', 'discount_type', 'discount_value', 'valid_from', 'valid_to', 'is_active', 'current_uses', 'max_uses')
-    list_filter = ('discount_type', 'is_active')
+    list_display = (
+        'code', 'discount_type', 'discount_value', 'valid_from', 'valid_to', 'is_active',
+        'current_uses', 'max_uses', 'max_uses_per_user'
+    )
+    list_filter = ('discount_type', 'is_active', 'auto_apply')
     search_fields = ('code', 'description')
     list_editable = ('is_active',)
     filter_horizontal = ('categories', 'products')
+    raw_id_fields = ('template',)
     readonly_fields = ('current_uses', 'created_at', 'updated_at')
     date_hierarchy = 'valid_from'
+    inlines = [CouponRedemptionInline]
+    actions = ['generate_campaign_codes']
+
+    def generate_campaign_codes(self, request, queryset):
+        # Au-delà, utiliser la commande: manage.py generate_coupon_codes CODE --count 100000
+        created = sum(generate_campaign(template, CAMPAIGN_ADMIN_COUNT) for template in queryset)
+        self.message_user(request, f"{created} codes générés")
+    generate_campaign_codes.short_description = f"Générer {CAMPAIGN_ADMIN_COUNT} codes uniques à partir de ce modèle"
 
 # Cart Admin
 class CartItemInline(admin.TabularInline):
@@ -133,19 +155,10 @@ class CartAdmin(admin.ModelAdmin):
     list_filter = ('user',)
     search_fields = ('user__username', 'session_key')
     inlines = [CartItemInline]
-    readonly_fields = ('created_at', 'updated_at')
-
-    def item_count(self, obj):
-        return obj.items.count()
-    item_count.short_description = 'Items'
-
-    def subtotal(self, obj):
-        return obj.subtotal
-    subtotal.admin_order_field = 'subtotal'
+    readonly_fields = ('created_at', 'updated_at', 'item_count', 'quantity_total', 'subtotal', 'weight_total', 'version')
 
     def total(self, obj):
         return obj.total
-    total.admin_order_field = 'total'
 
 # Address Admin
 @admin.register(Address)
@@ -161,12 +174,18 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('created_at',)
 
+class StockReservationInline(admin.TabularInline):
+    model = StockReservation
+    extra = 0
+    can_delete = False
+    readonly_fields = ('product', 'quantity', 'expires_at', 'created_at')
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_number', 'user', 'status', 'payment_status', 'total', 'created_at')
     list_filter = ('status', 'payment_status', 'payment_method', 'created_at')
     search_fields = ('order_number', 'user__username')
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, StockReservationInline]
     readonly_fields = ('order_number', 'created_at', 'updated_at')
     fieldsets = (
         (None, {
@@ -213,7 +232,7 @@ class PaymentAdmin(admin.ModelAdmin):
 # ShippingMethod Admin
 @admin.register(ShippingMethod)
 class ShippingMethodAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'free_shipping_threshold', 'estimated_delivery', 'is_active')
+    list_display = ('name', 'price', 'price_per_kg', 'max_weight', 'free_shipping_threshold', 'estimated_delivery', 'is_active')
     list_editable = ('price', 'is_active')
     list_filter = ('is_active',)
 
@@ -229,7 +248,7 @@ class NotificationAdmin(admin.ModelAdmin):
 # TrendingProduct Admin
 @admin.register(TrendingProduct)
 class TrendingProductAdmin(admin.ModelAdmin):
-    list_display = ('product', 'period', 'rank', 'views', 'clicks', 'date')
+    list_display = ('product', 'period', 'rank', 'score', 'views', 'clicks', 'cart_adds', 'date')
     list_filter = ('period', 'date')
     search_fields = ('product__name',)
     list_editable = ('rank',)
@@ -0,0 +1,352 @@
+# universepro/cart.py
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+from .shipping import cart_quotes
+
+
+CART_SESSION_ID = getattr(settings, 'CART_SESSION_ID', 'cart')
+CART_OPERATIONS = ('add', 'set', 'remove')
+# Nombre maximal d'opérations acceptées par lot
+MAX_CART_OPERATIONS = 100
+
+_cart_totals = threading.local()
+
+
+@contextmanager
+def deferred_cart_totals():
+    """
+    Suspend le recalcul par article: l'appelant appelle Cart.refresh_totals() une fois à la fin.
+    Imbricable (compteur de profondeur): le recalcul reprend à la sortie du bloc le plus externe.
+    """
+    _cart_totals.depth = getattr(_cart_totals, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _cart_totals.depth -= 1
+
+
+def cart_totals_deferred():
+    return getattr(_cart_totals, 'depth', 0) > 0
+
+
+class SessionCartItem:
+    """Ligne du panier de session, mêmes attributs que CartItem pour les templates"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.price = product.price
+
+    @property
+    def id(self):
+        # Les vues de modification/suppression reçoivent l'id produit pour un visiteur anonyme
+        return self.product.id
+
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+
+
+class SessionCart:
+    """
+    Panier d'un visiteur anonyme conservé en session ({id produit: quantité}).
+
+    Aucune ligne Cart/CartItem n'est écrite tant que le visiteur ne passe pas
+    commande ou ne se connecte pas: voir materialize_session_cart().
+    """
+    coupon = None
+    coupon_discount = Decimal('0.00')
+
+    def __init__(self, session):
+        self.session = session
+        # Clés JSON: les ids produits sont stockés sous forme de chaînes
+        self.lines = {int(pk): quantity for pk, quantity in session.get(CART_SESSION_ID, {}).items()}
+        self._items = None
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def save(self):
+        self.session[CART_SESSION_ID] = {str(pk): quantity for pk, quantity in self.lines.items()}
+        self._items = None
+
+    def add(self, product_id, quantity=1):
+        self.lines[product_id] = self.lines.get(product_id, 0) + quantity
+        self.save()
+
+    def set(self, product_id, quantity):
+        if quantity < 1:
+            self.remove(product_id)
+            return
+        self.lines[product_id] = quantity
+        self.save()
+
+    def remove(self, product_id):
+        if self.lines.pop(product_id, None) is not None:
+            self.save()
+
+    def clear(self):
+        self.lines = {}
+        if CART_SESSION_ID in self.session:
+            del self.session[CART_SESSION_ID]
+        self._items = None
+
+    def get_items(self):
+        """Lignes avec leur produit (une requête, images préchargées)"""
+        if self._items is None:
+            products = Product.objects.filter(pk__in=self.lines, is_active=True).prefetch_related('images')
+            self._items = [SessionCartItem(product, self.lines[product.pk]) for product in products]
+        return self._items
+
+    def get_item(self, product_id):
+        return next((item for item in self.get_items() if item.product.pk == product_id), None)
+
+    @property
+    def item_count(self):
+        return len(self.lines)
+
+    @property
+    def quantity_total(self):
+        return sum(self.lines.values())
+
+    @property
+    def subtotal(self):
+        return sum((item.total_price for item in self.get_items()), Decimal('0.00'))
+
+    @property
+    def shipping_cost(self):
+        return cart_quotes(self)[0].price
+
+    @property
+    def total(self):
+        return max(self.subtotal - self.coupon_discount + self.shipping_cost, Decimal('0.00'))
+
+
+def add_cart_line(cart, product, quantity):
+    """
+    Ajoute `quantity` unités au panier sans perte d'incrément entre requêtes concurrentes.
+
+    Ligne existante: un seul UPDATE conditionnel, quantity = quantity + n si
+    quantity + n <= stock, le stock lu par une sous-requête corrélée dans la même
+    instruction. La condition porte sur la ligne mise à jour elle-même: après
+    l'attente d'un verrou, PostgreSQL la réévalue avec la quantité validée par
+    l'ajout concurrent (une jointure compilée en `id IN (SELECT ...)` ne l'est pas).
+
+    Nouvelle ligne: INSERT puis stock relu en base dans la même transaction,
+    annulée s'il est insuffisant. Si l'INSERT échoue sur la contrainte d'unicité,
+    la ligne existe (requête concurrente ou stock insuffisant): l'UPDATE est
+    retenté une fois. Retourne False si le stock est insuffisant.
+    """
+    stock = Subquery(Product.objects.filter(pk=OuterRef('product_id')).order_by().values('stock_quantity')[:1])
+    line = CartItem.objects.alias(
+        new_quantity=F('quantity') + quantity, stock=stock
+    ).filter(cart=cart, product=product, new_quantity__lte=F('stock'))
+    for attempt in range(2):
+        if line.update(quantity=F('quantity') + quantity, price=product.price, updated_at=timezone.now()):
+            # update() n'émet pas post_save
+            Cart.refresh_totals(cart.pk)
+            return True
+        if attempt:
+            return False
+        try:
+            with transaction.atomic():
+                # Produit déjà chargé: CartItem.save() ne le relit pas
+                CartItem.objects.create(cart=cart, product=product, quantity=quantity, price=product.price)
+                # Écriture d'abord (pas de verrou en lecture à promouvoir sous SQLite), stock relu ensuite
+                if not Product.objects.filter(pk=product.pk, stock_quantity__gte=quantity).exists():
+                    transaction.set_rollback(True)
+                    return False
+            return True
+        except IntegrityError:
+            continue
+    return False
+
+
+def merge_cart_lines(cart, lines):
+    """
+    Ajoute des lignes {product_id: quantité} au panier en une opération ensembliste:
+    lecture des prix et des lignes existantes, quantités fusionnées en mémoire
+    (plafonnées au stock), puis un seul upsert et un recalcul des totaux.
+    Le nombre de requêtes ne dépend pas de la taille du panier.
+    """
+    products = Product.objects.filter(pk__in=lines, is_active=True).order_by().values_list(
+        'pk', 'price', 'stock_quantity'
+    )
+    existing = {
+        product_id: (pk, quantity)
+        for pk, product_id, quantity in cart.items.filter(product_id__in=lines).values_list(
+            'pk', 'product_id', 'quantity'
+        )
+    }
+    merged = []
+    for product_id, price, stock_quantity in products:
+        pk, quantity = existing.get(product_id, (None, 0))
+        quantity += lines[product_id]
+        if stock_quantity:
+            quantity = min(quantity, stock_quantity)
+        merged.append(CartItem(pk=pk, cart=cart, product_id=product_id, quantity=quantity, price=price))
+    if not merged:
+        return
+
+    with transaction.atomic():
+        if connection.features.supports_update_conflicts_with_target:
+            for item in merged:
+                item.pk = None
+            CartItem.objects.bulk_create(
+                merged, update_conflicts=True,
+                unique_fields=['cart', 'product'], update_fields=['quantity', 'price', 'updated_at']
+            )
+        else:
+            CartItem.objects.bulk_create([item for item in merged if item.pk is None])
+            CartItem.objects.bulk_update([item for item in merged if item.pk], ['quantity', 'price'])
+        # Les opérations groupées n'émettent pas post_save: totaux recalculés une fois
+        Cart.refresh_totals(cart.pk)
+
+
+def materialize_session_cart(request, cart=None, user=None):
+    """
+    Écrit le panier de session dans le panier de l'utilisateur connecté (à la
+    commande ou à la connexion, où `user` est fourni par le signal), puis vide la session.
+    """
+    session_cart = SessionCart(request.session)
+    if cart is None:
+        if not session_cart:
+            return None
+        cart, _ = Cart.objects.get_or_create(user=user or request.user)
+    if not session_cart:
+        return cart
+
+    merge_cart_lines(cart, session_cart.lines)
+    session_cart.clear()
+    cart.reload_totals()
+    return cart
+
+
+def parse_cart_operations(operations):
+    """
+    Valide une liste d'opérations [{'op': 'add'|'set'|'remove', 'product_id': 3, 'quantity': 2}]
+    et la retourne sous forme de tuples (op, product_id, quantité).
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValidationError("Aucune opération à appliquer")
+    if len(operations) > MAX_CART_OPERATIONS:
+        raise ValidationError(f"Au plus {MAX_CART_OPERATIONS} opérations par requête")
+    parsed = []
+    for operation in operations:
+        try:
+            op = operation['op']
+            product_id = int(operation['product_id'])
+            quantity = int(operation.get('quantity', 1 if op == 'add' else 0))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValidationError("Opération invalide")
+        if op not in CART_OPERATIONS or quantity < 0 or (op == 'add' and quantity < 1):
+            raise ValidationError("Opération invalide")
+        parsed.append((op, product_id, quantity))
+    return parsed
+
+
+def resolve_quantities(current, operations):
+    """Quantités finales par produit après application des opérations, dans l'ordre"""
+    quantities = {}
+    for op, product_id, quantity in operations:
+        previous = quantities.get(product_id, current.get(product_id, 0))
+        if op == 'add':
+            quantities[product_id] = previous + quantity
+        elif op == 'set':
+            quantities[product_id] = quantity
+        else:
+            quantities[product_id] = 0
+    return quantities
+
+
+def check_stock(quantities):
+    """
+    Vérifie disponibilité et stock de tous les produits concernés en une requête.
+    Retourne {product_id: prix} des produits conservés; lève ValidationError sinon.
+    """
+    products = {
+        pk: (price, in_stock, stock_quantity)
+        for pk, price, in_stock, stock_quantity in Product.objects.filter(
+            pk__in=[pk for pk, quantity in quantities.items() if quantity], is_active=True
+        ).order_by().values_list('pk', 'price', 'in_stock', 'stock_quantity')
+    }
+    errors = []
+    for product_id, quantity in quantities.items():
+        if not quantity:
+            continue
+        if product_id not in products:
+            errors.append({'product_id': product_id, 'message': "Ce produit n'est pas disponible"})
+            continue
+        _, in_stock, stock_quantity = products[product_id]
+        if not in_stock or stock_quantity == 0:
+            errors.append({'product_id': product_id, 'message': "Ce produit n'est pas disponible"})
+        elif stock_quantity and quantity > stock_quantity:
+            errors.append({
+                'product_id': product_id,
+                'message': "Quantité demandée supérieure au stock disponible",
+                'available_quantity': stock_quantity,
+            })
+    if errors:
+        raise ValidationError("Certains articles ne peuvent pas être mis à jour", params={'errors': errors})
+    return {pk: price for pk, (price, _, _) in products.items()}
+
+
+def apply_cart_operations(cart, operations):
+    """
+    Applique un lot d'opérations au panier, tout ou rien.
+
+    Panier en base: lecture des lignes et des stocks (deux requêtes), puis dans une
+    seule transaction une insertion groupée, une mise à jour groupée, une suppression
+    et un recalcul des totaux. Panier de session: aucune écriture en base.
+    Retourne {product_id: quantité finale} pour les produits concernés.
+    """
+    if isinstance(cart, SessionCart):
+        quantities = resolve_quantities(cart.lines, operations)
+        check_stock(quantities)
+        for product_id, quantity in quantities.items():
+            if quantity:
+                cart.lines[product_id] = quantity
+            else:
+                cart.lines.pop(product_id, None)
+        cart.save()
+        return quantities
+
+    product_ids = {product_id for _, product_id, _ in operations}
+    existing = {item.product_id: item for item in cart.items.filter(product_id__in=product_ids)}
+    quantities = resolve_quantities(
+        {product_id: item.quantity for product_id, item in existing.items()}, operations
+    )
+    prices = check_stock(quantities)
+
+    new_items, updated_items, removed_ids = [], [], []
+    for product_id, quantity in quantities.items():
+        item = existing.get(product_id)
+        if not quantity:
+            if item is not None:
+                removed_ids.append(item.pk)
+        elif item is None:
+            new_items.append(CartItem(cart=cart, product_id=product_id, quantity=quantity, price=prices[product_id]))
+        elif (item.quantity, item.price) != (quantity, prices[product_id]):
+            item.quantity, item.price = quantity, prices[product_id]
+            updated_items.append(item)
+
+    with transaction.atomic():
+        CartItem.objects.bulk_create(new_items)
+        CartItem.objects.bulk_update(updated_items, ['quantity', 'price'])
+        if removed_ids:
+            # post_delete est émis par article: recalcul différé à la fin du lot
+            with deferred_cart_totals():
+                CartItem.objects.filter(pk__in=removed_ids).delete()
+        # Les opérations groupées n'émettent pas post_save: totaux recalculés une fois
+        Cart.refresh_totals(cart.pk)
+    cart.reload_totals()
+    return quantities
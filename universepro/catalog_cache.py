@@ -0,0 +1,87 @@
+# universepro/catalog_cache.py
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# Durée de vie d'une page assemblée (la version du catalogue invalide avant expiration)
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+# Durée maximale d'une reconstruction avant que le verrou ne soit considéré comme perdu
+REBUILD_LOCK_TIMEOUT = 30
+REBUILD_WAIT = 2.0
+
+
+def get_version(key):
+    """
+    Compteur de version partagé (cache commun à tous les processus, voir settings.CACHES):
+    les données dérivées sont indexées par sa valeur
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def incr_version(key):
+    """Incrémente un compteur de version immédiatement et retourne sa nouvelle valeur"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        return 1
+
+
+def bump_version(key):
+    """Incrémente un compteur de version après validation de la transaction"""
+    transaction.on_commit(lambda: incr_version(key))
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalide toutes les données de catalogue en cache (après validation de la transaction)"""
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def get_catalog_data(name, builder, timeout=CATALOG_CACHE_TIMEOUT):
+    """
+    Retourne `builder()` mis en cache pour la version courante du catalogue.
+
+    Protection contre l'effet de meute: après une invalidation, un seul worker obtient
+    le verrou et reconstruit; les autres servent la version précédente (`:stale`) au
+    lieu de relancer les mêmes requêtes. Sans version précédente (cache froid), ils
+    attendent brièvement le résultat du worker qui reconstruit.
+    """
+    key = f'{name}:v{get_catalog_version()}'
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    lock_key = f'{key}:lock'
+    stale_key = f'{name}:stale'
+    if cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT):
+        try:
+            data = builder()
+            cache.set(key, data, timeout)
+            cache.set(stale_key, data, None)
+        finally:
+            cache.delete(lock_key)
+        return data
+
+    data = cache.get(stale_key)
+    if data is not None:
+        return data
+
+    deadline = time.monotonic() + REBUILD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return builder()
@@ -1,26 +1,25 @@
 # universepro/context_processors.py
+from django.utils.functional import SimpleLazyObject
+
+from .cart import SessionCart
 from .models import Cart, SiteSetting
 
 def cart_context(request):
-    """Context processor pour le panier"""
-    cart_items = []
-    cart_total = 0
-    cart_count = 0
-    
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = cart.items.all()
-            # Calculate total by summing all items' totals
-            cart_total = sum(item.product.price * item.quantity for item in cart_items)
-            cart_count = cart.items.count()
-        except Cart.DoesNotExist:
-            pass
+    """Context processor pour le panier (résumé dénormalisé ou session, sans parcours des articles)"""
+    if not request.user.is_authenticated:
+        # Panier anonyme en session: compteurs sans requête, sous-total seulement si affiché
+        session_cart = SessionCart(request.session)
+        return {
+            'cart_total': SimpleLazyObject(lambda: session_cart.subtotal),
+            'cart_count': session_cart.item_count,
+            'cart_quantity': session_cart.quantity_total,
+        }
     
+    summary = Cart.objects.filter(user=request.user).values('item_count', 'quantity_total', 'subtotal').first() or {}
     return {
-        'cart_items': cart_items,
-        'cart_total': cart_total,
-        'cart_count': cart_count,
+        'cart_total': summary.get('subtotal', 0),
+        'cart_count': summary.get('item_count', 0),
+        'cart_quantity': summary.get('quantity_total', 0),
     }
 
 def site_settings(request):
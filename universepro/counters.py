@@ -0,0 +1,128 @@
+# universepro/counters.py
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, TrendingProduct
+
+
+logger = logging.getLogger(__name__)
+
+# Délai maximal (secondes) avant écriture des compteurs accumulés
+COUNTER_FLUSH_INTERVAL = getattr(settings, 'COUNTER_FLUSH_INTERVAL', 30)
+# Nombre de clés (produit, jour) au-delà duquel on écrit sans attendre le délai
+COUNTER_FLUSH_SIZE = getattr(settings, 'COUNTER_FLUSH_SIZE', 1000)
+
+COUNTED_FIELDS = ('views', 'clicks', 'cart_adds')
+
+
+class CounterBuffer:
+    """
+    Tampon en mémoire (par processus) des vues, clics et ajouts au panier.
+
+    Les requêtes n'écrivent plus de compteurs en base: elles incrémentent un Counter protégé
+    par un verrou. Le tampon est vidé périodiquement vers TrendingProduct (ligne
+    'daily') par des upserts groupés avec incréments F(), sans course sur la
+    contrainte d'unicité. Chaque processus vide son propre tampon; les incréments
+    s'additionnent en base. Au pire, un arrêt brutal perd COUNTER_FLUSH_INTERVAL
+    secondes de compteurs, ce qui est acceptable pour des statistiques de tendance.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.last_flush = time.monotonic()
+
+    def add(self, product_id, field, amount=1):
+        key = (product_id, timezone.localdate(), field)
+        with self.lock:
+            self.counts[key] += amount
+
+    def is_due(self):
+        return bool(self.counts) and (
+            len(self.counts) >= COUNTER_FLUSH_SIZE
+            or time.monotonic() - self.last_flush >= COUNTER_FLUSH_INTERVAL
+        )
+
+    def take(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.last_flush = time.monotonic()
+        return counts
+
+    def restore(self, counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def flush(self):
+        """Écrit les compteurs accumulés; en cas d'erreur ils sont remis dans le tampon"""
+        counts = self.take()
+        if not counts:
+            return 0
+        try:
+            write_counts(counts)
+        except Exception:
+            logger.exception("Échec de l'écriture des compteurs produits")
+            self.restore(counts)
+            return 0
+        return len(counts)
+
+
+def write_counts(counts):
+    """
+    Upsert groupé: une insertion (ignore_conflicts) des lignes manquantes, puis un
+    UPDATE par combinaison (jour, +vues, +clics, +ajouts) au lieu d'une écriture par produit.
+    """
+    totals = defaultdict(lambda: dict.fromkeys(COUNTED_FIELDS, 0))
+    for (product_id, day, field), amount in counts.items():
+        totals[(product_id, day)][field] += amount
+
+    existing = set(Product.objects.filter(
+        pk__in={product_id for product_id, _ in totals}
+    ).order_by().values_list('pk', flat=True))
+
+    groups = defaultdict(list)
+    for (product_id, day), increments in totals.items():
+        if product_id in existing:
+            groups[(day,) + tuple(increments[field] for field in COUNTED_FIELDS)].append(product_id)
+
+    with transaction.atomic():
+        TrendingProduct.objects.bulk_create([
+            TrendingProduct(product_id=product_id, period='daily', date=key[0])
+            for key, product_ids in groups.items() for product_id in product_ids
+        ], ignore_conflicts=True)
+        for (day, *increments), product_ids in groups.items():
+            TrendingProduct.objects.filter(
+                period='daily', date=day, product_id__in=product_ids
+            ).update(updated_at=timezone.now(), **{
+                field: F(field) + amount
+                for field, amount in zip(COUNTED_FIELDS, increments) if amount
+            })
+
+
+buffer = CounterBuffer()
+
+
+def record_view(product_id):
+    buffer.add(product_id, 'views')
+
+
+def record_click(product_id):
+    buffer.add(product_id, 'clicks')
+
+
+def record_cart_add(product_id):
+    """Ajout au panier compté à part: les lignes du panier disparaissent à la commande"""
+    buffer.add(product_id, 'cart_adds')
+
+
+def flush_counters(force=False):
+    if force or buffer.is_due():
+        return buffer.flush()
+    return 0
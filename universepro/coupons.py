@@ -0,0 +1,188 @@
+# universepro/coupons.py
+import hashlib
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import chain
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import Coupon
+from .promotions import bump_promotions_version
+
+
+# Sans caractères ambigus (0/O, 1/I/L)
+CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+CODE_LENGTH = 10
+CAMPAIGN_CHUNK_SIZE = 5000
+# Délai entre deux vérifications du filtre en base (codes créés par les autres processus)
+CODE_FILTER_PROBE_INTERVAL = 30
+# Recul de la fenêtre de rattrapage, au-delà de la durée d'un lot de campagne
+CODE_FILTER_SYNC_MARGIN = timedelta(minutes=2)
+# Champs recopiés du coupon modèle vers chaque code généré
+TEMPLATE_FIELDS = (
+    'description', 'discount_type', 'discount_value', 'min_order_amount', 'max_discount_amount',
+    'valid_from', 'valid_to', 'max_uses', 'max_uses_per_user', 'is_active',
+)
+
+
+def random_code(prefix='', length=CODE_LENGTH):
+    return prefix + ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def fresh_codes(count, prefix, length, seen):
+    """
+    `count` codes jamais vus, vérifiés par ensembles: collisions internes écartées
+    par `seen`, collisions avec la base par une seule requête IN pour tout le lot.
+    """
+    codes = set()
+    while len(codes) < count:
+        candidates = set()
+        while len(candidates) < count - len(codes):
+            code = random_code(prefix, length)
+            if code not in seen:
+                candidates.add(code)
+        seen.update(candidates)
+        candidates -= set(Coupon.objects.filter(code__in=candidates).values_list('code', flat=True))
+        codes |= candidates
+    return codes
+
+
+def generate_campaign(template, count, prefix='', length=CODE_LENGTH, chunk_size=CAMPAIGN_CHUNK_SIZE):
+    """
+    Crée `count` coupons à codes uniques aléatoires sur le modèle de `template`
+    (remise, validité, limites, produits et catégories ciblés), par lots bulk_create.
+    Retourne le nombre de coupons créés.
+    """
+    values = {field: getattr(template, field) for field in TEMPLATE_FIELDS}
+    product_ids = list(template.products.values_list('id', flat=True))
+    category_ids = list(template.categories.values_list('id', flat=True))
+    products_through = Coupon.products.through
+    categories_through = Coupon.categories.through
+
+    seen = set()
+    created = 0
+    while created < count:
+        codes = fresh_codes(min(chunk_size, count - created), prefix, length, seen)
+        try:
+            with transaction.atomic():
+                coupons = Coupon.objects.bulk_create([
+                    Coupon(code=code, template=template, **values) for code in codes
+                ])
+                if not connection.features.can_return_rows_from_bulk_insert:
+                    coupons = list(Coupon.objects.filter(code__in=codes).only('pk'))
+                products_through.objects.bulk_create([
+                    products_through(coupon_id=coupon.pk, product_id=product_id)
+                    for coupon in coupons for product_id in product_ids
+                ], batch_size=chunk_size)
+                categories_through.objects.bulk_create([
+                    categories_through(coupon_id=coupon.pk, category_id=category_id)
+                    for coupon in coupons for category_id in category_ids
+                ], batch_size=chunk_size)
+        except IntegrityError:
+            # Code créé entre-temps par un autre processus: lot entièrement retiré
+            continue
+        created += len(coupons)
+
+    # bulk_create n'émet pas post_save: index à recharger, filtre des codes à vérifier
+    bump_promotions_version()
+    transaction.on_commit(code_filter.expire)
+    return created
+
+
+def code_hash(code):
+    return int.from_bytes(hashlib.blake2b(code.encode(), digest_size=8).digest(), 'big')
+
+
+def contains(hashes, target):
+    position = bisect_left(hashes, target)
+    return position < len(hashes) and hashes[position] == target
+
+
+class CodeFilter:
+    """
+    Filtre des codes en mémoire (par processus): tableau trié d'empreintes 64 bits,
+    recherche par bisect. 8 octets par code (~800 Ko pour 100 000 codes).
+
+    Contient tous les codes non expirés, actifs ou non (un coupon réactivé ne doit
+    pas être refusé): un code absent n'existe pas et peut être refusé sans requête.
+    Faux positifs quasi nuls (collision 64 bits), la base reste consultée pour les
+    codes présents.
+
+    Fraîcheur fondée sur la base, visible de tous les processus: au plus toutes les
+    CODE_FILTER_PROBE_INTERVAL secondes, une requête indexée lit les coupons créés
+    ou modifiés depuis le dernier chargement (updated_at, fixé aussi par bulk_create)
+    et les ajoute au tableau, sans rechargement complet. Entre deux vérifications,
+    aucune requête ni lecture du cache: un code créé par un autre processus est
+    refusé au plus CODE_FILTER_PROBE_INTERVAL secondes. Le processus qui crée ou
+    modifie des coupons vérifie dès l'appel suivant (expire()). Les codes supprimés ou
+    expirés restent jusqu'au prochain chargement complet: faux positifs sans effet.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hashes = array('Q')
+        self.updated_at = None
+        self.checked_at = 0.0
+
+    def load(self):
+        """Chargement complet (démarrage du processus)"""
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        now = timezone.now()
+        latest = None
+        hashes = []
+        for code, updated_at in Coupon.objects.filter(valid_to__gte=now).values_list(
+            'code', 'updated_at'
+        ).iterator(chunk_size=10000):
+            hashes.append(code_hash(code))
+            latest = updated_at if latest is None or updated_at > latest else latest
+        self.hashes = array('Q', sorted(hashes))
+        self.updated_at = latest or now
+        self.checked_at = time.monotonic()
+
+    def _refresh(self):
+        """
+        Ajoute les codes créés ou modifiés depuis le dernier chargement (une requête).
+        Fenêtre reculée de CODE_FILTER_SYNC_MARGIN: un lot de campagne reçoit son
+        updated_at à l'insertion mais n'est validé qu'à la fin de sa transaction,
+        parfois après une modification plus récente déjà lue. Les codes relus dans
+        la marge sont déjà présents et ne sont pas ajoutés deux fois.
+        """
+        rows = list(Coupon.objects.filter(
+            updated_at__gte=self.updated_at - CODE_FILTER_SYNC_MARGIN
+        ).values_list('code', 'updated_at'))
+        hashes = self.hashes
+        added = [value for value in {code_hash(code) for code, _ in rows} if not contains(hashes, value)]
+        if added:
+            # Tableau déjà trié: tri quasi linéaire
+            self.hashes = array('Q', sorted(chain(hashes, added)))
+        if rows:
+            self.updated_at = max(self.updated_at, *(updated_at for _, updated_at in rows))
+        self.checked_at = time.monotonic()
+
+    def expire(self):
+        """Coupons modifiés par ce processus: vérification en base au prochain appel"""
+        self.checked_at = 0.0
+
+    def ensure_fresh(self):
+        with self.lock:
+            if self.updated_at is None:
+                self._load()
+            elif time.monotonic() - self.checked_at > CODE_FILTER_PROBE_INTERVAL:
+                self._refresh()
+
+    def might_exist(self, code):
+        if not code:
+            return False
+        self.ensure_fresh()
+        return contains(self.hashes, code_hash(code))
+
+
+code_filter = CodeFilter()
@@ -0,0 +1,140 @@
+# universepro/facets.py
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.http import QueryDict
+
+from .models import ProductColor
+
+
+# Tranches de prix proposées (FCFA): clé, libellé, borne basse incluse, borne haute exclue
+PRICE_RANGES = [
+    ('0-10000', 'Moins de 10 000', None, 10000),
+    ('10000-50000', '10 000 - 50 000', 10000, 50000),
+    ('50000-100000', '50 000 - 100 000', 50000, 100000),
+    ('100000-250000', '100 000 - 250 000', 100000, 250000),
+    ('250000-', 'Plus de 250 000', 250000, None),
+]
+RATING_BUCKETS = (5, 4, 3, 2, 1)
+AVAILABILITY_CHOICES = ('in_stock', 'on_sale')
+# Paramètres GET qui restreignent la liste (et donc le jeu de facettes)
+FILTER_PARAMS = ('price', 'min_price', 'max_price', 'color', 'rating', 'availability')
+
+
+def _values(params, name):
+    """Valeurs d'un paramètre multiple: ?rating=4,3 ou ?rating=4&rating=3"""
+    values = []
+    for raw in params.getlist(name):
+        values += [value.strip() for value in raw.split(',') if value.strip()]
+    return values
+
+
+def _decimal(value):
+    try:
+        return Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def _price_q(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+IN_STOCK_Q = Q(in_stock=True, stock_quantity__gt=0)
+ON_SALE_Q = Q(original_price__gt=F('price'))
+
+
+def parse_filters(params):
+    """Filtres actifs normalisés (les valeurs invalides sont ignorées)"""
+    ranges = {key for key, _, _, _ in PRICE_RANGES}
+    ratings = [int(value) for value in _values(params, 'rating') if value in {'1', '2', '3', '4', '5'}]
+    return {
+        'price': [value for value in _values(params, 'price') if value in ranges],
+        'min_price': _decimal(params.get('min_price')),
+        'max_price': _decimal(params.get('max_price')),
+        'color': sorted({ProductColor.normalize(value) for value in _values(params, 'color')}),
+        'rating': min(ratings) if ratings else None,
+        'availability': [value for value in _values(params, 'availability') if value in AVAILABILITY_CHOICES],
+    }
+
+
+def has_filters(filters):
+    return any(value not in (None, []) for value in filters.values())
+
+
+def apply_filters(queryset, filters):
+    """Restreint le queryset produit aux filtres de `parse_filters()`"""
+    if filters['price']:
+        condition = Q()
+        for key, _, low, high in PRICE_RANGES:
+            if key in filters['price']:
+                condition |= _price_q(low, high)
+        queryset = queryset.filter(condition)
+    if filters['min_price'] is not None:
+        queryset = queryset.filter(price__gte=filters['min_price'])
+    if filters['max_price'] is not None:
+        queryset = queryset.filter(price__lte=filters['max_price'])
+    if filters['color']:
+        # Index des couleurs: EXISTS indexé au lieu d'un parcours du JSON
+        queryset = queryset.filter(Exists(
+            ProductColor.objects.filter(product=OuterRef('pk'), color__in=filters['color'])
+        ))
+    if filters['rating']:
+        queryset = queryset.filter(rating__gte=filters['rating'])
+    if 'in_stock' in filters['availability']:
+        queryset = queryset.filter(IN_STOCK_Q)
+    if 'on_sale' in filters['availability']:
+        queryset = queryset.filter(ON_SALE_Q)
+    return queryset
+
+
+def compute_facets(queryset, filters=None):
+    """
+    Compteurs de facettes pour le jeu de résultats courant, en deux requêtes quel que
+    soit le nombre de valeurs: un agrégat conditionnel (prix, notes, disponibilité)
+    et un GROUP BY sur l'index des couleurs.
+    """
+    filters = filters or parse_filters(QueryDict())
+    queryset = queryset.order_by()
+
+    aggregates = {'total': Count('pk')}
+    for key, _, low, high in PRICE_RANGES:
+        aggregates[f'price_{key}'] = Count('pk', filter=_price_q(low, high))
+    for value in RATING_BUCKETS:
+        aggregates[f'rating_{value}'] = Count('pk', filter=Q(rating__gte=value))
+    aggregates['in_stock'] = Count('pk', filter=IN_STOCK_Q)
+    aggregates['on_sale'] = Count('pk', filter=ON_SALE_Q)
+    counts = queryset.aggregate(**aggregates)
+
+    colors = (
+        ProductColor.objects
+        .filter(product__in=queryset.values('pk'))
+        .values('color')
+        .annotate(count=Count('product'))
+        .order_by('-count', 'color')
+    )
+
+    return {
+        'total': counts['total'],
+        'price': [
+            {'key': key, 'label': label, 'count': counts[f'price_{key}'], 'selected': key in filters['price']}
+            for key, label, _, _ in PRICE_RANGES
+        ],
+        'rating': [
+            {'value': value, 'count': counts[f'rating_{value}'], 'selected': filters['rating'] == value}
+            for value in RATING_BUCKETS
+        ],
+        'colors': [
+            {'value': row['color'], 'count': row['count'], 'selected': row['color'] in filters['color']}
+            for row in colors
+        ],
+        'availability': [
+            {'value': value, 'count': counts[value], 'selected': value in filters['availability']}
+            for value in AVAILABILITY_CHOICES
+        ],
+    }
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from universepro.similarity import build_similarities, SIMILARITY_TOP_K
+
+
+class Command(BaseCommand):
+    help = "Recalcule les produits similaires (co-achat, co-panier, co-sauvegarde) à planifier en cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=SIMILARITY_TOP_K)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        total = build_similarities(options['top_k'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} liens de similarité écrits en {time.monotonic() - start:.1f}s"
+        ))
@@ -0,0 +1,19 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from universepro.trending import compute_trending
+
+
+class Command(BaseCommand):
+    help = "Calcule les classements tendance (quotidien, hebdomadaire, mensuel) à planifier en cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help="Jour de référence (AAAA-MM-JJ), aujourd'hui par défaut")
+
+    def handle(self, *args, **options):
+        stats = compute_trending(options['date'])
+        self.stdout.write(self.style.SUCCESS(
+            "Tendances: {created} créées, {updated} mises à jour, {deleted} retirées, {pruned} expirées".format(**stats)
+        ))
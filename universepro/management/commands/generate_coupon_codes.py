@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from universepro.coupons import generate_campaign, CAMPAIGN_CHUNK_SIZE, CODE_LENGTH
+from universepro.models import Coupon
+
+
+class Command(BaseCommand):
+    help = "Génère une campagne de codes uniques à partir d'un coupon modèle (remise, validité, ciblage)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('template', help="Code du coupon modèle")
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--prefix', default='', help="Préfixe des codes générés (ex: NOEL-)")
+        parser.add_argument('--length', type=int, default=CODE_LENGTH, help="Caractères aléatoires par code")
+        parser.add_argument('--chunk-size', type=int, default=CAMPAIGN_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            template = Coupon.objects.get(code=options['template'])
+        except Coupon.DoesNotExist:
+            raise CommandError(f"Coupon modèle introuvable: {options['template']}")
+        start = time.monotonic()
+        created = generate_campaign(
+            template, options['count'], options['prefix'], options['length'], options['chunk_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{created} codes générés en {time.monotonic() - start:.1f}s"
+        ))
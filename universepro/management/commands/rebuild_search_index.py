@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from universepro.models import Product
+from universepro.search import get_backend, INDEXED_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Reconstruit entièrement l'index de recherche plein texte des produits"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        batch_size = options['batch_size']
+        products = Product.objects.only('id', *INDEXED_FIELDS).order_by('id')
+        total = 0
+
+        with transaction.atomic():
+            backend.clear()
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    backend.index_products(batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                backend.index_products(batch)
+                total += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"{total} produits indexés ({backend.__class__.__name__})"))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from universepro.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Libère les réservations de stock expirées (paiements abandonnés) à planifier en cron"
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(
+            f"{released} réservations libérées en {time.monotonic() - start:.1f}s"
+        ))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0003_alter_trendingproduct_rank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_data', models.JSONField()),
+                ('response_data', models.JSONField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_attempts', to='universepro.order')),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+    ]
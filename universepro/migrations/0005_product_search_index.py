@@ -0,0 +1,52 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS universepro_product_fts USING fts5("
+    "name, short_description, description, sku, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO universepro_product_fts (rowid, name, short_description, description, sku) "
+    "SELECT id, name, short_description, description, COALESCE(sku, '') FROM universepro_product",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS universepro_product_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE IF NOT EXISTS universepro_product_search ("
+    "product_id bigint PRIMARY KEY REFERENCES universepro_product (id) ON DELETE CASCADE, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS universepro_product_search_document_gin "
+    "ON universepro_product_search USING GIN (document)",
+    "INSERT INTO universepro_product_search (product_id, document) "
+    "SELECT id, "
+    "setweight(to_tsvector('french', name), 'A') || "
+    "setweight(to_tsvector('french', short_description), 'B') || "
+    "setweight(to_tsvector('french', description), 'C') || "
+    "setweight(to_tsvector('simple', COALESCE(sku, '')), 'A') "
+    "FROM universepro_product",
+]
+POSTGRES_BACKWARD = [
+    "DROP TABLE IF EXISTS universepro_product_search",
+]
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0004_paymentattempt'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_statements({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:16
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_sort_keys(apps, schema_editor):
+    Product = apps.get_model('universepro', 'Product')
+    ProductReview = apps.get_model('universepro', 'ProductReview')
+    OrderItem = apps.get_model('universepro', 'OrderItem')
+
+    approved = ProductReview.objects.filter(product=OuterRef('pk'), is_approved=True).values('product')
+    sold = OrderItem.objects.filter(product=OuterRef('pk')).values('product')
+    Product.objects.update(
+        rating=Coalesce(Subquery(approved.annotate(avg=Avg('rating')).values('avg')), Value(0.0)),
+        reviews_count=Coalesce(Subquery(approved.annotate(total=Count('id')).values('total')), Value(0)),
+        sales_count=Coalesce(Subquery(sold.annotate(total=Sum('quantity')).values('total')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sales_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', '-rating', '-id'], name='product_cat_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', '-reviews_count', '-id'], name='product_cat_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', '-sales_count', '-id'], name='product_cat_sales_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', 'price', 'id'], name='product_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', '-created_at', '-id'], name='product_cat_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', '-rating', '-id'], name='product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', '-reviews_count', '-id'], name='product_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', '-sales_count', '-id'], name='product_sales_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='product_newest_idx'),
+        ),
+        migrations.RunPython(backfill_sort_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:18
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Category = apps.get_model('universepro', 'Category')
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    # Parcours en largeur depuis les racines
+    level = [(category, '') for category in children.get(None, [])]
+    depth = 0
+    while level:
+        next_level = []
+        for category, parent_path in level:
+            category.path = f"{parent_path}{category.pk:08d}/"
+            category.depth = depth
+            next_level += [(child, category.path) for child in children.get(category.pk, [])]
+        level = next_level
+        depth += 1
+    Category.objects.bulk_update(categories, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0006_product_sort_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
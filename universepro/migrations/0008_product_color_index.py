@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_colors(apps, schema_editor):
+    Product = apps.get_model('universepro', 'Product')
+    ProductColor = apps.get_model('universepro', 'ProductColor')
+    rows = []
+    for product_id, colors in Product.objects.values_list('id', 'colors'):
+        normalized = {str(color).strip().capitalize() for color in (colors or []) if str(color).strip()}
+        rows += [ProductColor(product_id=product_id, color=color) for color in sorted(normalized)]
+    ProductColor.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0007_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductColor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('color', models.CharField(max_length=50)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='color_index', to='universepro.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['color', 'product'], name='productcolor_color_idx')],
+                'unique_together': {('product', 'color')},
+            },
+        ),
+        migrations.RunPython(backfill_colors, migrations.RunPython.noop),
+    ]
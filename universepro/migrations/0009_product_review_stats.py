@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_stats(apps, schema_editor):
+    ProductReview = apps.get_model('universepro', 'ProductReview')
+    ProductReviewStats = apps.get_model('universepro', 'ProductReviewStats')
+    stats = {}
+    rows = (
+        ProductReview.objects.filter(is_approved=True).order_by()
+        .values_list('product_id', 'rating').annotate(count=models.Count('id'))
+    )
+    for product_id, rating, count in rows:
+        record = stats.setdefault(product_id, ProductReviewStats(product_id=product_id))
+        setattr(record, f'rating_{rating}', count)
+        record.total += count
+        record.average += rating * count
+    for record in stats.values():
+        record.average /= record.total
+    ProductReviewStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0008_product_color_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductReviewStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_stats', serialize=False, to='universepro.product')),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
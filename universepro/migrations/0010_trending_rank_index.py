@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0009_product_review_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trendingproduct',
+            index=models.Index(fields=['period', 'date', 'rank'], name='trending_rank_idx'),
+        ),
+    ]
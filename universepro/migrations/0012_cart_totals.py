@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:32
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model('universepro', 'Cart')
+    CartItem = apps.get_model('universepro', 'CartItem')
+    items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        item_count=Coalesce(models.Subquery(items.annotate(total=models.Count('id')).values('total')), 0),
+        quantity_total=Coalesce(models.Subquery(items.annotate(total=models.Sum('quantity')).values('total')), 0),
+        subtotal=Coalesce(
+            models.Subquery(items.annotate(total=models.Sum(models.F('price') * models.F('quantity'))).values('total')),
+            models.Value(Decimal('0.00')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0011_product_similarity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='quantity_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
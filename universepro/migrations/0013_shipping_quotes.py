@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:43
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_weight(apps, schema_editor):
+    Cart = apps.get_model('universepro', 'Cart')
+    CartItem = apps.get_model('universepro', 'CartItem')
+    items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        weight_total=Coalesce(
+            models.Subquery(items.annotate(
+                total=models.Sum(models.F('product__weight') * models.F('quantity'))
+            ).values('total')),
+            models.Value(Decimal('0.00')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0012_cart_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='weight_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='shippingmethod',
+            name='max_weight',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='shippingmethod',
+            name='price_per_kg',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.RunPython(backfill_weight, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0014_coupon_redemptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='auto_apply',
+            field=models.BooleanField(default=False),
+        ),
+    ]
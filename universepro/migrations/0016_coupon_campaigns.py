@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0015_coupon_auto_apply'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='generated_codes', to='universepro.coupon'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:52
+
+from django.db import migrations, models
+
+
+def start_order_numbers(apps, schema_editor):
+    """Le compteur reprend après le plus grand numéro existant (CMD-000123) ou id de commande"""
+    Order = apps.get_model('universepro', 'Order')
+    Sequence = apps.get_model('universepro', 'Sequence')
+    last = Order.objects.aggregate(last=models.Max('id'))['last'] or 0
+    for number in Order.objects.filter(order_number__startswith='CMD-').values_list('order_number', flat=True).iterator():
+        suffix = number[4:]
+        if suffix.isdigit():
+            last = max(last, int(suffix))
+    Sequence.objects.update_or_create(name='order_number', defaults={'value': last})
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE SEQUENCE IF NOT EXISTS universepro_order_number_seq')
+        schema_editor.execute("SELECT setval('universepro_order_number_seq', %s, %s)", [max(last, 1), last > 0])
+
+
+def drop_order_numbers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP SEQUENCE IF EXISTS universepro_order_number_seq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0016_coupon_campaigns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(start_order_numbers, drop_order_numbers),
+    ]
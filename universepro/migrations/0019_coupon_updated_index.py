@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0018_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['updated_at'], name='coupon_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('universepro', '0020_product_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trendingproduct',
+            name='cart_adds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trendingproduct',
+            name='score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trendingproduct',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingproduct',
+            index=models.Index(fields=['updated_at'], name='trending_updated_idx'),
+        ),
+    ]
@@ -8,6 +8,7 @@ from decimal import Decimal
 
 # universepro/models.py
 from django.db import models
+from django.db.models.functions import Cast, Coalesce, Concat, Greatest, Round, Substr
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
@@ -84,6 +85,11 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     icon = models.CharField(max_length=50, blank=True, null=True)  # Pour les icônes FontAwesome
+    # Chemin matérialisé "00000001/00000004/" (ids des ancêtres puis de la catégorie)
+    path = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    PATH_STEP = 8
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -92,15 +98,127 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        if self.path and self.parent_id and self.parent.path.startswith(self.path):
+            raise ValidationError("Une catégorie ne peut pas être placée sous l'une de ses sous-catégories")
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        self.clean()
         super().save(*args, **kwargs)
+        self.update_path()
+
+    def update_path(self):
+        """Recalcule le chemin de la catégorie et, s'il a changé, celui de toute sa descendance"""
+        parent_path = self.parent.path if self.parent_id else ''
+        path = f"{parent_path}{self.pk:0{self.PATH_STEP}d}/"
+        if path == self.path:
+            return
+        old_path, old_depth = self.path, self.depth
+        depth = path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if old_path:
+            # Une seule requête pour réécrire le préfixe de tous les descendants
+            Category.objects.filter(self.subtree_q(path=old_path)).exclude(pk=self.pk).update(
+                path=Concat(models.Value(path), Substr('path', len(old_path) + 1)),
+                depth=models.F('depth') + (depth - old_depth),
+            )
+        self.path, self.depth = path, depth
+
+    def subtree_q(self, prefix='', path=None):
+        """
+        Condition "dans le sous-arbre de cette catégorie" (catégorie incluse), sous forme
+        d'intervalle sur le chemin pour rester une lecture d'index: '/' précède '0'.
+        Ex: Product.objects.filter(category.subtree_q('category__'))
+        """
+        path = path or self.path
+        return models.Q(**{
+            f'{prefix}path__gte': path,
+            f'{prefix}path__lt': path[:-1] + '0',
+        })
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(self.subtree_q())
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def get_ancestor_ids(self, include_self=False):
+        ids = [int(part) for part in self.path.split('/') if part]
+        return ids if include_self else ids[:-1]
+
+    def get_ancestors(self, include_self=False):
+        """Ancêtres de la racine vers la catégorie (fil d'Ariane), en une requête"""
+        return Category.objects.filter(id__in=self.get_ancestor_ids(include_self)).order_by('depth')
+
+    @classmethod
+    def get_tree(cls):
+        """
+        Arbre des catégories actives pour les menus, construit à partir d'une seule requête.
+        Chaque noeud reçoit un attribut `tree_children`; retourne la liste des racines.
+        """
+        nodes = {}
+        roots = []
+        for category in cls.objects.filter(is_active=True).order_by('path'):
+            category.tree_children = []
+            nodes[category.pk] = category
+            if category.parent_id is None:
+                roots.append(category)
+            elif category.parent_id in nodes:
+                nodes[category.parent_id].tree_children.append(category)
+        for category in nodes.values():
+            category.tree_children.sort(key=lambda child: child.name)
+        return sorted(roots, key=lambda root: root.name)
 
     def get_absolute_url(self):
         return f'/category/{self.slug}/'
 
 
+class ProductQuerySet(models.QuerySet):
+    # Champs affichés par templates/products/product_card.html
+    CARD_FIELDS = (
+        'id', 'name', 'slug', 'short_description', 'price', 'original_price', 'rating',
+        'reviews_count', 'sales_count', 'in_stock', 'stock_quantity', 'featured', 'created_at',
+        'category__name',
+    )
+
+    def for_cards(self):
+        """
+        Projection "carte produit" partagée par toutes les grilles: seulement les champs
+        affichés (ni description ni couleurs), catégorie jointe, image principale et deux
+        caractéristiques préchargées (une requête chacune pour toute la grille), badge de
+        réduction calculé en SQL. Nombre de requêtes constant quelle que soit la grille.
+        """
+        return self.select_related('category').only(*self.CARD_FIELDS).prefetch_related(
+            models.Prefetch(
+                'images',
+                queryset=ProductImage.objects.order_by('-is_featured', 'order', 'id')[:1],
+                to_attr='card_images'
+            ),
+            models.Prefetch(
+                'features',
+                queryset=ProductFeature.objects.order_by('id')[:2],
+                to_attr='card_feature_list'
+            ),
+        ).annotate(
+            on_sale_badge=models.ExpressionWrapper(
+                models.Q(original_price__gt=models.F('price')),
+                output_field=models.BooleanField()
+            ),
+            discount_badge=models.Case(
+                models.When(
+                    original_price__gt=models.F('price'),
+                    then=Cast(Round(
+                        models.Value(100.0) - models.F('price') * models.Value(100.0) / models.F('original_price')
+                    ), models.IntegerField())
+                ),
+                default=models.Value(0),
+                output_field=models.IntegerField()
+            ),
+        )
+
+
 class Product(models.Model):
     COLOR_CHOICES = [
         ('Noir', 'Noir'),
@@ -132,6 +250,7 @@ class Product(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(5)]
     )
     reviews_count = models.PositiveIntegerField(default=0)
+    sales_count = models.PositiveIntegerField(default=0)  # Unités vendues, maintenu par OrderItem
     in_stock = models.BooleanField(default=True)
     stock_quantity = models.PositiveIntegerField(default=0)
     sku = models.CharField(max_length=50, unique=True, blank=True, null=True)
@@ -143,8 +262,27 @@ class Product(models.Model):
     weight = models.DecimalField(max_digits=6, decimal_places=2, default=0)  # en grammes
     dimensions = models.CharField(max_length=50, blank=True)  # "L x l x H" en cm
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        # Index composites des tris du catalogue (voir PRODUCT_SORTS dans views.py)
+        indexes = [
+            models.Index(fields=['is_active', 'category', '-rating', '-id'], name='product_cat_rating_idx'),
+            models.Index(fields=['is_active', 'category', '-reviews_count', '-id'], name='product_cat_popular_idx'),
+            models.Index(fields=['is_active', 'category', '-sales_count', '-id'], name='product_cat_sales_idx'),
+            models.Index(fields=['is_active', 'category', 'price', 'id'], name='product_cat_price_idx'),
+            models.Index(fields=['is_active', 'category', '-created_at', '-id'], name='product_cat_newest_idx'),
+            models.Index(fields=['is_active', 'category', 'name', 'id'], name='product_cat_name_idx'),
+            models.Index(fields=['is_active', '-rating', '-id'], name='product_rating_idx'),
+            models.Index(fields=['is_active', '-reviews_count', '-id'], name='product_popular_idx'),
+            models.Index(fields=['is_active', '-sales_count', '-id'], name='product_sales_idx'),
+            models.Index(fields=['is_active', 'price', 'id'], name='product_price_idx'),
+            models.Index(fields=['is_active', '-created_at', '-id'], name='product_newest_idx'),
+            models.Index(fields=['is_active', 'name', 'id'], name='product_name_idx'),
+            # Rattrapage de l'index de suggestions par les autres processus (suggest.py)
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -175,14 +313,38 @@ class Product(models.Model):
 
     def is_available(self):
         return self.in_stock and (self.stock_quantity > 0 if self.stock_quantity is not None else True)
+
+    @property
+    def card_image(self):
+        """Image principale (préchargée par for_cards(), sinon une requête)"""
+        if hasattr(self, 'card_images'):
+            return self.card_images[0] if self.card_images else None
+        return self.images.order_by('-is_featured', 'order', 'id').first()
+
+    @property
+    def card_features(self):
+        """Deux premières caractéristiques (préchargées par for_cards(), sinon une requête)"""
+        if hasattr(self, 'card_feature_list'):
+            return self.card_feature_list
+        return self.features.order_by('id')[:2]
     
     def update_average_rating(self):
         """Met à jour la note moyenne et le nombre d'avis"""
-        reviews = self.reviews.filter(is_approved=True)
-        if reviews.exists():
-            self.rating = reviews.aggregate(models.Avg('rating'))['rating__avg']
-            self.reviews_count = reviews.count()
-            self.save(update_fields=['rating', 'reviews_count'])
+        Product.refresh_rating(self.pk)
+        self.refresh_from_db(fields=['rating', 'reviews_count'])
+
+    @classmethod
+    def refresh_rating(cls, product_id):
+        """Recalcule histogramme, note et nombre d'avis approuvés (un seul agrégat groupé)"""
+        stats = ProductReviewStats.refresh(product_id)
+        cls.objects.filter(pk=product_id).update(rating=stats.average, reviews_count=stats.total)
+
+    @classmethod
+    def add_sales(cls, product_id, quantity):
+        """Ajuste le compteur de ventes (clé de tri 'best_selling'), quantité négative pour retirer"""
+        cls.objects.filter(pk=product_id).update(
+            sales_count=Greatest(models.F('sales_count') + quantity, models.Value(0))
+        )
 
 
 class ProductImage(models.Model):
@@ -209,6 +371,38 @@ class ProductFeature(models.Model):
         return f"{self.name}: {self.value}"
 
 
+class ProductColor(models.Model):
+    """Index normalisé de `Product.colors` (filtres et facettes sans parcourir le JSON)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='color_index')
+    color = models.CharField(max_length=50)
+
+    class Meta:
+        unique_together = ['product', 'color']
+        indexes = [
+            models.Index(fields=['color', 'product'], name='productcolor_color_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.color}"
+
+    @staticmethod
+    def normalize(color):
+        return str(color).strip().capitalize()
+
+    @classmethod
+    def sync(cls, product):
+        """Aligne l'index sur la liste `colors` du produit"""
+        colors = {cls.normalize(color) for color in (product.colors or []) if str(color).strip()}
+        existing = set(cls.objects.filter(product=product).values_list('color', flat=True))
+        if existing - colors:
+            cls.objects.filter(product=product, color__in=existing - colors).delete()
+        if colors - existing:
+            cls.objects.bulk_create(
+                [cls(product=product, color=color) for color in sorted(colors - existing)],
+                ignore_conflicts=True
+            )
+
+
 class ProductReview(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -231,11 +425,43 @@ class ProductReview(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         # Mettre à jour la note moyenne du produit
-        reviews = ProductReview.objects.filter(product=self.product, is_approved=True)
-        if reviews.exists():
-            self.product.rating = reviews.aggregate(models.Avg('rating'))['rating__avg']
-            self.product.reviews_count = reviews.count()
-            self.product.save()
+        self.product.update_average_rating()
+
+
+class ProductReviewStats(models.Model):
+    """Statistiques des avis approuvés d'un produit, maintenues à chaque modification d'avis"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='review_stats')
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats des avis pour {self.product_id}"
+
+    @property
+    def histogram(self):
+        """Liste (étoiles, nombre d'avis) de 5 à 1"""
+        return [(stars, getattr(self, f'rating_{stars}')) for stars in range(5, 0, -1)]
+
+    @classmethod
+    def refresh(cls, product_id):
+        counts = dict(
+            ProductReview.objects.filter(product_id=product_id, is_approved=True)
+            .order_by()
+            .values_list('rating')
+            .annotate(count=models.Count('id'))
+        )
+        total = sum(counts.values())
+        defaults = {f'rating_{stars}': counts.get(stars, 0) for stars in range(1, 6)}
+        defaults['total'] = total
+        defaults['average'] = sum(stars * count for stars, count in counts.items()) / total if total else 0.0
+        stats, _ = cls.objects.update_or_create(product_id=product_id, defaults=defaults)
+        return stats
 
 
 class Favorite(models.Model):
@@ -271,49 +497,38 @@ class Coupon(models.Model):
     valid_to = models.DateTimeField()
     max_uses = models.PositiveIntegerField(default=1)
     current_uses = models.PositiveIntegerField(default=0)
+    # Utilisations par client, garanties par l'index unique de CouponRedemption
+    max_uses_per_user = models.PositiveIntegerField(default=1)
+    # Proposé et appliqué sans saisie du code (voir promotions.best_coupon)
+    auto_apply = models.BooleanField(default=False)
+    # Coupon modèle d'une campagne de codes générés (voir coupons.generate_campaign)
+    template = models.ForeignKey(
+        'self', on_delete=models.CASCADE, related_name='generated_codes', null=True, blank=True
+    )
     is_active = models.BooleanField(default=True)
     categories = models.ManyToManyField(Category, blank=True)
     products = models.ManyToManyField(Product, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Codes créés ou modifiés depuis le dernier chargement du filtre (voir coupons.CodeFilter)
+            models.Index(fields=['updated_at'], name='coupon_updated_idx'),
+        ]
+
     def __str__(self):
         return self.code
 
     def is_valid(self, user=None, cart=None):
-        now = timezone.now()
-        if not self.is_active:
-            return False
-        if now < self.valid_from or now > self.valid_to:
-            return False
-        if self.current_uses >= self.max_uses:
-            return False
-        
-        # Vérifier si le coupon est applicable au panier
+        # Périmètre compilé et mis en cache, panier évalué en mémoire (voir promotions.py)
+        from .promotions import evaluate_coupon, is_usable
         if cart:
-            # Vérifier le montant minimum de la commande
-            if cart.subtotal < self.min_order_amount:
-                return False
-            
-            # Vérifier les catégories ou produits spécifiques
-            if self.categories.exists() or self.products.exists():
-                valid_items = False
-                for item in cart.items.all():
-                    if self.products.filter(id=item.product.id).exists():
-                        valid_items = True
-                        break
-                    if self.categories.filter(id=item.product.category.id).exists():
-                        valid_items = True
-                        break
-                if not valid_items:
-                    return False
-        
-        return True
+            return evaluate_coupon(self, cart) is not None
+        return is_usable(self)
 
     def calculate_discount(self, amount):
-        if not self.is_valid():
-            return Decimal('0.00')
-        
+        # Validité vérifiée par l'appelant (is_valid / evaluate_coupon)
         if self.discount_type == 'percentage':
             discount = amount * (self.discount_value / Decimal('100.00'))
             if self.max_discount_amount and discount > self.max_discount_amount:
@@ -326,12 +541,10 @@ class Coupon(models.Model):
         
         return Decimal('0.00')
 
-    def use_coupon(self):
-        if self.current_uses < self.max_uses:
-            self.current_uses += 1
-            if self.current_uses >= self.max_uses:
-                self.is_active = False
-            self.save()
+    def use_coupon(self, user=None, order=None):
+        """Utilisation atomique (voir promotions.redeem_coupon): la ligne du registre, ou None si refusée"""
+        from .promotions import redeem_coupon
+        return redeem_coupon(self, user, order)
 
 
 class Cart(models.Model):
@@ -344,6 +557,15 @@ class Cart(models.Model):
     shipping_cost = models.DecimalField(max_digits=8, decimal_places=2, default=0)
     shipping_method = models.CharField(max_length=50, blank=True, null=True)
     note = models.TextField(blank=True)
+    # Résumé maintenu par refresh_totals() à chaque modification d'un CartItem
+    item_count = models.PositiveIntegerField(default=0)
+    quantity_total = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    weight_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # en grammes
+    # Incrémentée à chaque recalcul: clé des devis de livraison mémorisés
+    version = models.PositiveIntegerField(default=0)
+
+    TOTAL_FIELDS = ('item_count', 'quantity_total', 'subtotal', 'weight_total', 'version')
 
     class Meta:
         unique_together = ['user', 'session_key']
@@ -353,26 +575,69 @@ class Cart(models.Model):
             return f"Panier de {self.user.username}"
         return f"Panier session {self.session_key}"
 
-    @property
-    def subtotal(self):
-        return sum(item.total_price for item in self.items.all())
+    def save(self, *args, **kwargs):
+        # Ne jamais réécrire les totaux depuis une copie en mémoire possiblement périmée
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.TOTAL_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def refresh_totals(cls, cart_id, **fields):
+        """
+        Recalcule nombre de lignes, quantité, sous-total et poids en une seule requête UPDATE
+        (`fields`: autres colonnes écrites dans la même requête)
+        """
+        items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+        cls.objects.filter(pk=cart_id).update(
+            item_count=Coalesce(
+                models.Subquery(items.annotate(total=models.Count('id')).values('total')),
+                models.Value(0)
+            ),
+            quantity_total=Coalesce(
+                models.Subquery(items.annotate(total=models.Sum('quantity')).values('total')),
+                models.Value(0)
+            ),
+            subtotal=Coalesce(
+                models.Subquery(items.annotate(
+                    total=models.Sum(models.F('price') * models.F('quantity'))
+                ).values('total')),
+                models.Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+            weight_total=Coalesce(
+                models.Subquery(items.annotate(
+                    total=models.Sum(models.F('product__weight') * models.F('quantity'))
+                ).values('total')),
+                models.Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+            version=models.F('version') + 1,
+            **fields
+        )
+
+    def reload_totals(self):
+        self.refresh_from_db(fields=self.TOTAL_FIELDS)
 
     @property
     def total(self):
         total = self.subtotal - self.coupon_discount + self.shipping_cost
         return max(total, Decimal('0.00'))
 
-    def apply_coupon(self, coupon_code):
-        try:
-            coupon = Coupon.objects.get(code=coupon_code, is_active=True)
-            if coupon.is_valid(cart=self):
-                self.coupon = coupon
-                self.coupon_discount = coupon.calculate_discount(self.subtotal)
-                self.save()
-                return True
-        except Coupon.DoesNotExist:
-            pass
-        return False
+    def apply_coupon(self, coupon):
+        """Applique un coupon (instance ou code) si le panier y est éligible"""
+        from .promotions import evaluate_coupon
+        if isinstance(coupon, str):
+            coupon = Coupon.objects.filter(code=coupon, is_active=True).first()
+        discount = evaluate_coupon(coupon, self) if coupon else None
+        if discount is None:
+            return False
+        self.coupon = coupon
+        self.coupon_discount = discount
+        self.save(update_fields=['coupon', 'coupon_discount', 'updated_at'])
+        return True
 
     def clear_coupon(self):
         self.coupon = None
@@ -380,30 +645,16 @@ class Cart(models.Model):
         self.save()
 
     def calculate_shipping(self, address=None):
-        # Logique de calcul des frais de livraison
-        # Pourrait être basée sur le poids, la destination, etc.
-        free_shipping_threshold = Decimal('100000.00')  # 100 000 FCFA
-        base_shipping_cost = Decimal('5000.00')  # 5 000 FCFA
-        
-        if self.subtotal >= free_shipping_threshold:
-            self.shipping_cost = Decimal('0.00')
-        else:
-            self.shipping_cost = base_shipping_cost
-        
-        self.save()
-        return self.shipping_cost
+        # Devis du moteur de livraison, écrit seulement s'il a changé (voir shipping.py)
+        from .shipping import update_cart_shipping
+        return update_cart_shipping(self, address)
 
     def merge_with_session_cart(self, session_cart):
-        # Fusionner deux paniers (utilisé lorsqu'un utilisateur se connecte)
-        for session_item in session_cart.items.all():
-            item, created = self.items.get_or_create(
-                product=session_item.product,
-                defaults={'quantity': session_item.quantity}
-            )
-            if not created:
-                item.quantity += session_item.quantity
-                item.save()
+        # Fusionner deux paniers (un upsert groupé, puis une suppression du panier de session)
+        from .cart import merge_cart_lines
+        merge_cart_lines(self, dict(session_cart.items.values_list('product_id', 'quantity')))
         session_cart.delete()
+        self.reload_totals()
 
 
 class CartItem(models.Model):
@@ -472,6 +723,15 @@ class Address(models.Model):
         return f"{self.address_line1}\n{self.address_line2}\n{self.city}, {self.state}\n{self.postal_code}, {self.country}"
 
 
+class Sequence(models.Model):
+    """Compteur nommé: les processus s'en réservent des blocs (voir sequences.py)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
 class Order(models.Model):
     PAYMENT_METHOD_CHOICES = [
         ('mobile_money', 'Mobile Money'),
@@ -492,7 +752,8 @@ class Order(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     order_number = models.CharField(max_length=20, unique=True)
-    cart = models.OneToOneField(Cart, on_delete=models.PROTECT)
+    # Plusieurs commandes par panier: commandes successives, tentatives de paiement
+    cart = models.ForeignKey(Cart, on_delete=models.PROTECT, related_name='orders')
     shipping_address = models.ForeignKey(
         Address, 
         on_delete=models.PROTECT, 
@@ -521,6 +782,10 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Commandes créées ou changées de statut depuis le dernier classement (trending.py)
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Commande #{self.order_number}"
@@ -529,11 +794,9 @@ class Order(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            # Générer un numéro de commande unique
-            prefix = "CMD"
-            last_order = Order.objects.order_by('-id').first()
-            last_id = last_order.id if last_order else 0
-            self.order_number = f"{prefix}-{last_id + 1:06d}"
+            # Numéro pris dans le bloc réservé par le processus: pas de lecture, pas de collision
+            from .sequences import next_order_number
+            self.order_number = next_order_number()
         
         super().save(*args, **kwargs)
 
@@ -573,6 +836,42 @@ class OrderItem(models.Model):
         return f"{self.quantity} x {self.product.name} (Commande #{self.order.order_number})"
 
 
+class StockReservation(models.Model):
+    """Stock retenu pour une commande en attente de paiement, jusqu'à expires_at (voir reservations.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Quantité retenue par produit: somme des réservations non expirées
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} (commande {self.order_id})"
+
+
+class CouponRedemption(models.Model):
+    """Registre des utilisations de coupons: la n-ième utilisation d'un client est unique"""
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='redemptions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coupon_redemptions', null=True, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, related_name='coupon_redemptions', null=True, blank=True)
+    use_number = models.PositiveIntegerField(default=1)
+    redeemed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'user', 'use_number'], name='unique_coupon_use_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.coupon.code} #{self.use_number} ({self.user_id})"
+
+
 class Payment(models.Model):
     PAYMENT_STATUS_CHOICES = [
         ('pending', 'En attente'),
@@ -620,18 +919,24 @@ class ShippingMethod(models.Model):
         max_digits=12, decimal_places=2, 
         null=True, blank=True
     )
+    # Supplément par kilogramme entamé (poids des produits du panier)
+    price_per_kg = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    max_weight = models.DecimalField(  # en grammes, au-delà la méthode n'est pas proposée
+        max_digits=10, decimal_places=2,
+        null=True, blank=True
+    )
     estimated_delivery = models.CharField(max_length=100)  # "2-5 jours"
     is_active = models.BooleanField(default=True)
-    regions = models.JSONField(default=list)  # Liste des régions où cette méthode est disponible
+    regions = models.JSONField(default=list)  # Liste des régions où cette méthode est disponible (vide: partout)
 
     def __str__(self):
         return self.name
 
     def calculate_cost(self, cart):
-        if (self.free_shipping_threshold is not None and 
-            cart.subtotal >= self.free_shipping_threshold):
-            return Decimal('0.00')
-        return self.price
+        from .shipping import method_cost
+        return method_cost(
+            self.price, self.price_per_kg, self.free_shipping_threshold, cart.subtotal, cart.weight_total
+        )
 
 
 class Notification(models.Model):
@@ -671,18 +976,41 @@ class TrendingProduct(models.Model):
         ('monthly', 'Mensuel'),
     ])
     rank = models.PositiveIntegerField(default=0)
+    # Score du classement, repris tel quel pour les produits sans nouveau signal (voir trending.py)
+    score = models.FloatField(default=0)
     views = models.PositiveIntegerField(default=0)
     clicks = models.PositiveIntegerField(default=0)
+    cart_adds = models.PositiveIntegerField(default=0)
     date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['product', 'period', 'date']
         ordering = ['period', 'date', 'rank']
+        indexes = [
+            models.Index(fields=['period', 'date', 'rank'], name='trending_rank_idx'),
+            models.Index(fields=['updated_at'], name='trending_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.get_period_display()} - {self.date}"
 
 
+class ProductSimilarity(models.Model):
+    """Voisins les plus proches d'un produit, calculés hors ligne (voir similarity.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarities')
+    similar = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ['product', 'rank']
+        ordering = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.similar_id} ({self.score:.3f})"
+
+
 class Wishlist(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wishlist')
     products = models.ManyToManyField(Product, through='WishlistItem')
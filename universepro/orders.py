@@ -0,0 +1,207 @@
+# universepro/orders.py
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .cart import deferred_cart_totals
+from .catalog_cache import bump_catalog_version
+from .models import Cart, CartItem, Order, OrderItem, Product
+from .promotions import redeem_coupon, release_coupon_uses
+from .reservations import RESERVATION_TTL, held_quantity, release_order, reserve_stock
+
+
+# Colonnes lues pour chaque ligne (panier ou commande), produit joint
+LINE_FIELDS = ('product_id', 'product__name', 'quantity', 'price', 'product__stock_quantity')
+
+
+def stock_error(lines):
+    """Premier article indisponible ou en stock insuffisant (chemin d'erreur uniquement)"""
+    products = Product.objects.in_bulk([product_id for product_id, _, _, _, _ in lines])
+    for product_id, name, quantity, _, _ in lines:
+        product = products.get(product_id)
+        if product is None or not product.is_active or not product.is_available():
+            return ValidationError(f"{name} n'est plus disponible", code='unavailable', params={'product_id': product_id})
+        if quantity > product.stock_quantity:
+            return ValidationError(f"Stock insuffisant pour {name}", code='stock', params={'product_id': product_id})
+    return ValidationError("Le stock a changé, veuillez réessayer", code='stock')
+
+
+def consume_stock(lines, reserved_for=None):
+    """
+    Décrémente le stock de toutes les lignes en un seul UPDATE conditionnel: chaque
+    produit doit couvrir la quantité en plus des réservations actives des autres
+    commandes (celles de `reserved_for` sont converties). Lève ValidationError sinon.
+
+    Lignes produits verrouillées d'abord (dans l'ordre des ids, comme reserve_stock):
+    la sous-requête des réservations n'est pas réévaluée par PostgreSQL après
+    l'attente d'un verrou, elle doit donc voir les réservations déjà validées.
+    """
+    quantities = {product_id: quantity for product_id, _, quantity, _, _ in lines}
+    list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', flat=True))
+    held = held_quantity(exclude_order=reserved_for)
+    updated = Product.objects.filter(is_active=True, in_stock=True).filter(reduce(or_, (
+        Q(pk=product_id, stock_quantity__gte=held + quantity) for product_id, quantity in quantities.items()
+    ))).update(
+        stock_quantity=F('stock_quantity') - Case(
+            *(When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items())
+        ),
+        # Évalué avec le stock avant mise à jour
+        in_stock=Case(
+            *(When(pk=product_id, stock_quantity__gt=quantity, then=Value(True))
+              for product_id, quantity in quantities.items()),
+            default=Value(False),
+        ),
+        # bulk_create n'émet pas post_save: compteur de ventes mis à jour ici
+        sales_count=F('sales_count') + Case(
+            *(When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items())
+        ),
+    )
+    if updated != len(quantities):
+        raise stock_error(lines)
+    if any(stock <= quantity for _, _, quantity, _, stock in lines):
+        # Produit épuisé: les listes du catalogue en cache ne doivent plus le proposer
+        bump_catalog_version()
+
+
+def create_order(cart, user, shipping_address, lines, **fields):
+    """Commande et articles (insertion groupée) d'après les lignes, puis utilisation du coupon du panier"""
+    subtotal = sum((price * quantity for _, _, quantity, price, _ in lines), Decimal('0.00'))
+    order = Order.objects.create(
+        user=user,
+        cart=cart,
+        shipping_address=shipping_address,
+        billing_address=shipping_address,
+        subtotal=subtotal,
+        coupon_discount=cart.coupon_discount,
+        shipping_cost=cart.shipping_cost,
+        total=max(subtotal - cart.coupon_discount + cart.shipping_cost, Decimal('0.00')),
+        **fields
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order, product_id=product_id, quantity=quantity, price=price, total_price=price * quantity
+        )
+        for product_id, _, quantity, price, _ in lines
+    ])
+    if cart.coupon_id and redeem_coupon(cart.coupon, user, order) is None:
+        raise ValidationError("Ce code promo n'est plus disponible", code='coupon')
+    return order
+
+
+def clear_cart(cart, product_ids=None):
+    """Supprime les lignes (toutes, ou celles des produits commandés) et recalcule le panier"""
+    lines = CartItem.objects.filter(cart=cart)
+    if product_ids is not None:
+        lines = lines.filter(product_id__in=product_ids)
+    with deferred_cart_totals():
+        lines.delete()
+    # Totaux recalculés et coupon retiré en un seul UPDATE
+    Cart.refresh_totals(cart.pk, coupon=None, coupon_discount=0, shipping_cost=0)
+    cart.coupon = None
+    cart.coupon_discount = cart.shipping_cost = Decimal('0.00')
+    cart.reload_totals()
+
+
+def supersede_pending_orders(cart):
+    """
+    Nouvelle tentative de commande sur le même panier: les commandes précédentes
+    encore en attente de paiement (mobile money abandonné) sont annulées, leur
+    stock et leur coupon rendus sans attendre l'expiration. Un paiement arrivé
+    malgré tout reste accepté (confirm_order).
+    """
+    for order in Order.objects.filter(cart=cart, status='pending', payment_status=False).only('pk'):
+        cancel_order(order)
+
+
+def cart_lines(cart):
+    lines = list(cart.items.order_by('pk').values_list(*LINE_FIELDS))
+    if not lines:
+        raise ValidationError("Votre panier est vide", code='empty')
+    return lines
+
+
+@transaction.atomic
+def place_order(cart, user, shipping_address, payment_method, payment_status=False, note='', status='confirmed'):
+    """
+    Transforme le panier en commande, tout ou rien.
+
+    Dans une seule transaction: annulation des tentatives mobile money en attente
+    sur ce panier, lecture des lignes (produits joints), un UPDATE
+    conditionnel de tous les produits (stock net des réservations actives,
+    disponibilité, ventes), création de la
+    commande, insertion groupée des articles, utilisation du coupon, puis suppression
+    des lignes et remise à zéro du panier. Le nombre de requêtes ne dépend pas de la
+    taille du panier. Lève ValidationError (code 'empty', 'unavailable', 'stock' ou
+    'coupon') sans rien écrire.
+    """
+    supersede_pending_orders(cart)
+    lines = cart_lines(cart)
+    consume_stock(lines)
+    order = create_order(
+        cart, user, shipping_address, lines,
+        payment_method=payment_method, payment_status=payment_status, status=status, note=note
+    )
+    clear_cart(cart)
+    return order
+
+
+@transaction.atomic
+def reserve_order(cart, user, shipping_address, payment_method, note='', ttl=RESERVATION_TTL):
+    """
+    Commande en attente de paiement (mobile money): le stock n'est pas décrémenté
+    mais retenu `ttl` secondes (voir reservations.py), le panier reste intact tant
+    que le paiement n'est pas confirmé. L'utilisation du coupon est retenue avec,
+    et rendue si le paiement échoue, si la réservation expire (cancel_order,
+    reservations.release_expired) ou si le client recommence (supersede_pending_orders).
+    """
+    supersede_pending_orders(cart)
+    lines = cart_lines(cart)
+    order = create_order(
+        cart, user, shipping_address, lines,
+        payment_method=payment_method, payment_status=False, status='pending', note=note
+    )
+    reserve_stock(order, {product_id: quantity for product_id, _, quantity, _, _ in lines}, ttl)
+    return order
+
+
+@transaction.atomic
+def confirm_order(order):
+    """
+    Paiement reçu: conversion des réservations en décrément de stock, articles
+    commandés retirés du panier. Idempotent (rappel PayGate et suivi du client
+    peuvent confirmer tous les deux): retourne False si la commande l'était déjà.
+
+    Réservation expirée: la conversion réussit si le stock est encore disponible,
+    sinon ValidationError et la commande reste en attente (à traiter par l'équipe).
+    Commande déjà annulée: son coupon a été rendu, la remise payée reste acquise.
+    """
+    # Commande annulée sur un refus puis payée malgré tout (notifications dans le désordre): confirmée aussi
+    if not Order.objects.filter(
+        pk=order.pk, status__in=('pending', 'cancelled'), payment_status=False
+    ).update(status='confirmed', payment_status=True, updated_at=timezone.now()):
+        return False
+    lines = list(order.items.order_by('pk').values_list(*LINE_FIELDS))
+    consume_stock(lines, reserved_for=order)
+    release_order(order)
+    clear_cart(order.cart, [product_id for product_id, _, _, _, _ in lines])
+    order.status, order.payment_status = 'confirmed', True
+    return True
+
+
+def cancel_order(order):
+    """
+    Paiement refusé ou non initié: réservations libérées immédiatement, sans attendre
+    leur expiration, et utilisation du coupon rendue (une seule fois).
+    """
+    with transaction.atomic():
+        release_order(order)
+        if Order.objects.filter(pk=order.pk, status='pending', payment_status=False).update(
+            status='cancelled', updated_at=timezone.now()
+        ):
+            release_coupon_uses([order.pk])
+    order.status = 'cancelled'
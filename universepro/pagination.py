@@ -0,0 +1,107 @@
+# universepro/pagination.py
+from decimal import Decimal
+from datetime import date, datetime
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+
+
+CURSOR_SALT = 'universepro.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """Page obtenue par pagination par curseur (pas de COUNT ni d'OFFSET)"""
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _parse_ordering(ordering):
+    return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+def _serialize(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _deserialize(model, name, value):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # Annotation (ex: search_rank): valeur JSON telle quelle
+        return value
+    if value is None:
+        return None
+    try:
+        return field.to_python(value)
+    except Exception:
+        raise InvalidCursor(name)
+
+
+def encode_cursor(obj, ordering, scope=''):
+    """Encode la clé de tri du dernier objet vu dans un jeton opaque et signé"""
+    values = [_serialize(getattr(obj, name)) for name, _ in _parse_ordering(ordering)]
+    return signing.dumps({'s': scope, 'v': values}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token, model, ordering, scope=''):
+    try:
+        payload = signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor(token)
+    fields = _parse_ordering(ordering)
+    if payload.get('s') != scope or len(payload.get('v', [])) != len(fields):
+        raise InvalidCursor(token)
+    return [_deserialize(model, name, value) for (name, _), value in zip(fields, payload['v'])]
+
+
+def keyset_filter(ordering, values):
+    """
+    Condition "après la clé (v1, v2, ...)" pour un tri composite:
+    (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ... (< pour les champs décroissants)
+    """
+    condition = Q()
+    equal = {}
+    for (name, descending), value in zip(_parse_ordering(ordering), values):
+        lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+        condition |= Q(**equal, **{lookup: value})
+        equal[name] = value
+    return condition
+
+
+def paginate_keyset(queryset, ordering, cursor=None, per_page=12, scope=''):
+    """
+    Retourne la page qui suit `cursor` pour le tri `ordering` (qui doit se terminer par
+    une clé unique, ex: 'id'). Coût constant quelle que soit la profondeur de la page.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering, scope)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    objects = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(objects) > per_page:
+        objects = objects[:per_page]
+        next_cursor = encode_cursor(objects[-1], ordering, scope)
+    return KeysetPage(objects, next_cursor)
@@ -0,0 +1,282 @@
+# universepro/promotions.py
+import threading
+from collections import defaultdict, namedtuple
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .catalog_cache import bump_version, get_catalog_version, get_version
+from .models import Category, Coupon, CouponRedemption
+
+
+# Périmètre compilé d'un coupon: ensembles immuables d'ids produits et de catégories
+# (descendantes incluses). Vides tous les deux: coupon valable sur tout le catalogue.
+CouponScope = namedtuple('CouponScope', 'product_ids category_ids')
+# Ligne de panier évaluée en mémoire
+CartLine = namedtuple('CartLine', 'product_id category_id total')
+
+COUPON_SCOPE_TIMEOUT = 60 * 60
+PROMOTIONS_VERSION_KEY = 'promotions:version'
+
+
+def compile_scope(coupon):
+    """Trois requêtes au plus: produits, catégories du coupon, puis leurs sous-arbres (une seule)"""
+    product_ids = frozenset(coupon.products.values_list('id', flat=True))
+    roots = list(coupon.categories.only('id', 'path'))
+    category_ids = frozenset()
+    if roots:
+        category_ids = frozenset(
+            Category.objects.filter(reduce(or_, (root.subtree_q() for root in roots)))
+            .values_list('id', flat=True)
+        ) | {root.id for root in roots}
+    return CouponScope(product_ids, category_ids)
+
+
+def coupon_scope(coupon):
+    """
+    Périmètre mis en cache, clé: updated_at du coupon (touché aussi par m2m_changed,
+    voir signals.py) et version du catalogue (nouvelles sous-catégories).
+    """
+    key = 'coupon:scope:{}:{}:{}'.format(
+        coupon.pk, coupon.updated_at.timestamp(), get_catalog_version()
+    )
+    scope = cache.get(key)
+    if scope is None:
+        scope = compile_scope(coupon)
+        cache.set(key, scope, COUPON_SCOPE_TIMEOUT)
+    return scope
+
+
+def cart_lines(cart):
+    """Lignes du panier (produit, catégorie, total) en une requête, sans chargement des produits"""
+    return [
+        CartLine(*row) for row in cart.items.order_by().values_list(
+            'product_id', 'product__category_id', F('price') * F('quantity')
+        )
+    ]
+
+
+def is_usable(coupon, now=None):
+    """Conditions propres au coupon: actif, dans sa période, utilisations restantes"""
+    now = now or timezone.now()
+    return (
+        coupon.is_active
+        and coupon.valid_from <= now <= coupon.valid_to
+        and coupon.current_uses < coupon.max_uses
+    )
+
+
+def evaluate_coupon(coupon, cart, now=None):
+    """
+    Éligibilité et remise en une passe sur le panier en mémoire.
+    Retourne la remise, ou None si le coupon ne s'applique pas au panier.
+
+    Nombre de requêtes constant: une pour les lignes (seulement si le coupon est
+    restreint), plus la compilation du périmètre lorsqu'il n'est pas en cache.
+    """
+    if not is_usable(coupon, now) or cart.subtotal < coupon.min_order_amount:
+        return None
+    scope = coupon_scope(coupon)
+    if scope.product_ids or scope.category_ids:
+        eligible = any(
+            line.product_id in scope.product_ids or line.category_id in scope.category_ids
+            for line in cart_lines(cart)
+        )
+        if not eligible:
+            return None
+    return coupon.calculate_discount(cart.subtotal)
+
+
+def free_use_number(coupon, user):
+    """
+    Plus petit numéro d'utilisation libre du client (1..max_uses_per_user), ou None.
+    Un numéro rendu par release_coupon_uses redevient libre: pas de compteur réutilisé.
+    """
+    if user is None:
+        return 1
+    used = set(CouponRedemption.objects.filter(coupon=coupon, user=user).values_list('use_number', flat=True))
+    return next((number for number in range(1, coupon.max_uses_per_user + 1) if number not in used), None)
+
+
+def redeem_coupon(coupon, user=None, order=None):
+    """
+    Enregistre une utilisation du coupon; retourne la ligne du registre, ou None si refusée.
+
+    Dans une transaction: insertion dans le registre au plus petit numéro libre
+    (l'index unique (coupon, client, numéro d'utilisation) borne les utilisations
+    par client, y compris entre requêtes concurrentes: le perdant relit les numéros
+    libres une fois), puis un seul UPDATE conditionnel current_uses < max_uses qui
+    désactive aussi le coupon à la dernière utilisation. Si l'UPDATE ne touche aucune
+    ligne, l'insertion est annulée.
+    """
+    for attempt in range(2):
+        use_number = free_use_number(coupon, user)
+        if use_number is None:
+            return None
+        try:
+            with transaction.atomic():
+                redemption = CouponRedemption.objects.create(
+                    coupon=coupon, user=user, order=order, use_number=use_number
+                )
+                redeemed = Coupon.objects.filter(
+                    pk=coupon.pk, is_active=True, current_uses__lt=F('max_uses')
+                ).update(
+                    current_uses=F('current_uses') + 1,
+                    # Évalué avec les valeurs avant mise à jour
+                    is_active=ExpressionWrapper(Q(current_uses__lt=F('max_uses') - 1), output_field=BooleanField()),
+                )
+                if not redeemed:
+                    transaction.set_rollback(True)
+            break
+        except IntegrityError:
+            # Même client, même numéro pris par une requête concurrente
+            if attempt:
+                return None
+    if not redeemed:
+        # Coupon épuisé ou désactivé: l'index des coupons automatiques est peut-être en retard
+        bump_promotions_version()
+        return None
+    return redemption
+
+
+def release_coupon_uses(order_ids):
+    """
+    Rend les utilisations de coupons des commandes annulées (paiement refusé ou
+    réservation expirée): lignes du registre supprimées, compteurs décrémentés et
+    coupon réactivé s'il avait été désactivé par épuisement. Une requête par coupon.
+    """
+    released = list(
+        CouponRedemption.objects.filter(order_id__in=order_ids)
+        .order_by().values_list('coupon_id').annotate(total=Count('id'))
+    )
+    if not released:
+        return 0
+    for coupon_id, total in released:
+        Coupon.objects.filter(pk=coupon_id).update(
+            # Évalué avec les valeurs avant mise à jour: épuisé -> de nouveau actif
+            is_active=Case(When(current_uses__gte=F('max_uses'), then=Value(True)), default=F('is_active')),
+            current_uses=Greatest(F('current_uses') - total, Value(0)),
+        )
+    CouponRedemption.objects.filter(order_id__in=order_ids).delete()
+    bump_promotions_version()
+    return sum(total for _, total in released)
+
+
+def bump_promotions_version():
+    """Invalide l'index des coupons automatiques de tous les processus"""
+    bump_version(PROMOTIONS_VERSION_KEY)
+
+
+class CouponIndex:
+    """
+    Index en mémoire (par processus) des coupons à application automatique.
+
+    Chargé en quatre requêtes (coupons, produits ciblés, catégories ciblées, arbre
+    des catégories), rechargé quand la version des promotions (coupons, signaux) ou
+    celle du catalogue (arbre des catégories) change. Pour un panier, les candidats
+    sont réunis par ligne via les index produit et catégorie (ancêtres compris), plus
+    les coupons sans restriction; aucune requête par coupon.
+
+    Les compteurs d'utilisation de l'index peuvent être en retard (redeem_coupon
+    n'émet pas de signal): l'utilisation reste garantie par l'UPDATE conditionnel.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.coupons = {}
+        self.by_product = {}
+        self.by_category = {}
+        self.unrestricted = ()
+        self.ancestors = {}
+        self.version = None
+
+    def current_version(self):
+        return get_version(PROMOTIONS_VERSION_KEY), get_catalog_version()
+
+    def load(self):
+        version = self.current_version()
+        now = timezone.now()
+        coupons = {
+            coupon.pk: coupon
+            for coupon in Coupon.objects.filter(
+                is_active=True, auto_apply=True, valid_to__gte=now, current_uses__lt=F('max_uses')
+            ).defer('description')
+        }
+        by_product, by_category = defaultdict(list), defaultdict(list)
+        restricted = set()
+        for coupon_id, product_id in Coupon.products.through.objects.filter(
+            coupon_id__in=coupons
+        ).values_list('coupon_id', 'product_id'):
+            by_product[product_id].append(coupon_id)
+            restricted.add(coupon_id)
+        for coupon_id, category_id in Coupon.categories.through.objects.filter(
+            coupon_id__in=coupons
+        ).values_list('coupon_id', 'category_id'):
+            by_category[category_id].append(coupon_id)
+            restricted.add(coupon_id)
+        ancestors = {
+            pk: tuple(int(part) for part in path.split('/') if part) or (pk,)
+            for pk, path in Category.objects.order_by().values_list('pk', 'path')
+        }
+        with self.lock:
+            self.coupons = coupons
+            self.by_product = dict(by_product)
+            self.by_category = dict(by_category)
+            self.unrestricted = tuple(pk for pk in coupons if pk not in restricted)
+            self.ancestors = ancestors
+            self.version = version
+
+    def ensure_fresh(self):
+        if self.version != self.current_version():
+            self.load()
+
+    def candidates(self, lines):
+        """Coupons dont le périmètre touche au moins une ligne du panier"""
+        self.ensure_fresh()
+        found = set(self.unrestricted)
+        for line in lines:
+            found.update(self.by_product.get(line.product_id, ()))
+            for category_id in self.ancestors.get(line.category_id, ()):
+                found.update(self.by_category.get(category_id, ()))
+        return [self.coupons[pk] for pk in found]
+
+
+coupon_index = CouponIndex()
+
+
+def coupon_saving(coupon, cart):
+    """Économie réelle pour le client: la livraison offerte vaut les frais de livraison"""
+    if coupon.discount_type == 'free_shipping':
+        return cart.shipping_cost
+    return coupon.calculate_discount(cart.subtotal)
+
+
+def best_coupon(cart, user=None, now=None):
+    """
+    Meilleur coupon automatique applicable au panier (plus grande économie), ou None.
+    Une requête pour les lignes du panier, une pour les utilisations du client.
+    """
+    if not cart.item_count:
+        return None
+    now = now or timezone.now()
+    candidates = [
+        coupon for coupon in coupon_index.candidates(cart_lines(cart))
+        if is_usable(coupon, now) and cart.subtotal >= coupon.min_order_amount
+    ]
+    if candidates and user is not None:
+        used = dict(
+            CouponRedemption.objects.filter(user=user, coupon_id__in=[coupon.pk for coupon in candidates])
+            .order_by().values_list('coupon_id').annotate(total=Count('id'))
+        )
+        candidates = [coupon for coupon in candidates if used.get(coupon.pk, 0) < coupon.max_uses_per_user]
+    best, best_saving = None, 0
+    for coupon in candidates:
+        saving = coupon_saving(coupon, cart)
+        if saving > best_saving or (saving == best_saving and best is not None and coupon.pk < best.pk):
+            best, best_saving = coupon, saving
+    return best
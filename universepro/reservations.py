@@ -0,0 +1,87 @@
+# universepro/reservations.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Order, Product, StockReservation
+from .promotions import release_coupon_uses
+
+
+# Durée de la retenue: validation du paiement mobile sur le téléphone (5 minutes de suivi) et marge
+RESERVATION_TTL = getattr(settings, 'STOCK_RESERVATION_TTL', 10 * 60)
+
+
+def held_quantity(now=None, exclude_order=None):
+    """
+    Quantité retenue du produit courant (OuterRef) par les réservations non expirées,
+    hors celles de `exclude_order`. Sous-requête servie par l'index (produit, expiration).
+    """
+    holds = StockReservation.objects.filter(product=OuterRef('pk'), expires_at__gt=now or timezone.now())
+    if exclude_order is not None:
+        holds = holds.exclude(order=exclude_order)
+    return Coalesce(
+        Subquery(holds.order_by().values('product').annotate(total=Sum('quantity')).values('total')),
+        Value(0), output_field=IntegerField()
+    )
+
+
+def available_quantities(product_ids, now=None):
+    """{id produit: stock - réservations actives} des produits en vente, en une requête"""
+    return dict(
+        Product.objects.filter(pk__in=product_ids, is_active=True, in_stock=True).order_by()
+        .values_list('pk', ExpressionWrapper(F('stock_quantity') - held_quantity(now), output_field=IntegerField()))
+    )
+
+
+def reserve_stock(order, quantities, ttl=RESERVATION_TTL):
+    """
+    Retient `quantities` ({id produit: quantité}) pour la commande jusqu'à maintenant + ttl.
+
+    À appeler dans la transaction de l'appelant. Les lignes produits sont verrouillées le
+    temps de cette transaction seulement (SELECT ... FOR UPDATE, dans l'ordre des ids),
+    les réservations insérées en une fois, puis la disponibilité recalculée en une
+    requête, réservations comprises: si un produit passe sous zéro, ValidationError et
+    l'appelant annule tout. Aucun verrou n'est gardé pendant le paiement.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', flat=True))
+    StockReservation.objects.bulk_create([
+        StockReservation(product_id=product_id, order=order, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+    available = available_quantities(quantities, now)
+    short = [product_id for product_id in quantities if available.get(product_id, -1) < 0]
+    if short:
+        raise ValidationError("Stock insuffisant pour certains articles", code='stock', params={'product_ids': short})
+    return expires_at
+
+
+def release_order(order):
+    """Libère les réservations d'une commande (paiement échoué ou converti)"""
+    return StockReservation.objects.filter(order=order).delete()[0]
+
+
+def release_expired(now=None):
+    """
+    Suppression groupée des réservations expirées, à planifier en cron. Les commandes
+    en attente concernées sont annulées et leurs utilisations de coupons rendues.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.filter(status='pending', payment_status=False, reservations__expires_at__lte=now)
+            .order_by().values_list('pk', flat=True).distinct()
+        )
+        if order_ids:
+            # Condition répétée: une confirmation de paiement concurrente l'emporte
+            Order.objects.filter(pk__in=order_ids, status='pending', payment_status=False).update(
+                status='cancelled', updated_at=timezone.now()
+            )
+            release_coupon_uses(Order.objects.filter(pk__in=order_ids, status='cancelled').values('pk'))
+        return StockReservation.objects.filter(expires_at__lte=now).delete()[0]
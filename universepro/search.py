@@ -0,0 +1,242 @@
+# universepro/search.py
+import re
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+
+# Champs du produit qui alimentent l'index plein texte
+INDEXED_FIELDS = ('name', 'short_description', 'description', 'sku')
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Découpe la requête utilisateur en mots (sans opérateurs)"""
+    return TOKEN_RE.findall(query or '')[:10]
+
+
+class BaseSearchBackend:
+    """
+    Interface commune des moteurs de recherche produit.
+    Chaque moteur maintient une table d'index séparée, clé = id du produit.
+    """
+    def __init__(self, alias=DEFAULT_DB_ALIAS):
+        self.alias = alias
+
+    @property
+    def connection(self):
+        return connections[self.alias]
+
+    def rows(self, products):
+        return [
+            (product.pk,) + tuple(getattr(product, field) or '' for field in INDEXED_FIELDS)
+            for product in products
+        ]
+
+    def index_product(self, product):
+        self.index_products([product])
+
+    def index_products(self, products):
+        raise NotImplementedError
+
+    def remove_product(self, product_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def ranked_ids(self, query, limit=None):
+        """Retourne les ids des produits correspondants, du plus pertinent au moins pertinent"""
+        raise NotImplementedError
+
+    def match_sql(self, query):
+        """(sql, params) de la sous-requête des ids correspondants, None si la requête est vide"""
+        raise NotImplementedError
+
+    def rank_sql(self, query, column):
+        """(sql, params) du score du produit `column` (sous-requête corrélée, plus petit = plus pertinent)"""
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        """
+        Filtre le queryset sur les résultats de l'index et l'ordonne par pertinence.
+        Le score `search_rank` (plus petit = plus pertinent) est calculé en SQL: tri et
+        pagination (OFFSET ou curseur) portent sur tous les résultats, sans plafond.
+        """
+        match = self.match_sql(query)
+        if match is None:
+            return queryset.none()
+        quote_name = self.connection.ops.quote_name
+        meta = queryset.model._meta
+        column = '%s.%s' % (quote_name(meta.db_table), quote_name(meta.pk.column))
+        return queryset.filter(pk__in=RawSQL(*match)).annotate(
+            search_rank=RawSQL(*self.rank_sql(query, column), output_field=FloatField())
+        ).order_by('search_rank', 'pk')
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """Index FTS5 (SQLite) avec classement bm25 et recherche par préfixe"""
+    table = 'universepro_product_fts'
+    # Poids bm25 dans l'ordre des colonnes: name, short_description, description, sku
+    weights = (10.0, 4.0, 1.0, 8.0)
+
+    def index_products(self, products):
+        rows = self.rows(products)
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (rowid, {', '.join(INDEXED_FIELDS)}) "
+                f"VALUES ({', '.join(['%s'] * (len(INDEXED_FIELDS) + 1))})",
+                rows
+            )
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [product_id])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def match_expression(self, query):
+        # Chaque mot devient un préfixe: "xiao"* "pro"* (ET implicite)
+        return ' '.join('"%s"*' % token.replace('"', '""') for token in tokenize(query))
+
+    def bm25(self):
+        return f"bm25({self.table}, {', '.join(str(weight) for weight in self.weights)})"
+
+    def match_sql(self, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return None
+        return f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [expression]
+
+    def rank_sql(self, query, column):
+        # bm25 est négatif: plus petit = plus pertinent
+        return (
+            f"SELECT {self.bm25()} FROM {self.table} WHERE {self.table} MATCH %s AND rowid = {column}",
+            [self.match_expression(query)]
+        )
+
+    def ranked_ids(self, query, limit=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s "
+                f"ORDER BY {self.bm25()}, rowid LIMIT %s",
+                [expression, -1 if limit is None else limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Index tsvector + GIN (PostgreSQL) avec classement ts_rank et recherche par préfixe"""
+    table = 'universepro_product_search'
+    config = 'french'
+
+    def _document_sql(self):
+        return (
+            f"setweight(to_tsvector('{self.config}', %s), 'A') || "
+            f"setweight(to_tsvector('{self.config}', %s), 'B') || "
+            f"setweight(to_tsvector('{self.config}', %s), 'C') || "
+            f"setweight(to_tsvector('simple', %s), 'A')"
+        )
+
+    def index_products(self, products):
+        rows = self.rows(products)
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (product_id, document) "
+                f"VALUES (%s, {self._document_sql()}) "
+                f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE product_id = %s", [product_id])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+
+    def tsquery(self, query):
+        # Chaque mot devient un préfixe: xiao:* & pro:*
+        return ' & '.join('%s:*' % token for token in tokenize(query))
+
+    def match_sql(self, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return None
+        return (
+            f"SELECT product_id FROM {self.table} WHERE document @@ to_tsquery('{self.config}', %s)",
+            [tsquery]
+        )
+
+    def rank_sql(self, query, column):
+        # ts_rank croît avec la pertinence: opposé pour un tri croissant
+        return (
+            f"SELECT -ts_rank(document, to_tsquery('{self.config}', %s)) FROM {self.table} "
+            f"WHERE product_id = {column}",
+            [self.tsquery(query)]
+        )
+
+    def ranked_ids(self, query, limit=None):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT product_id FROM {self.table}, to_tsquery('{self.config}', %s) query "
+                f"WHERE document @@ query ORDER BY ts_rank(document, query) DESC, product_id LIMIT %s",
+                [tsquery, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Moteur de secours (autres SGBD): recherche icontains sans index"""
+
+    def index_products(self, products):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(short_description__icontains=query)
+        )
+
+
+BACKENDS = {
+    'sqlite3': SQLiteFTS5Backend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backends = {}
+
+
+def get_backend(alias=DEFAULT_DB_ALIAS):
+    """Sélectionne le moteur de recherche selon le moteur déclaré dans DATABASES"""
+    if alias not in _backends:
+        engine = settings.DATABASES[alias]['ENGINE'].rsplit('.', 1)[-1]
+        _backends[alias] = BACKENDS.get(engine, BasicSearchBackend)(alias)
+    return _backends[alias]
+
+
+def search_products(queryset, query):
+    return get_backend(queryset.db).search(queryset, query)
@@ -0,0 +1,93 @@
+# universepro/sequences.py
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Sequence
+
+
+ORDER_NUMBER_SEQUENCE = 'order_number'
+ORDER_NUMBER_PREFIX = 'CMD'
+# Numéros réservés d'un coup par processus (une requête par bloc)
+ORDER_NUMBER_BLOCK_SIZE = getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 20)
+
+
+def native_sequence_name(name):
+    return f'universepro_{name}_seq'
+
+
+def reserve_block(name, size):
+    """
+    Réserve `size` valeurs du compteur `name`, retournées dans l'ordre croissant.
+
+    PostgreSQL: séquence native, nextval() n'est jamais annulé par un rollback.
+    Autres bases: table de compteurs; l'UPDATE pose un verrou d'écriture jusqu'à la
+    validation et la relecture dans la même transaction voit sa propre valeur, deux
+    processus ne reçoivent donc jamais le même bloc. Compteur créé à zéro s'il manque.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(%s) FROM generate_series(1, %s)', [native_sequence_name(name), size]
+            )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    with transaction.atomic():
+        if not Sequence.objects.filter(name=name).update(value=F('value') + size):
+            Sequence.objects.get_or_create(name=name)
+            Sequence.objects.filter(name=name).update(value=F('value') + size)
+        end = Sequence.objects.filter(name=name).values_list('value', flat=True).get()
+    return list(range(end - size + 1, end + 1))
+
+
+class SequenceAllocator:
+    """
+    Distribue les valeurs d'un compteur par blocs (par processus).
+
+    Une requête par bloc, aucune pour les valeurs suivantes. Les blocs non épuisés
+    sont perdus à l'arrêt du processus: les numéros sont uniques, croissants par
+    processus, mais pas contigus. Un processus issu d'un fork ne réutilise pas le
+    bloc de son parent.
+
+    Hors PostgreSQL, un bloc réservé dans une transaction en cours n'est acquis qu'à
+    sa validation (un rollback rendrait ses valeurs à la table): d'ici là, chaque
+    allocation réserve un nouveau bloc plutôt que de réutiliser des valeurs incertaines.
+    """
+
+    def __init__(self, name, block_size):
+        self.name = name
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.values = []
+        self.pending = False
+        self.pid = None
+
+    def reserve(self):
+        values = reserve_block(self.name, self.block_size)
+        values.reverse()
+        self.values = values
+        self.pid = os.getpid()
+        self.pending = connection.vendor != 'postgresql' and connection.in_atomic_block
+        if self.pending:
+            transaction.on_commit(lambda: self.confirm(values))
+
+    def confirm(self, values):
+        with self.lock:
+            if self.values is values:
+                self.pending = False
+
+    def allocate(self):
+        with self.lock:
+            if self.pending or not self.values or self.pid != os.getpid():
+                self.reserve()
+            return self.values.pop()
+
+
+order_numbers = SequenceAllocator(ORDER_NUMBER_SEQUENCE, ORDER_NUMBER_BLOCK_SIZE)
+
+
+def next_order_number():
+    return f"{ORDER_NUMBER_PREFIX}-{order_numbers.allocate():06d}"
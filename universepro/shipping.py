@@ -0,0 +1,156 @@
+# universepro/shipping.py
+import math
+import threading
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .catalog_cache import bump_version, get_version
+from .models import Cart, ShippingMethod, SiteSetting
+
+
+SHIPPING_VERSION_KEY = 'shipping:version'
+# Durée de vie d'un devis mémorisé (la version du panier invalide avant expiration)
+QUOTE_CACHE_TIMEOUT = 60 * 60
+ZERO = Decimal('0.00')
+
+ShippingQuote = namedtuple('ShippingQuote', 'id name description estimated_delivery price free_shipping_threshold')
+Rate = namedtuple('Rate', 'id name description estimated_delivery price price_per_kg max_weight threshold regions')
+
+
+def normalize_region(value):
+    return (value or '').strip().casefold()
+
+
+def address_regions(address):
+    """Régions couvertes par une adresse (ville, région, pays), normalisées"""
+    if address is None:
+        return frozenset()
+    regions = (address.city, address.state, address.country)
+    return frozenset(normalize_region(region) for region in regions if region)
+
+
+def method_cost(price, price_per_kg, threshold, subtotal, weight):
+    """Gratuit au-delà du seuil, sinon prix de base + supplément par kilogramme entamé"""
+    if threshold is not None and subtotal >= threshold:
+        return ZERO
+    return price + price_per_kg * math.ceil(Decimal(weight) / 1000)
+
+
+def get_shipping_version():
+    return get_version(SHIPPING_VERSION_KEY)
+
+
+def bump_shipping_version():
+    """Invalide les tarifs chargés et les devis mémorisés (après validation de la transaction)"""
+    bump_version(SHIPPING_VERSION_KEY)
+
+
+class ShippingRates:
+    """
+    Méthodes actives et paramètres du site gardés en mémoire (par processus).
+
+    Deux requêtes au chargement, aucune ensuite: les processus se rechargent quand
+    la version de livraison (cache partagé) change, c'est-à-dire après modification
+    d'une ShippingMethod ou des paramètres du site.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rates = ()
+        self.free_shipping_threshold = Decimal(settings.FREE_SHIPPING_THRESHOLD)
+        self.default_cost = Decimal(settings.DEFAULT_SHIPPING_COST)
+        self.version = None
+
+    def load(self):
+        version = get_shipping_version()
+        rates = tuple(
+            Rate(
+                method.id, method.name, method.description, method.estimated_delivery,
+                method.price, method.price_per_kg, method.max_weight, method.free_shipping_threshold,
+                frozenset(normalize_region(region) for region in method.regions or ())
+            )
+            for method in ShippingMethod.objects.filter(is_active=True).order_by('price', 'id')
+        )
+        site = SiteSetting.objects.filter(pk=1).values('free_shipping_threshold', 'default_shipping_cost').first()
+        with self.lock:
+            self.rates = rates
+            if site:
+                self.free_shipping_threshold = site['free_shipping_threshold']
+                self.default_cost = site['default_shipping_cost']
+            self.version = version
+
+    def ensure_fresh(self):
+        if self.version != get_shipping_version():
+            self.load()
+
+    def quote(self, subtotal, weight, regions=frozenset()):
+        """
+        Devis de chaque méthode active desservant la destination, du moins cher au plus cher.
+        Une méthode sans régions dessert partout. Sans méthode applicable: tarif par défaut du site.
+        Poids en grammes.
+        """
+        self.ensure_fresh()
+        quotes = []
+        for rate in self.rates:
+            if rate.regions and not rate.regions & regions:
+                continue
+            if rate.max_weight is not None and weight > rate.max_weight:
+                continue
+            # Sans seuil propre, le seuil de livraison gratuite du site s'applique
+            threshold = rate.threshold if rate.threshold is not None else self.free_shipping_threshold
+            quotes.append(ShippingQuote(
+                rate.id, rate.name, rate.description, rate.estimated_delivery,
+                method_cost(rate.price, rate.price_per_kg, threshold, subtotal, weight), threshold
+            ))
+        if not quotes:
+            quotes = [ShippingQuote(
+                None, "Livraison standard", '', '',
+                method_cost(self.default_cost, ZERO, self.free_shipping_threshold, subtotal, weight),
+                self.free_shipping_threshold
+            )]
+        return sorted(quotes, key=lambda quote: (quote.price, quote.id or 0))
+
+
+rates = ShippingRates()
+
+
+def cart_quotes(cart, address=None):
+    """
+    Devis pour un panier. Pour un panier en base, mémorisés par version du panier
+    (incrémentée par Cart.refresh_totals), destination et version des tarifs.
+    """
+    if not cart.item_count:
+        return [ShippingQuote(None, "Livraison standard", '', '', ZERO, None)]
+    regions = address_regions(address)
+    if not isinstance(cart, Cart):
+        weight = sum((item.product.weight * item.quantity for item in cart.get_items()), ZERO)
+        return rates.quote(cart.subtotal, weight, regions)
+
+    key = 'shipping:quote:{}:{}:{}:{}'.format(
+        cart.pk, cart.version, '|'.join(sorted(regions)).replace(' ', '_'), get_shipping_version()
+    )
+    quotes = cache.get(key)
+    if quotes is None:
+        quotes = rates.quote(cart.subtotal, cart.weight_total, regions)
+        cache.set(key, quotes, QUOTE_CACHE_TIMEOUT)
+    return quotes
+
+
+def apply_quote(cart, address=None):
+    """Frais du devis le moins cher appliqués au panier en mémoire, sans écriture (lecture pure)"""
+    quote = cart_quotes(cart, address)[0]
+    cart.shipping_cost = quote.price
+    cart.shipping_method = quote.name[:50]
+    return quote
+
+
+def update_cart_shipping(cart, address=None):
+    """Persiste les frais de livraison, seulement s'ils ont changé (après une modification du panier)"""
+    stored = (cart.shipping_cost, cart.shipping_method)
+    quote = apply_quote(cart, address)
+    if stored != (cart.shipping_cost, cart.shipping_method):
+        Cart.objects.filter(pk=cart.pk).update(shipping_cost=cart.shipping_cost, shipping_method=cart.shipping_method)
+    return cart.shipping_cost
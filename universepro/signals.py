@@ -0,0 +1,148 @@
+# universepro/signals.py
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import timezone
+from django.dispatch import receiver
+
+from .models import (
+    Product, ProductColor, ProductImage, Category, TrendingProduct, ProductReview, OrderItem, Cart, CartItem,
+    ShippingMethod, SiteSetting, Coupon
+)
+from .search import get_backend, INDEXED_FIELDS
+from .catalog_cache import bump_catalog_version
+from .counters import flush_counters
+from .cart import cart_totals_deferred, materialize_session_cart
+from .shipping import bump_shipping_version
+from .promotions import bump_promotions_version
+from .coupons import code_filter
+from . import suggest
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Met à jour l'index de recherche quand un champ indexé change"""
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    get_backend(using).index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def sync_product_colors(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Maintient l'index des couleurs utilisé par les facettes"""
+    if raw:
+        return
+    if update_fields is not None and 'colors' not in update_fields:
+        return
+    ProductColor.sync(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using=None, **kwargs):
+    get_backend(using).remove_product(instance.pk)
+
+
+@receiver(post_delete, sender=ProductReview)
+def refresh_product_rating(sender, instance, **kwargs):
+    Product.refresh_rating(instance.product_id)
+
+
+@receiver(post_save, sender=OrderItem)
+def count_sale(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Product.add_sales(instance.product_id, instance.quantity)
+
+
+@receiver(post_delete, sender=OrderItem)
+def uncount_sale(sender, instance, **kwargs):
+    Product.add_sales(instance.product_id, -instance.quantity)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def refresh_cart_totals(sender, instance, raw=False, **kwargs):
+    """Maintient le résumé du panier (badge, sous-total) sans parcours des articles à la lecture"""
+    if not raw and not cart_totals_deferred():
+        Cart.refresh_totals(instance.cart_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=TrendingProduct)
+def invalidate_catalog_cache(sender, raw=False, **kwargs):
+    """Toute modification du catalogue invalide les pages assemblées en cache (accueil)"""
+    if not raw:
+        bump_catalog_version()
+
+
+@receiver(request_finished)
+def flush_product_counters(sender, **kwargs):
+    """Écrit les vues/clics accumulés une fois le délai de regroupement écoulé"""
+    flush_counters()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def update_suggestions(sender, instance, raw=False, **kwargs):
+    """Mise à jour incrémentale de l'index de suggestions du processus courant"""
+    if raw:
+        return
+    if sender is Product:
+        suggest.index.update_product(instance)
+    else:
+        suggest.index.update_category(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def remove_suggestion(sender, instance, **kwargs):
+    if sender is Product:
+        suggest.index.remove_product(instance.pk)
+    else:
+        suggest.index.remove_category(instance.pk)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """Le panier de session du visiteur rejoint celui du compte à la connexion"""
+    if request is not None and hasattr(request, 'session'):
+        materialize_session_cart(request, user=user)
+
+
+@receiver([post_save, post_delete], sender=ShippingMethod)
+@receiver([post_save, post_delete], sender=SiteSetting)
+def invalidate_shipping_rates(sender, raw=False, **kwargs):
+    """Les tarifs en mémoire et les devis mémorisés sont recalculés après toute modification"""
+    if not raw:
+        bump_shipping_version()
+
+
+@receiver(m2m_changed, sender=Coupon.products.through)
+@receiver(m2m_changed, sender=Coupon.categories.through)
+def touch_coupon(sender, instance, action, reverse, pk_set, **kwargs):
+    """Le périmètre compilé d'un coupon est indexé par updated_at: le toucher à chaque changement"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    now = timezone.now()
+    if not reverse:
+        coupon_ids = [instance.pk]
+        instance.updated_at = now
+    elif action == 'post_clear':
+        # Depuis un produit ou une catégorie: pk_set n'est pas fourni pour clear
+        coupon_ids = None
+    else:
+        coupon_ids = pk_set
+    coupons = Coupon.objects.all() if coupon_ids is None else Coupon.objects.filter(pk__in=coupon_ids)
+    coupons.update(updated_at=now)
+    bump_promotions_version()
+
+
+@receiver([post_save, post_delete], sender=Coupon)
+def invalidate_coupon_index(sender, raw=False, **kwargs):
+    """L'index des coupons automatiques est rechargé après toute modification d'un coupon"""
+    if not raw:
+        bump_promotions_version()
+        transaction.on_commit(code_filter.expire)
@@ -1,5 +1,39 @@
-from django.test import TestCase
-from .models import User, Payment,Cart, Product, CartItem, PaymentAttempt
+import multiprocessing
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .models import (
+    User, Payment,Cart, Product, CartItem, PaymentAttempt, ProductReview, Order, OrderItem, Category,
+    ProductImage, ProductFeature, TrendingProduct, Favorite, ProductSimilarity, ShippingMethod, Address, Coupon,
+    CouponRedemption, StockReservation
+)
+from . import catalog_cache, counters
+from .cart import (
+    SessionCart, materialize_session_cart, apply_cart_operations, parse_cart_operations, add_cart_line,
+    deferred_cart_totals,
+)
+from .context_processors import cart_context
+from .search import get_backend, search_products
+from .views import PRODUCT_SORTS
+from .catalog_cache import get_catalog_data, incr_version, CATALOG_VERSION_KEY
+from . import trending
+from .trending import compute_trending
+from .similarity import build_similarities
+from . import suggest as suggest_module
+from .promotions import redeem_coupon, release_coupon_uses, best_coupon, coupon_index
+from .shipping import cart_quotes, update_cart_shipping, rates as shipping_rates
+from .coupons import generate_campaign, code_filter, CODE_FILTER_PROBE_INTERVAL
+from .sequences import order_numbers
+from .orders import place_order, reserve_order, confirm_order, cancel_order
+from .reservations import available_quantities
 class PaygateTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user('testuser', 'test@example.com', 'password')
@@ -16,4 +50,1251 @@ class PaygateTestCase(TestCase):
         
         success, result = PaymentAttempt.initiate_payment(...)
         self.assertTrue(success)
-        self.assertIsInstance(result, Payment)
\ No newline at end of file
+        self.assertIsInstance(result, Payment)
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(
+            name="Téléphone Xiaomi 12 Pro", description="Smartphone haut de gamme", price=250000
+        )
+        self.case = Product.objects.create(
+            name="Coque de protection", description="Compatible Xiaomi 12 Pro", price=5000
+        )
+        Product.objects.create(name="Casque Samsung", description="Audio sans fil", price=30000)
+
+    def test_prefix_search_is_ranked(self):
+        ids = get_backend().ranked_ids("xiao 12")
+        self.assertEqual(ids, [self.phone.id, self.case.id])
+
+    def test_accents_are_ignored(self):
+        self.assertEqual(get_backend().ranked_ids("telephone"), [self.phone.id])
+
+    def test_index_follows_save_and_delete(self):
+        self.case.name = "Étui Galaxy"
+        self.case.description = "Cuir"
+        self.case.save()
+        self.assertEqual(get_backend().ranked_ids("xiaomi"), [self.phone.id])
+        self.phone.delete()
+        self.assertEqual(get_backend().ranked_ids("xiaomi"), [])
+
+    def test_rebuild_command(self):
+        get_backend().clear()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(get_backend().ranked_ids("xiaomi")), 2)
+
+    def test_product_list_uses_index(self):
+        response = self.client.get(reverse('core:product_list'), {'q': 'xiaomi'})
+        self.assertEqual(list(response.context['products']), [self.phone, self.case])
+
+    def test_results_are_not_capped(self):
+        Product.objects.bulk_create([
+            Product(name=f"Xiaomi Redmi {i}", slug=f"xiaomi-redmi-{i}", sku=f"XR-{i}", description="", price=1000)
+            for i in range(40)
+        ])
+        get_backend().index_products(Product.objects.filter(name__startswith="Xiaomi Redmi"))
+        with patch.object(type(get_backend()), 'ranked_ids') as ranked_ids:
+            response = self.client.get(reverse('core:product_list'), {'q': 'xiaomi'})
+        ranked_ids.assert_not_called()  # classement calculé dans la requête SQL paginée
+        self.assertEqual(response.context['facets']['total'], 42)
+        self.assertEqual(
+            [product.id for product in search_products(Product.objects.all(), 'xiaomi')],
+            get_backend().ranked_ids('xiaomi')
+        )
+
+
+class ProductSortKeysTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.first = Product.objects.create(name="Produit A", description="", price=1000)
+        self.second = Product.objects.create(name="Produit B", description="", price=2000)
+
+    def test_rating_follows_review_approval_and_deletion(self):
+        review = ProductReview.objects.create(
+            product=self.first, user=self.user, rating=4, title="Bien", comment="", is_approved=True
+        )
+        ProductReview.objects.create(
+            product=self.first, user=self.other, rating=2, title="Bof", comment="", is_approved=True
+        )
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.rating, self.first.reviews_count), (3.0, 2))
+
+        review.delete()
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.rating, self.first.reviews_count), (2.0, 1))
+
+    def test_sales_count_follows_order_items(self):
+        cart = Cart.objects.create(user=self.user)
+        order = Order.objects.create(user=self.user, cart=cart, subtotal=4000, total=4000, payment_method='cash')
+        OrderItem.objects.create(order=order, product=self.second, quantity=2, price=2000, total_price=4000)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.sales_count, 2)
+
+        response = self.client.get(reverse('core:product_list'), {'sort_by': 'best_selling'})
+        self.assertEqual(list(response.context['products']), [self.second, self.first])
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        for i in range(30):
+            Product.objects.create(
+                name=f"Produit {i:02d}", description="", price=1000 + (i % 7) * 100, rating=i % 5
+            )
+
+    def walk(self, params):
+        ids, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(reverse('core:product_list_json'), dict(params, cursor=cursor)).json()
+            ids += [product['id'] for product in data['products']]
+            cursor = data['next_cursor']
+        return ids
+
+    def test_cursor_walk_matches_full_ordering(self):
+        for sort_by, ordering in PRODUCT_SORTS.items():
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(self.walk({'sort_by': sort_by}), expected, sort_by)
+        self.assertEqual(self.walk({'q': 'produit'}), get_backend().ranked_ids('produit'))
+
+    def test_html_listing_switches_to_cursor(self):
+        response = self.client.get(reverse('core:product_list'), {'sort_by': 'price_asc'})
+        cursor = response.context['next_cursor']
+        self.assertIsNotNone(cursor)
+        response = self.client.get(reverse('core:product_list'), {'sort_by': 'price_asc', 'cursor': cursor})
+        expected = list(Product.objects.order_by('price', 'id')[12:24])
+        self.assertEqual(list(response.context['products']), expected)
+
+    def test_numbered_pages_are_capped(self):
+        url = reverse('core:product_list')
+        with patch('universepro.views.OFFSET_PAGE_LIMIT', 2):
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual(list(response.context['page_range']), [1, 2])
+            self.assertIsNotNone(response.context['next_cursor'])  # page 3: par curseur
+            self.assertEqual(self.client.get(url, {'page': 3}).status_code, 404)
+            self.assertEqual(self.client.get(url, {'page': 'last'}).status_code, 404)
+
+        cursor = self.client.get(url).context['next_cursor']
+        response = self.client.get(url, {'cursor': cursor})
+        self.assertContains(response, "30 produits trouvés")
+
+    def test_cursor_is_bound_to_its_sort(self):
+        cursor = self.client.get(reverse('core:product_list_json'), {'sort_by': 'name'}).json()['next_cursor']
+        response = self.client.get(reverse('core:product_list_json'), {'sort_by': 'rating', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+
+class CategoryTreeTestCase(TestCase):
+    def setUp(self):
+        self.phones = Category.objects.create(name="Téléphones")
+        self.android = Category.objects.create(name="Android", parent=self.phones)
+        self.xiaomi = Category.objects.create(name="Xiaomi", parent=self.android)
+        self.audio = Category.objects.create(name="Audio")
+        self.deep = Product.objects.create(name="Redmi Note", description="", price=1000, category=self.xiaomi)
+        self.other = Product.objects.create(name="Casque", description="", price=1000, category=self.audio)
+
+    def test_products_at_any_depth(self):
+        self.assertEqual(list(Product.objects.filter(self.phones.subtree_q('category__'))), [self.deep])
+        response = self.client.get(reverse('core:product_list_by_category', args=[self.phones.slug]))
+        self.assertEqual(list(response.context['products']), [self.deep])
+
+    def test_category_page_renders_breadcrumbs_and_tree(self):
+        response = self.client.get(reverse('core:product_list_by_category', args=[self.xiaomi.slug]))
+        self.assertEqual(response.context['breadcrumbs'], [self.phones, self.android, self.xiaomi])
+        self.assertContains(response, 'href="%s"' % reverse('core:product_list_by_category', args=[self.android.slug]))
+        # Sous-catégories dans les menus latéraux (bureau et mobile)
+        self.assertContains(response, 'href="%s"' % reverse('core:product_list_by_category', args=[self.xiaomi.slug]), count=2)
+
+    def test_ancestors_and_tree(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.xiaomi.get_ancestors()), [self.phones, self.android])
+        with self.assertNumQueries(1):
+            roots = Category.get_tree()
+        self.assertEqual(roots, [self.audio, self.phones])
+        self.assertEqual(roots[1].tree_children[0].tree_children, [self.xiaomi])
+
+    def test_moving_a_branch_updates_descendants(self):
+        self.android.parent = self.audio
+        self.android.save()
+        self.xiaomi.refresh_from_db()
+        self.assertEqual(self.xiaomi.depth, 2)
+        self.assertEqual(list(self.xiaomi.get_ancestors()), [self.audio, self.android])
+        self.assertEqual(set(Product.objects.filter(self.audio.subtree_q('category__'))), {self.deep, self.other})
+
+    def test_cannot_move_under_own_descendant(self):
+        self.phones.parent = self.xiaomi
+        with self.assertRaises(ValidationError):
+            self.phones.save()
+
+
+class HomeCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Produit vedette", description="", price=1000, featured=True)
+
+    def test_home_is_served_from_cache_until_catalog_changes(self):
+        self.client.get(reverse('core:home'))
+        with self.assertNumQueries(1):  # paramètres du site (context processor)
+            response = self.client.get(reverse('core:home'))
+        self.assertEqual(response.context['featured_products'], [self.product])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Product.objects.create(name="Nouveau produit", description="", price=500, featured=True)
+        response = self.client.get(reverse('core:home'))
+        self.assertEqual(response.context['featured_products'], [other, self.product])
+
+    def test_concurrent_rebuild_serves_stale_copy(self):
+        get_catalog_data('test', lambda: 'v1')
+        bump = cache.incr(CATALOG_VERSION_KEY)
+        cache.add(f'test:v{bump}:lock', 1)  # un autre worker reconstruit
+        self.assertEqual(get_catalog_data('test', lambda: 'v2'), 'v1')
+
+
+class ProductCardProjectionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Téléphones")
+
+    def create_products(self, count):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            product = Product.objects.create(
+                name=f"Produit {i}", description="Longue description", price=750, original_price=1000,
+                category=self.category
+            )
+            ProductImage.objects.create(product=product, image=f"products/{i}.jpg")
+            ProductFeature.objects.create(product=product, name="Écran", value="6 pouces")
+
+    def listing_queries(self):
+        cache.clear()  # facettes précalculées: mesurer toujours à froid
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('core:product_list'), {'sort_by': 'newest'})
+        return len(queries)
+
+    def test_grid_cost_does_not_depend_on_card_count(self):
+        self.create_products(3)
+        small = self.listing_queries()
+        self.create_products(9)
+        self.assertEqual(self.listing_queries(), small)
+
+    def test_card_fields_are_precomputed(self):
+        self.create_products(1)
+        product = Product.objects.for_cards().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(product.discount_badge, 25)
+            self.assertTrue(product.on_sale_badge)
+            self.assertEqual(product.card_image.image.name, "products/0.jpg")
+            self.assertEqual(product.category.name, "Téléphones")
+            self.assertEqual(len(product.card_features), 1)
+        self.assertEqual(product.get_deferred_fields(), {'description', 'colors', 'sku', 'is_active',
+                                                         'updated_at', 'weight', 'dimensions'})
+
+
+class ProductFacetsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Téléphones")
+        specs = [
+            (5000, None, ['noir', ' Bleu'], 4.5, 3),
+            (30000, 40000, ['Noir'], 3.2, 0),
+            (120000, None, ['Rouge'], 0, 5),
+        ]
+        for i, (price, original_price, colors, rating, stock) in enumerate(specs):
+            Product.objects.create(
+                name=f"Produit {i}", description="Description", price=price, original_price=original_price,
+                colors=colors, rating=rating, stock_quantity=stock, category=self.category
+            )
+
+    def test_color_index_follows_product(self):
+        product = Product.objects.get(name="Produit 0")
+        self.assertEqual(sorted(product.color_index.values_list('color', flat=True)), ['Bleu', 'Noir'])
+        product.colors = ['Blanc']
+        product.save(update_fields=['colors'])
+        self.assertEqual(list(product.color_index.values_list('color', flat=True)), ['Blanc'])
+
+    def test_filters_and_counts(self):
+        response = self.client.get(reverse('core:product_list'), {'color': 'noir', 'rating': '3'})
+        self.assertEqual(len(response.context['products']), 2)
+        facets = response.context['facets']
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual({c['value']: c['count'] for c in facets['colors']}, {'Noir': 2, 'Bleu': 1})
+        self.assertEqual({a['value']: a['count'] for a in facets['availability']}, {'in_stock': 1, 'on_sale': 1})
+        self.assertEqual([r['count'] for r in facets['price']], [1, 1, 0, 0, 0])
+
+        response = self.client.get(reverse('core:product_list'), {'price': '100000-250000,0-10000'})
+        self.assertEqual({p.name for p in response.context['products']}, {"Produit 0", "Produit 2"})
+
+    def test_facets_cost_is_fixed(self):
+        def count_queries(params):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('core:product_list'), params)
+            return len(queries)
+
+        params = {'color': 'Noir,Rouge,Bleu', 'availability': 'in_stock', 'price': '0-10000,250000-'}
+        baseline = count_queries(params)
+        for i in range(3, 10):
+            Product.objects.create(name=f"Produit {i}", description="Description", price=1000 * i,
+                                   colors=['Vert', 'Gris', f'Couleur {i}'], category=self.category)
+        self.assertEqual(count_queries(params), baseline)
+
+
+class ProductReviewStatsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Téléphones")
+        self.product = Product.objects.create(name="Produit A", description="", price=1000, category=category)
+        ProductImage.objects.create(product=self.product, image="products/a.jpg", order=0)
+        ProductImage.objects.create(product=self.product, image="products/b.jpg", order=1, is_featured=True)
+
+    def add_reviews(self, ratings, is_approved=True):
+        start = User.objects.count()
+        for i, rating in enumerate(ratings, start):
+            user = User.objects.create_user(f'reviewer{i}', f'reviewer{i}@example.com', 'password')
+            ProductReview.objects.create(
+                product=self.product, user=user, rating=rating, title="Avis", comment="", is_approved=is_approved
+            )
+
+    def detail_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:product_detail', args=[self.product.slug]))
+        return response, len(queries)
+
+    def test_histogram_follows_approval(self):
+        self.add_reviews([5, 5, 3])
+        self.add_reviews([1], is_approved=False)
+        stats = self.product.review_stats
+        self.assertEqual(stats.histogram, [(5, 2), (4, 0), (3, 1), (2, 0), (1, 0)])
+        self.assertAlmostEqual(stats.average, 13 / 3)
+
+        review = ProductReview.objects.get(rating=1)
+        review.is_approved = True
+        review.save()
+        stats.refresh_from_db()
+        self.assertEqual((stats.total, stats.rating_1), (4, 1))
+
+    def test_detail_cost_does_not_depend_on_review_count(self):
+        self.add_reviews([4])
+        response, few = self.detail_queries()
+        self.assertEqual(response.context['main_image'].image.name, "products/b.jpg")
+        self.assertEqual([image.image.name for image in response.context['other_images']], ["products/a.jpg"])
+        self.add_reviews([5, 3, 2, 1, 5, 4])
+        response, many = self.detail_queries()
+        self.assertEqual(many, few)
+        self.assertEqual(response.context['total_reviews'], 7)
+
+
+class ProductCountersTestCase(TestCase):
+    def setUp(self):
+        counters.buffer.take()
+        category = Category.objects.create(name="Téléphones")
+        self.product = Product.objects.create(name="Produit A", description="", price=1000, category=category)
+
+    def test_views_and_clicks_are_buffered_then_flushed_in_batch(self):
+        with patch.object(counters, 'COUNTER_FLUSH_INTERVAL', 3600):
+            for _ in range(3):
+                self.client.get(reverse('core:product_detail', args=[self.product.slug]))
+            self.client.post(reverse('core:track_product_click', args=[self.product.id]))
+        self.assertFalse(TrendingProduct.objects.exists())
+
+        # Produits existants, puis INSERT OR IGNORE + UPDATE groupé (dans un savepoint)
+        with self.assertNumQueries(5):
+            counters.flush_counters(force=True)
+        row = TrendingProduct.objects.get(product=self.product, period='daily')
+        self.assertEqual((row.views, row.clicks), (3, 1))
+
+        counters.record_view(self.product.id)
+        counters.record_view(0)  # produit supprimé entre-temps: ignoré
+        counters.flush_counters(force=True)
+        row.refresh_from_db()
+        self.assertEqual(row.views, 4)
+
+
+class TrendingRankingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        counters.buffer.take()
+        self.today = timezone.localdate()
+        self.viewed = Product.objects.create(name="Produit vu", description="", price=1000)
+        self.sold = Product.objects.create(name="Produit vendu", description="", price=1000)
+        self.old = Product.objects.create(name="Produit ancien", description="", price=1000)
+        TrendingProduct.objects.create(product=self.viewed, period='daily', date=self.today, views=8)
+        TrendingProduct.objects.create(product=self.old, period='daily', date=self.today - timedelta(days=5), views=30)
+        TrendingProduct.objects.create(product=self.old, period='daily', date=self.today - timedelta(days=40), views=9)
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cart = Cart.objects.create(user=user)
+        order = Order.objects.create(user=user, cart=cart, subtotal=1000, total=1000, payment_method='cash')
+        OrderItem.objects.create(order=order, product=self.sold, quantity=1, price=1000, total_price=1000)
+        self.order = order
+
+    def ranks(self, period):
+        return list(TrendingProduct.objects.filter(period=period, date=self.today)
+                    .filter(rank__gt=0).order_by('rank').values_list('product__name', flat=True))
+
+    def test_rolling_windows_with_decay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('compute_trending', stdout=StringIO())
+        self.assertEqual(self.ranks('daily'), ["Produit vendu", "Produit vu"])
+        self.assertEqual(self.ranks('weekly'), ["Produit vendu", "Produit vu", "Produit ancien"])
+        self.assertEqual(self.ranks('monthly'), ["Produit ancien", "Produit vendu", "Produit vu"])
+        self.assertEqual(TrendingProduct.objects.get(product=self.viewed, period='daily').views, 8)
+        self.assertFalse(TrendingProduct.objects.filter(date__lt=self.today - timedelta(days=30)).exists())
+
+    def test_second_run_writes_nothing(self):
+        compute_trending()
+        self.assertEqual(compute_trending(), {'created': 0, 'updated': 0, 'deleted': 0, 'pruned': 0})
+
+    def test_same_day_run_rescores_changed_products_only(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            compute_trending()
+        for _ in range(40):
+            counters.record_view(self.viewed.id)
+        counters.flush_counters(force=True)
+        with patch.object(trending, 'collect_signals', wraps=trending.collect_signals) as collect:
+            with self.captureOnCommitCallbacks(execute=True):
+                compute_trending()
+        self.assertEqual(collect.call_args.args[1], {self.viewed.pk})
+        self.assertEqual(self.ranks('daily'), ["Produit vu", "Produit vendu"])
+        self.assertEqual(self.ranks('monthly'), ["Produit vu", "Produit ancien", "Produit vendu"])
+
+        # Commande annulée: un produit classé perd des points, recalcul complet
+        cancel_order(self.order)
+        with patch.object(trending, 'collect_signals', wraps=trending.collect_signals) as collect:
+            compute_trending()
+        self.assertEqual([call.args[1] for call in collect.call_args_list], [{self.sold.pk}, None])
+        self.assertEqual(self.ranks('daily'), ["Produit vu"])
+
+    def test_cart_adds_survive_checkout(self):
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        added = Product.objects.create(name="Produit ajouté", description="", price=1000, stock_quantity=5)
+        self.client.force_login(user)
+        self.client.post(reverse('core:add_to_cart', args=[added.id]), {'quantity': 2})
+        CartItem.objects.filter(product=added).delete()  # lignes supprimées à la commande
+        counters.flush_counters(force=True)
+        compute_trending()
+        self.assertEqual(TrendingProduct.objects.get(product=added, period='daily').cart_adds, 1)
+        self.assertIn("Produit ajouté", self.ranks('weekly'))
+
+
+class ProductSimilarityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Téléphones")
+        self.phone, self.case, self.charger, self.other = [
+            Product.objects.create(name=name, description="", price=1000, category=self.category)
+            for name in ("Téléphone", "Coque", "Chargeur", "Autre")
+        ]
+        for i, products in enumerate([(self.phone, self.case), (self.phone, self.case), (self.phone, self.charger)]):
+            user = User.objects.create_user(f'buyer{i}', f'buyer{i}@example.com', 'password')
+            cart = Cart.objects.create(user=user)
+            order = Order.objects.create(user=user, cart=cart, subtotal=0, total=0, payment_method='cash')
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=1000, total_price=1000)
+        Favorite.objects.create(user=user, product=self.other)
+        Favorite.objects.create(user=user, product=self.charger)
+
+    def test_neighbours_are_ranked_by_cooccurrence(self):
+        call_command('build_similarities', stdout=StringIO())
+        neighbours = list(ProductSimilarity.objects.filter(product=self.phone).values_list('similar__name', flat=True))
+        self.assertEqual(neighbours, ["Coque", "Chargeur"])
+        self.assertEqual(ProductSimilarity.objects.get(product=self.other).similar, self.charger)
+
+    def test_detail_page_uses_precomputed_neighbours(self):
+        build_similarities()
+        response = self.client.get(reverse('core:product_detail', args=[self.phone.slug]))
+        self.assertEqual(response.context['similar_products'][:2], [self.case, self.charger])
+        self.assertEqual(len(response.context['similar_products']), 3)  # complété par la catégorie
+
+
+class SearchSuggestionsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Écouteurs")
+        self.popular = Product.objects.create(name="Écouteurs Sans Fil Pro", description="", price=1000,
+                                              sku="EAR-PRO", sales_count=50, category=self.category)
+        Product.objects.create(name="Écouteurs Filaires", description="", price=1000, sku="EAR-WIRE")
+        suggest_module.index.load()
+
+    def labels(self, query):
+        return [item['label'] for item in suggest_module.suggest(query)]
+
+    def test_accent_folded_prefix_ranked_by_popularity(self):
+        self.assertEqual(self.labels("ecou"), ["Écouteurs", "Écouteurs Sans Fil Pro", "Écouteurs Filaires"])
+        self.assertEqual(self.labels("sans f"), ["Écouteurs Sans Fil Pro"])
+        self.assertEqual(self.labels("ear-w"), ["Écouteurs Filaires"])
+
+    def test_index_follows_catalog_without_queries_per_keystroke(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Enceinte Bluetooth", description="", price=1000)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels("blue"), ["Enceinte Bluetooth"])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels("blue"), [])
+            response = self.client.get(reverse('core:search_suggestions'), {'q': 'fila'})
+        self.assertEqual(response.json()['suggestions'][0]['url'], "/products/ecouteurs-filaires/")
+
+    def test_popular_match_found_beyond_first_keys(self):
+        Product.objects.bulk_create([
+            Product(name=f"Zeta a{number:04d}", slug=f"zeta-a{number:04d}", sku=f"ZA-{number}", description="", price=1)
+            for number in range(1200)
+        ] + [Product(name="Zeta zz", slug="zeta-zz", sku="ZZ", description="", price=1, sales_count=5)])
+        suggest_module.index.load()
+        self.assertEqual(self.labels("zeta")[0], "Zeta zz")
+
+    def test_changes_from_other_processes_applied_by_delta(self):
+        # Catalogue modifié ailleurs: version du catalogue sans effet, compteur de l'index rattrapé par updated_at
+        incr_version(CATALOG_VERSION_KEY)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels("sans f"), ["Écouteurs Sans Fil Pro"])
+        Product.objects.filter(pk=self.popular.pk).update(name="Casque Sans Fil Pro", updated_at=timezone.now())
+        incr_version(suggest_module.SUGGEST_VERSION_KEY)
+        # Compteurs partagés non relus avant le délai de vérification: aucune lecture du cache par frappe
+        with patch.object(suggest_module.cache, 'get_many') as get_many:
+            self.assertEqual(self.labels("sans f"), ["Écouteurs Sans Fil Pro"])
+        get_many.assert_not_called()
+        suggest_module.index.checked_at -= suggest_module.SUGGEST_PROBE_INTERVAL
+        with self.assertNumQueries(2):
+            self.assertEqual(self.labels("sans f"), ["Casque Sans Fil Pro"])
+        self.assertEqual(self.labels("ecou"), ["Écouteurs", "Écouteurs Filaires"])
+
+
+class CartTotalsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.cart = Cart.objects.create(user=self.user)
+        self.phone = Product.objects.create(name="Téléphone", description="", price=1500, stock_quantity=10)
+        self.case = Product.objects.create(name="Coque", description="", price=250, stock_quantity=10)
+
+    def test_totals_follow_item_changes(self):
+        stale = Cart.objects.get(pk=self.cart.pk)
+        item = CartItem.objects.create(cart=self.cart, product=self.phone, quantity=2, price=0)
+        CartItem.objects.create(cart=self.cart, product=self.case, quantity=1, price=0)
+        self.cart.reload_totals()
+        self.assertEqual((self.cart.item_count, self.cart.quantity_total, self.cart.subtotal), (2, 3, 3250))
+
+        stale.note = "Livrer le soir"
+        stale.save()  # copie périmée: les totaux ne sont pas écrasés
+        item.delete()
+        self.cart.reload_totals()
+        self.assertEqual((self.cart.item_count, self.cart.quantity_total, self.cart.subtotal), (1, 1, 250))
+
+    def test_nested_deferral_keeps_totals_deferred(self):
+        CartItem.objects.create(cart=self.cart, product=self.phone, quantity=2, price=0)
+        with deferred_cart_totals():
+            with deferred_cart_totals():
+                pass
+            CartItem.objects.create(cart=self.cart, product=self.case, quantity=1, price=0)
+        self.cart.reload_totals()
+        self.assertEqual(self.cart.quantity_total, 2)
+        Cart.refresh_totals(self.cart.pk)
+        self.cart.reload_totals()
+        self.assertEqual(self.cart.quantity_total, 3)
+
+    def test_header_badge_is_a_single_read(self):
+        CartItem.objects.create(cart=self.cart, product=self.phone, quantity=2, price=0)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('core:add_to_cart', args=[self.case.id]), {'quantity': 3},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['cart_items_count'], 5)
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            context = cart_context(request)
+        self.assertEqual((context['cart_count'], context['cart_quantity'], context['cart_total']), (2, 5, 3750))
+
+
+class SessionCartTestCase(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(name="Téléphone", description="", price=1500, stock_quantity=10)
+        self.case = Product.objects.create(name="Coque", description="", price=250, stock_quantity=10)
+
+    def add(self, product, quantity):
+        return self.client.post(reverse('core:add_to_cart', args=[product.id]), {'quantity': quantity},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_anonymous_cart_writes_no_rows(self):
+        self.client.get(reverse('core:cart_view'))
+        self.add(self.phone, 2)
+        self.assertEqual(self.add(self.case, 1).json()['cart_items_count'], 3)
+        self.client.post(reverse('core:update_cart_item', args=[self.phone.id]), {'quantity': 4})
+        response = self.client.get(reverse('core:cart_view'))
+        self.assertEqual(response.context['cart'].subtotal, 6250)
+        self.assertEqual(response.context['cart_quantity'], 5)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_session_cart_is_materialized_in_bulk(self):
+        self.add(self.phone, 2)
+        self.add(self.case, 1)
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.phone, quantity=1, price=0)
+
+        request = RequestFactory().get('/')
+        request.user, request.session = user, self.client.session
+        request.session.items()  # chargement de la session hors du décompte
+        # Prix, lignes existantes, upsert groupé et totaux (dans un savepoint), relecture
+        with self.assertNumQueries(7):
+            materialize_session_cart(request, cart)
+        self.assertEqual((cart.item_count, cart.quantity_total, cart.subtotal), (2, 4, 4750))
+        self.assertFalse(SessionCart(request.session))
+
+
+class CartBatchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.cart = Cart.objects.create(user=self.user)
+        self.phone = Product.objects.create(name="Téléphone", description="", price=1500, stock_quantity=10)
+        self.case = Product.objects.create(name="Coque", description="", price=250, stock_quantity=10)
+        self.cable = Product.objects.create(name="Câble", description="", price=100, stock_quantity=3)
+        CartItem.objects.create(cart=self.cart, product=self.phone, quantity=1, price=0)
+        CartItem.objects.create(cart=self.cart, product=self.case, quantity=1, price=0)
+
+    def batch(self, operations):
+        return self.client.post(reverse('core:batch_update_cart'), {'operations': operations},
+                                content_type='application/json')
+
+    def test_batch_is_applied_in_bulk(self):
+        operations = parse_cart_operations([
+            {'op': 'set', 'product_id': self.phone.id, 'quantity': 3},
+            {'op': 'remove', 'product_id': self.case.id},
+            {'op': 'add', 'product_id': self.cable.id, 'quantity': 2},
+        ])
+        # Lignes, stocks, puis INSERT, UPDATE, DELETE (SELECT + DELETE), totaux dans un savepoint, relecture
+        with self.assertNumQueries(10):
+            apply_cart_operations(self.cart, operations)
+        self.assertEqual((self.cart.item_count, self.cart.quantity_total, self.cart.subtotal), (2, 5, 4700))
+
+    def test_batch_is_all_or_nothing(self):
+        self.client.force_login(self.user)
+        response = self.batch([
+            {'op': 'set', 'product_id': self.phone.id, 'quantity': 2},
+            {'op': 'add', 'product_id': self.cable.id, 'quantity': 4},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['available_quantity'], 3)
+        self.assertEqual(self.cart.items.get(product=self.phone).quantity, 1)
+
+        response = self.batch([
+            {'op': 'add', 'product_id': self.cable.id, 'quantity': 1},
+            {'op': 'add', 'product_id': self.cable.id, 'quantity': 1},
+            {'op': 'set', 'product_id': self.case.id, 'quantity': 0},
+        ])
+        self.assertEqual(response.json()['cart_items_count'], 3)
+        self.assertEqual(response.json()['items'], {str(self.cable.id): 2, str(self.case.id): 0})
+        cable_line = self.cart.items.get(product=self.cable)
+        self.assertEqual(response.json()['item_totals'], {str(cable_line.id): '200.00'})
+
+    def test_anonymous_batch_stays_in_session(self):
+        response = self.batch([{'op': 'add', 'product_id': self.case.id, 'quantity': 2}])
+        self.assertEqual(response.json()['subtotal'], '500.00')
+        self.assertEqual(response.json()['item_totals'], {str(self.case.id): '500.00'})
+        self.assertEqual(self.batch([{'op': 'drop'}]).status_code, 400)
+        self.assertEqual(CartItem.objects.filter(cart__user__isnull=True).count(), 0)
+
+
+class CartMergeOnLoginTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.products = [
+            Product.objects.create(name=f"Produit {i}", description="", price=100, stock_quantity=5)
+            for i in range(6)
+        ]
+
+    def test_session_cart_is_merged_on_login(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=4, price=0)
+        for product in self.products:
+            self.client.post(reverse('core:add_to_cart', args=[product.id]), {'quantity': 2})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.login(username='shopper', password='password')
+        merge_queries = [q for q in queries.captured_queries if 'universepro_cart' in q['sql']]
+        # Lignes existantes, upsert, totaux et relecture, quel que soit le nombre d'articles
+        self.assertLessEqual(len(merge_queries), 6)
+
+        cart.reload_totals()
+        self.assertEqual((cart.item_count, cart.quantity_total), (6, 15))  # 4 + 2 plafonné au stock de 5
+        self.assertFalse(SessionCart(self.client.session))
+
+    def test_session_cart_is_materialized_at_checkout(self):
+        # Lignes ajoutées à la session après la connexion (fusion déjà passée)
+        self.client.force_login(self.user)
+        session = self.client.session
+        SessionCart(session).add(self.products[0].id, 2)
+        session.save()
+
+        coupon_index.load()
+        self.client.get(reverse('core:checkout'))
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.item_count, cart.quantity_total), (1, 2))
+        self.assertFalse(SessionCart(self.client.session))
+
+    def test_database_session_cart_merge(self):
+        cart = Cart.objects.create(user=self.user)
+        legacy = Cart.objects.create(session_key='abc')
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1, price=0)
+        CartItem.objects.create(cart=legacy, product=self.products[0], quantity=2, price=0)
+        CartItem.objects.create(cart=legacy, product=self.products[1], quantity=1, price=0)
+        cart.merge_with_session_cart(legacy)
+        self.assertEqual((cart.item_count, cart.quantity_total, cart.subtotal), (2, 4, 400))
+        self.assertFalse(Cart.objects.filter(pk=legacy.pk).exists())
+
+
+def add_to_cart_worker(cart_id, product_id, attempts):
+    """Processus concurrent: ajouts unitaires répétés au même panier"""
+    cart = Cart.objects.get(pk=cart_id)
+    product = Product.objects.get(pk=product_id)
+    added = sum(add_cart_line(cart, product, 1) for _ in range(attempts))
+    connection.close()
+    return added
+
+
+class ConcurrentAddToCartTestCase(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Base en mémoire: non partagée entre processus
+            self.skipTest("Nécessite une base de test partagée entre processus (fichier ou serveur)")
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def run_workers(self, product, workers=4, attempts=10):
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return sum(pool.starmap(add_to_cart_worker, [(self.cart.pk, product.pk, attempts)] * workers))
+
+    def test_no_lost_increments(self):
+        product = Product.objects.create(name="Téléphone", description="", price=1500, stock_quantity=1000)
+        self.assertEqual(self.run_workers(product), 40)
+        self.assertEqual(self.cart.items.get(product=product).quantity, 40)
+        self.cart.reload_totals()
+        self.assertEqual(self.cart.quantity_total, 40)
+
+    def test_stock_is_never_exceeded(self):
+        product = Product.objects.create(name="Coque", description="", price=250, stock_quantity=25)
+        self.assertEqual(self.run_workers(product), 25)
+        self.assertEqual(self.cart.items.get(product=product).quantity, 25)
+
+
+class AddToCartTestCase(TestCase):
+    def test_add_to_cart_increments_in_place(self):
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        product = Product.objects.create(name="Coque", description="", price=250, stock_quantity=5)
+        self.client.force_login(user)
+        url = reverse('core:add_to_cart', args=[product.id])
+        self.client.post(url, {'quantity': 3}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = self.client.post(url, {'quantity': 2}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['cart_items_count'], 5)
+        response = self.client.post(url, {'quantity': 1}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get(product=product).quantity, 5)
+
+    def test_stock_checked_in_database(self):
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        cart = Cart.objects.create(user=user)
+        product = Product.objects.create(name="Coque", description="", price=250, stock_quantity=5)
+        self.assertTrue(add_cart_line(cart, product, 2))
+        # Stock réduit ailleurs: l'instance chargée ne le sait pas, la clause WHERE si
+        Product.objects.filter(pk=product.pk).update(stock_quantity=3)
+        self.assertFalse(add_cart_line(cart, product, 2))
+        self.assertTrue(add_cart_line(cart, product, 1))
+        self.assertEqual(CartItem.objects.get(product=product).quantity, 3)
+
+        # Nouvelle ligne: même vérification en base
+        other = Cart.objects.create(session_key='autre')
+        self.assertFalse(add_cart_line(other, product, 4))
+        self.assertFalse(other.items.exists())
+
+
+class ShippingQuoteTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.cart = Cart.objects.create(user=self.user)
+        self.product = Product.objects.create(
+            name="Imprimante", description="", price=10000, stock_quantity=10, weight=1500
+        )
+        ShippingMethod.objects.create(name="Lomé express", price=2000, estimated_delivery="24h", regions=['Lomé'])
+        ShippingMethod.objects.create(name="Standard", price=3000, price_per_kg=500, estimated_delivery="3-5 jours")
+        ShippingMethod.objects.create(name="Pli léger", price=1000, max_weight=1000, estimated_delivery="3-5 jours")
+        shipping_rates.load()  # l'invalidation attend la fin de transaction, jamais atteinte ici
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1, price=0)
+        self.cart.reload_totals()
+
+    def test_quotes_use_weight_and_region(self):
+        quotes = cart_quotes(self.cart)
+        self.assertEqual([(quote.name, quote.price) for quote in quotes], [("Standard", 4000)])
+
+        address = Address(city="Lomé", state="Maritime", country="Togo")
+        quotes = cart_quotes(self.cart, address)
+        self.assertEqual([(quote.name, quote.price) for quote in quotes], [("Lomé express", 2000), ("Standard", 4000)])
+
+        CartItem.objects.filter(cart=self.cart).update(quantity=10)
+        Cart.refresh_totals(self.cart.pk)
+        self.cart.reload_totals()
+        self.assertEqual(cart_quotes(self.cart)[0].price, 0)  # seuil de livraison gratuite du site
+
+    def test_cart_view_is_a_pure_read(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('core:cart_view'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:cart_view'))
+        self.assertEqual(response.context['cart'].shipping_cost, 4000)
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertNotIn('UPDATE', statements)
+        self.assertNotIn('INSERT', statements)
+        # Tarifs en mémoire et devis mémorisé pour cette version du panier
+        self.assertFalse([query for query in queries.captured_queries if 'shippingmethod' in query['sql']])
+
+    def test_shipping_is_persisted_only_when_changed(self):
+        update_cart_shipping(self.cart)
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).shipping_cost, 4000)
+        with self.assertNumQueries(0):
+            update_cart_shipping(self.cart)
+
+
+class CouponEligibilityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.cart = Cart.objects.create(user=self.user)
+        self.phones = Category.objects.create(name="Téléphones")
+        self.android = Category.objects.create(name="Android", parent=self.phones)
+        self.audio = Category.objects.create(name="Audio")
+        self.phone = Product.objects.create(
+            name="Téléphone", description="", price=50000, stock_quantity=10, category=self.android
+        )
+        self.headset = Product.objects.create(
+            name="Casque", description="", price=20000, stock_quantity=10, category=self.audio
+        )
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(
+            code="PHONE10", discount_type='percentage', discount_value=10, max_uses=100,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+        self.coupon.categories.add(self.phones)
+
+    def test_descendant_categories_are_eligible(self):
+        CartItem.objects.create(cart=self.cart, product=self.headset, quantity=1, price=0)
+        self.cart.reload_totals()
+        self.assertFalse(self.cart.apply_coupon(self.coupon))
+
+        CartItem.objects.create(cart=self.cart, product=self.phone, quantity=1, price=0)
+        self.cart.reload_totals()
+        self.assertTrue(self.cart.apply_coupon(self.coupon))
+        self.assertEqual(self.cart.coupon_discount, 7000)
+
+    def test_application_costs_constant_queries(self):
+        for index in range(10):
+            product = Product.objects.create(
+                name=f"Téléphone {index}", description="", price=1000, stock_quantity=10, category=self.android
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1, price=0)
+        self.cart.reload_totals()
+        self.cart.apply_coupon(self.coupon)  # compilation du périmètre
+        # Lignes du panier, puis écriture du coupon
+        with self.assertNumQueries(2):
+            self.assertTrue(self.cart.apply_coupon(self.coupon))
+
+    def test_scope_follows_m2m_changes(self):
+        CartItem.objects.create(cart=self.cart, product=self.headset, quantity=1, price=0)
+        self.cart.reload_totals()
+        self.assertFalse(self.cart.apply_coupon(self.coupon))
+        self.coupon.products.add(self.headset)
+        self.assertTrue(self.cart.apply_coupon(self.coupon))
+
+
+def redeem_worker(coupon_id, user_ids):
+    """Processus concurrent: une tentative d'utilisation par client"""
+    coupon = Coupon.objects.get(pk=coupon_id)
+    redeemed = sum(redeem_coupon(coupon, User(pk=user_id)) is not None for user_id in user_ids)
+    connection.close()
+    return redeemed
+
+
+class CouponRedemptionTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.coupon = Coupon.objects.create(
+            code="FLASH", discount_type='fixed', discount_value=1000, max_uses=2, max_uses_per_user=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+
+    def test_redemption_limits(self):
+        self.assertIsNotNone(redeem_coupon(self.coupon, self.user))
+        self.assertIsNone(redeem_coupon(self.coupon, self.user))  # limite par client
+
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.assertIsNotNone(redeem_coupon(self.coupon, other))
+        third = User.objects.create_user('third', 'third@example.com', 'password')
+        self.assertIsNone(redeem_coupon(self.coupon, third))  # max_uses atteint
+
+        self.coupon.refresh_from_db()
+        self.assertEqual((self.coupon.current_uses, self.coupon.is_active), (2, False))
+        self.assertEqual(CouponRedemption.objects.filter(coupon=self.coupon).count(), 2)
+
+    def test_released_use_number_is_reused(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(max_uses=10, max_uses_per_user=3)
+        self.coupon.refresh_from_db()
+        cart = Cart.objects.create(user=self.user)
+        orders = [
+            Order.objects.create(user=self.user, cart=cart, subtotal=1000, total=1000, payment_method='cash')
+            for _ in range(2)
+        ]
+        for order in orders:
+            self.assertIsNotNone(redeem_coupon(self.coupon, self.user, order))
+        release_coupon_uses([orders[0].pk])  # première commande annulée: utilisation #1 rendue
+        self.coupon.refresh_from_db()
+        self.assertEqual(redeem_coupon(self.coupon, self.user).use_number, 1)
+        self.assertEqual(redeem_coupon(self.coupon, self.user).use_number, 3)
+        self.assertIsNone(redeem_coupon(self.coupon, self.user))  # limite par client
+
+
+class ConcurrentCouponRedemptionTestCase(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Base en mémoire: non partagée entre processus
+            self.skipTest("Nécessite une base de test partagée entre processus (fichier ou serveur)")
+
+    def test_exactly_max_uses_succeed(self):
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code="FLASH", discount_type='fixed', discount_value=1000, max_uses=50,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+        User.objects.bulk_create([User(username=f'client{index}') for index in range(2000)])
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        workers = 8
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            redeemed = sum(pool.starmap(
+                redeem_worker, [(coupon.pk, user_ids[index::workers]) for index in range(workers)]
+            ))
+        self.assertEqual(redeemed, 50)
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.current_uses, 50)
+        self.assertEqual(CouponRedemption.objects.filter(coupon=coupon).count(), 50)
+
+
+class BestCouponTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.window = {'valid_from': now - timedelta(days=1), 'valid_to': now + timedelta(days=1)}
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.cart = Cart.objects.create(user=self.user)
+        self.phones = Category.objects.create(name="Téléphones")
+        self.android = Category.objects.create(name="Android", parent=self.phones)
+        self.phone = Product.objects.create(
+            name="Téléphone", description="", price=50000, stock_quantity=10, category=self.android
+        )
+        self.other = Product.objects.create(name="Casque", description="", price=20000, stock_quantity=10)
+        CartItem.objects.create(cart=self.cart, product=self.phone, quantity=1, price=0)
+        self.cart.reload_totals()
+
+        Coupon.objects.create(code="BIENVENUE", discount_type='fixed', discount_value=1000,
+                              max_uses=100, auto_apply=True, **self.window)
+        self.category_coupon = Coupon.objects.create(code="PHONE10", discount_type='percentage', discount_value=10,
+                                                     max_uses=100, auto_apply=True, **self.window)
+        self.category_coupon.categories.add(self.phones)
+        other_coupon = Coupon.objects.create(code="CASQUE", discount_type='fixed', discount_value=9000,
+                                             max_uses=100, auto_apply=True, **self.window)
+        other_coupon.products.add(self.other)
+        Coupon.objects.create(code="MANUEL", discount_type='fixed', discount_value=20000,
+                              max_uses=100, **self.window)
+
+    def test_best_applicable_coupon_is_selected(self):
+        coupon_index.load()
+        self.assertEqual(best_coupon(self.cart, self.user).code, "PHONE10")  # 5000 > 1000
+
+        redeem_coupon(self.category_coupon, self.user)
+        self.assertEqual(best_coupon(self.cart, self.user).code, "BIENVENUE")  # limite par client atteinte
+
+    def test_lookup_cost_does_not_grow_with_coupons(self):
+        campaign = Coupon.objects.bulk_create([
+            Coupon(code=f"CAMPAGNE{index}", discount_type='fixed', discount_value=500,
+                   max_uses=100, auto_apply=True, **self.window)
+            for index in range(2000)
+        ])
+        Coupon.products.through.objects.bulk_create([
+            Coupon.products.through(coupon_id=coupon.pk, product_id=self.other.pk) for coupon in campaign
+        ])
+        coupon_index.load()
+        # Lignes du panier, utilisations du client
+        with self.assertNumQueries(2):
+            self.assertEqual(best_coupon(self.cart, self.user).code, "PHONE10")
+
+    def test_checkout_applies_best_coupon(self):
+        coupon_index.load()
+        self.client.force_login(self.user)
+        self.client.get(reverse('core:checkout'))
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.coupon.code, self.cart.coupon_discount), ("PHONE10", 5000))
+
+
+class CouponCampaignTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.phones = Category.objects.create(name="Téléphones")
+        self.template = Coupon.objects.create(
+            code="NOEL", discount_type='percentage', discount_value=15, max_uses=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30)
+        )
+        self.template.categories.add(self.phones)
+
+    def test_campaign_codes_are_unique_copies(self):
+        self.assertEqual(generate_campaign(self.template, 500, prefix='NOEL-', chunk_size=200), 500)
+        codes = list(self.template.generated_codes.values_list('code', flat=True))
+        self.assertEqual(len(set(codes)), 500)
+        self.assertTrue(all(code.startswith('NOEL-') for code in codes))
+        self.assertEqual(
+            Coupon.categories.through.objects.filter(coupon__template=self.template, category=self.phones).count(), 500
+        )
+
+    def test_unknown_codes_are_rejected_without_queries(self):
+        generate_campaign(self.template, 50)
+        code_filter.load()
+        code = self.template.generated_codes.values_list('code', flat=True).first()
+        with self.assertNumQueries(0):
+            self.assertFalse(code_filter.might_exist("INCONNU42"))
+            self.assertTrue(code_filter.might_exist(code))
+
+        self.client.force_login(self.user)
+        with self.assertNumQueries(2):  # session, utilisateur
+            response = self.client.post(reverse('core:apply_coupon'), {'coupon_code': "INCONNU42"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_codes_created_elsewhere_are_picked_up(self):
+        code_filter.load()
+        # Créé par un autre processus (insertion groupée: aucun signal reçu ici)
+        Coupon.objects.bulk_create([Coupon(
+            code="AILLEURS", discount_type='fixed', discount_value=500, max_uses=1,
+            valid_from=self.template.valid_from, valid_to=self.template.valid_to
+        )])
+        # Avant le délai de vérification: ni requête ni lecture du cache
+        with self.assertNumQueries(0), patch.object(catalog_cache.cache, 'get') as cache_get:
+            self.assertFalse(code_filter.might_exist("AILLEURS"))
+        cache_get.assert_not_called()
+        code_filter.checked_at -= CODE_FILTER_PROBE_INTERVAL + 1
+        with self.assertNumQueries(1):
+            self.assertTrue(code_filter.might_exist("AILLEURS"))
+        with self.assertNumQueries(0):
+            self.assertTrue(code_filter.might_exist("AILLEURS"))
+
+    def test_late_committed_codes_are_not_skipped(self):
+        code_filter.load()
+        values = dict(discount_type='fixed', discount_value=500, max_uses=1,
+                      valid_from=self.template.valid_from, valid_to=self.template.valid_to)
+        Coupon.objects.bulk_create([Coupon(code="RECENT", **values)])
+        code_filter.expire()
+        self.assertTrue(code_filter.might_exist("RECENT"))
+        # Lot horodaté avant RECENT mais validé après sa lecture
+        Coupon.objects.bulk_create([Coupon(code="TARDIF", **values)])
+        Coupon.objects.filter(code="TARDIF").update(updated_at=timezone.now() - timedelta(seconds=30))
+        size = len(code_filter.hashes)
+        code_filter.expire()
+        self.assertTrue(code_filter.might_exist("TARDIF"))
+        self.assertEqual(len(code_filter.hashes), size + 1)  # RECENT relu sans doublon
+
+
+def order_worker(cart_ids):
+    """Processus concurrent: une commande par panier, chacune dans sa transaction"""
+    numbers = []
+    for cart_id in cart_ids:
+        with transaction.atomic():
+            order = Order.objects.create(cart_id=cart_id, subtotal=0, total=0, payment_method='cash')
+        numbers.append(order.order_number)
+    connection.close()
+    return numbers
+
+
+class OrderNumberTestCase(TestCase):
+    def test_order_creation_needs_no_read(self):
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        cart = Cart.objects.create(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            order_numbers.allocate()  # bloc réservé puis acquis à la validation
+        with self.assertNumQueries(1):
+            order = Order.objects.create(user=user, cart=cart, subtotal=0, total=0, payment_method='cash')
+        self.assertRegex(order.order_number, r'^CMD-\d{6,}$')
+
+
+class ConcurrentOrderNumberTestCase(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Base en mémoire: non partagée entre processus
+            self.skipTest("Nécessite une base de test partagée entre processus (fichier ou serveur)")
+
+    def test_numbers_never_collide(self):
+        User.objects.bulk_create([User(username=f'client{index}') for index in range(400)])
+        Cart.objects.bulk_create([Cart(user_id=pk) for pk in User.objects.values_list('pk', flat=True)])
+        cart_ids = list(Cart.objects.values_list('pk', flat=True))
+        workers = 8
+        connections.close_all()
+        # Petits blocs: nombreuses réservations concurrentes
+        with patch.object(order_numbers, 'block_size', 7), \
+                multiprocessing.get_context('fork').Pool(workers) as pool:
+            numbers = sum(pool.map(order_worker, [cart_ids[index::workers] for index in range(workers)]), [])
+        self.assertEqual(len(numbers), 400)
+        self.assertEqual(len(set(numbers)), 400)
+        self.assertEqual(Order.objects.values('order_number').distinct().count(), 400)
+
+
+class PlaceOrderTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.address = Address.objects.create(
+            user=self.user, first_name="Ama", last_name="K", phone="90000000",
+            address_line1="Rue 1", city="Lomé", postal_code="00228"
+        )
+
+    def fill_cart(self, size, stock=5):
+        cart = Cart.objects.create(user=self.user, session_key=f'cart-{size}')
+        products = Product.objects.bulk_create([
+            Product(name=f"Produit {size}-{index}", slug=f"produit-{size}-{index}", sku=f"P{size}-{index}",
+                    description="", price=1000, stock_quantity=stock)
+            for index in range(size)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2, price=product.price) for product in products
+        ])
+        Cart.refresh_totals(cart.pk)
+        cart.refresh_from_db()
+        return cart, products
+
+    def test_order_is_placed_in_constant_queries(self):
+        counts = []
+        for size in (2, 20):
+            cart, products = self.fill_cart(size)
+            with CaptureQueriesContext(connection) as queries:
+                order = place_order(cart, self.user, self.address, 'cash')
+            counts.append(len(queries))
+            self.assertEqual((order.items.count(), order.subtotal), (size, size * 2000))
+        self.assertEqual(counts[0], counts[1])
+
+        product = Product.objects.get(pk=products[0].pk)
+        self.assertEqual((product.stock_quantity, product.sales_count, product.in_stock), (3, 2, True))
+        cart.refresh_from_db()
+        self.assertEqual((cart.items.count(), cart.item_count, cart.subtotal), (0, 0, 0))
+
+    def test_insufficient_stock_changes_nothing(self):
+        cart, products = self.fill_cart(3)
+        Product.objects.filter(pk=products[2].pk).update(stock_quantity=1)
+        with self.assertRaises(ValidationError) as raised:
+            place_order(cart, self.user, self.address, 'cash')
+        self.assertEqual(raised.exception.code, 'stock')
+        self.assertEqual(Product.objects.get(pk=products[0].pk).stock_quantity, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.items.count(), 3)
+
+    def test_sold_out_product_leaves_stock(self):
+        cart, products = self.fill_cart(1, stock=2)
+        place_order(cart, self.user, self.address, 'cash')
+        product = Product.objects.get(pk=products[0].pk)
+        self.assertEqual((product.stock_quantity, product.in_stock), (0, False))
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Édition limitée", description="", price=10000, stock_quantity=1)
+        self.buyers = []
+        for name in ('first', 'second'):
+            user = User.objects.create_user(name, f'{name}@example.com', 'password')
+            address = Address.objects.create(
+                user=user, first_name=name, last_name="K", phone="90000000",
+                address_line1="Rue 1", city="Lomé", postal_code="00228"
+            )
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1, price=0)
+            cart.reload_totals()
+            self.buyers.append((cart, user, address))
+
+    def test_hold_prevents_overselling(self):
+        cart, user, address = self.buyers[0]
+        reserve_order(cart, user, address, 'mobile_money')
+        self.assertEqual(available_quantities([self.product.pk]), {self.product.pk: 0})
+
+        cart, user, address = self.buyers[1]
+        for attempt in (place_order, reserve_order):
+            with self.assertRaises(ValidationError) as raised:
+                attempt(cart, user, address, 'cash')
+            self.assertEqual(raised.exception.code, 'stock')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_payment_converts_hold(self):
+        cart, user, address = self.buyers[0]
+        order = reserve_order(cart, user, address, 'mobile_money')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 1)
+
+        self.assertTrue(confirm_order(order))
+        self.assertFalse(confirm_order(order))  # rappel et suivi du client
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.stock_quantity, product.in_stock, product.sales_count), (0, False, 1))
+        self.assertFalse(StockReservation.objects.exists())
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('confirmed', True))
+        self.assertFalse(cart.items.exists())
+
+    def test_expired_or_refused_holds_are_released(self):
+        cart, user, address = self.buyers[0]
+        order = reserve_order(cart, user, address, 'mobile_money')
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available_quantities([self.product.pk]), {self.product.pk: 1})
+        call_command('release_stock_reservations', stdout=StringIO())
+        self.assertFalse(StockReservation.objects.exists())
+
+        other = reserve_order(*self.buyers[1], 'mobile_money')
+        cancel_order(other)
+        self.assertEqual((other.status, StockReservation.objects.count()), ('cancelled', 0))
+        place_order(*self.buyers[1], 'cash')
+        # Paiement arrivé après expiration, dernier exemplaire vendu entre-temps
+        with self.assertRaises(ValidationError):
+            confirm_order(order)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('cancelled', False))  # annulée par le balayage
+
+    def test_cancelled_reservation_gives_coupon_back(self):
+        cart, user, address = self.buyers[0]
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code="DERNIER", discount_type='fixed', discount_value=1000, max_uses=1, max_uses_per_user=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+        self.assertTrue(cart.apply_coupon(coupon))
+        cancel_order(reserve_order(cart, user, address, 'mobile_money'))
+        coupon.refresh_from_db()
+        self.assertEqual((coupon.current_uses, coupon.is_active), (0, True))
+
+        expired = reserve_order(cart, user, address, 'mobile_money')
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('release_stock_reservations', stdout=StringIO())
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, 'cancelled')
+
+        order = place_order(cart, user, address, 'cash')
+        self.assertEqual(order.coupon_discount, 1000)
+        coupon.refresh_from_db()
+        self.assertEqual((coupon.current_uses, coupon.is_active), (1, False))
+        self.assertEqual(list(CouponRedemption.objects.values_list('order_id', flat=True)), [order.pk])
+
+    def test_new_attempt_supersedes_abandoned_payment(self):
+        cart, user, address = self.buyers[0]
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code="RETOUR", discount_type='fixed', discount_value=1000, max_uses=5, max_uses_per_user=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1)
+        )
+        self.assertTrue(cart.apply_coupon(coupon))
+        abandoned = reserve_order(cart, user, address, 'mobile_money')
+        # Sans attendre l'expiration ni le balayage: stock et coupon de la tentative abandonnée rendus
+        order = place_order(cart, user, address, 'cash')
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, 'cancelled')
+        self.assertEqual(order.coupon_discount, 1000)
+        self.assertEqual(list(CouponRedemption.objects.values_list('order_id', flat=True)), [order.pk])
+        self.assertFalse(StockReservation.objects.exists())
+
@@ -0,0 +1,234 @@
+# universepro/trending.py
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .models import OrderItem, Product, TrendingProduct
+
+
+# Fenêtre glissante (jours) et demi-vie de la décroissance (jours) par période
+TRENDING_PERIODS = {
+    'daily': {'days': 1, 'half_life': 1},
+    'weekly': {'days': 7, 'half_life': 2},
+    'monthly': {'days': 30, 'half_life': 7},
+}
+# Poids de chaque signal dans le score
+SIGNAL_WEIGHTS = {'views': 1.0, 'clicks': 2.0, 'cart_adds': 5.0, 'orders': 10.0}
+# Nombre de produits classés par période
+TRENDING_MAX_RANKED = getattr(settings, 'TRENDING_MAX_RANKED', 100)
+# Statuts de commande qui ne comptent pas comme une vente
+EXCLUDED_ORDER_STATUSES = ('cancelled', 'refunded')
+# (jour, début) du dernier passage, dans le cache partagé: absent, le passage suivant est complet
+TRENDING_LAST_RUN_KEY = 'trending:last_run'
+SCORE_DIGITS = 6
+
+
+def window_start(today):
+    return today - timedelta(days=max(period['days'] for period in TRENDING_PERIODS.values()) - 1)
+
+
+def collect_signals(today, product_ids=None):
+    """
+    Signaux par (produit, jour) sur la plus longue fenêtre, en deux requêtes groupées:
+    compteurs quotidiens (vues, clics, ajouts au panier) et unités commandées.
+    Limités à `product_ids` si fourni.
+    """
+    start = window_start(today)
+    signals = defaultdict(lambda: dict.fromkeys(SIGNAL_WEIGHTS, 0))
+
+    counters = TrendingProduct.objects.filter(period='daily', date__gte=start, date__lte=today)
+    orders = (
+        OrderItem.objects.annotate(day=TruncDate('order__created_at'))
+        .filter(day__gte=start, day__lte=today)
+        .exclude(order__status__in=EXCLUDED_ORDER_STATUSES)
+    )
+    if product_ids is not None:
+        counters = counters.filter(product_id__in=product_ids)
+        orders = orders.filter(product_id__in=product_ids)
+
+    for product_id, day, views, clicks, cart_adds in counters.values_list(
+        'product_id', 'date', 'views', 'clicks', 'cart_adds'
+    ):
+        values = signals[(product_id, day)]
+        values['views'] += views
+        values['clicks'] += clicks
+        values['cart_adds'] += cart_adds
+
+    for product_id, day, total in orders.values_list('product_id', 'day').annotate(total=Sum('quantity')).order_by():
+        signals[(product_id, day)]['orders'] += total
+
+    return signals
+
+
+def changed_products(since, today):
+    """
+    Produits dont un signal a pu changer depuis `since`: compteurs de la fenêtre,
+    commandes créées ou changées de statut, produits modifiés (désactivation).
+    Trois requêtes servies par les index sur updated_at.
+    """
+    return (
+        # Lignes de classement créées sans compteur par le passage précédent: pas un signal
+        set(TrendingProduct.objects.filter(
+            period='daily', date__gte=window_start(today), updated_at__gte=since
+        ).exclude(views=0, clicks=0, cart_adds=0).order_by().values_list('product_id', flat=True))
+        | set(OrderItem.objects.filter(order__updated_at__gte=since).order_by().values_list('product_id', flat=True))
+        | set(Product.objects.filter(updated_at__gte=since).order_by().values_list('pk', flat=True))
+    )
+
+
+def score_periods(signals, today, active_ids):
+    """
+    Score décroissant dans le temps pour chaque période:
+    somme(poids * signal * 0.5 ** (âge / demi-vie)) sur la fenêtre de la période.
+    Retourne {période: {product_id: (score, vues, clics)}} des scores positifs.
+    """
+    results = {}
+    for period, config in TRENDING_PERIODS.items():
+        scores = defaultdict(float)
+        totals = defaultdict(lambda: [0, 0])
+        for (product_id, day), values in signals.items():
+            age = (today - day).days
+            if product_id not in active_ids or not 0 <= age < config['days']:
+                continue
+            decay = 0.5 ** (age / config['half_life'])
+            scores[product_id] += decay * sum(SIGNAL_WEIGHTS[name] * value for name, value in values.items())
+            totals[product_id][0] += values['views']
+            totals[product_id][1] += values['clicks']
+        # Arrondi: un score recalculé à l'identique se compare exactement au score enregistré
+        results[period] = {
+            product_id: (round(score, SCORE_DIGITS), *totals[product_id])
+            for product_id, score in scores.items() if score > 0
+        }
+    return results
+
+
+def merge_scores(scores, existing, product_ids):
+    """
+    Scores des produits sans nouveau signal repris des lignes classées du jour,
+    complétés par ceux recalculés pour `product_ids`. Retourne None si un produit
+    classé a perdu des points (commande annulée, produit désactivé): un produit
+    non classé pourrait alors le dépasser, il faut tout recalculer.
+    """
+    merged = {}
+    for period, changed in scores.items():
+        kept = {}
+        for (product_id, row_period), row in existing.items():
+            if row_period != period or not row.rank:
+                continue
+            if product_id not in product_ids:
+                kept[product_id] = (row.score, row.views, row.clicks)
+            elif changed.get(product_id, (0,))[0] < row.score:
+                return None
+        kept.update(changed)
+        merged[period] = kept
+    return merged
+
+
+def rank_scores(scores):
+    """[(product_id, score, vues, clics), ...] des TRENDING_MAX_RANKED meilleurs scores"""
+    ranked = sorted(scores, key=lambda pk: (-scores[pk][0], pk))[:TRENDING_MAX_RANKED]
+    return [(product_id, *scores[product_id]) for product_id in ranked]
+
+
+def compute_trending(today=None, full=False):
+    """
+    Calcule les classements quotidien, hebdomadaire et mensuel du jour.
+
+    Premier passage du jour (ou `full`): tous les signaux de la fenêtre sont relus.
+    Passages suivants du même jour: l'âge des signaux n'a pas changé, seuls les
+    produits dont un signal a bougé depuis le passage précédent (changed_products)
+    sont relus et rescorés; les autres gardent le score enregistré sur leur ligne.
+
+    Seules les lignes dont le rang (ou le score, les totaux de fenêtre) change sont
+    écrites (bulk_create / bulk_update). Les lignes 'daily' servent aussi de compteurs
+    bruts (voir counters.py): on n'y écrit que rang et score pour ne pas écraser un
+    incrément concurrent. Les lignes expirées sont supprimées.
+    """
+    today = today or timezone.localdate()
+    started = timezone.now()
+    last_run = None if full else cache.get(TRENDING_LAST_RUN_KEY)
+    product_ids = changed_products(last_run[1], today) if last_run and last_run[0] == today else None
+
+    signals = collect_signals(today, product_ids)
+    active_ids = set(Product.objects.filter(
+        pk__in={product_id for product_id, _ in signals}, is_active=True
+    ).order_by().values_list('pk', flat=True))
+    scores = score_periods(signals, today, active_ids)
+
+    rows = TrendingProduct.objects.filter(date=today)
+    if product_ids is not None:
+        rows = rows.filter(Q(rank__gt=0) | Q(product_id__in=product_ids))
+    existing = {(row.product_id, row.period): row for row in rows}
+    if product_ids is not None:
+        scores = merge_scores(scores, existing, product_ids)
+        if scores is None:
+            return compute_trending(today, full=True)
+    ranking = {period: rank_scores(period_scores) for period, period_scores in scores.items()}
+
+    to_create, rank_updates, snapshot_updates, to_delete = [], [], [], []
+
+    for period, ranked in ranking.items():
+        seen = set()
+        for rank, (product_id, score, views, clicks) in enumerate(ranked, 1):
+            seen.add(product_id)
+            row = existing.get((product_id, period))
+            if period == 'daily':
+                if row is None:
+                    to_create.append(TrendingProduct(
+                        product_id=product_id, period=period, date=today, rank=rank, score=score
+                    ))
+                elif (row.rank, row.score) != (rank, score):
+                    row.rank, row.score = rank, score
+                    rank_updates.append(row)
+            elif row is None:
+                to_create.append(TrendingProduct(
+                    product_id=product_id, period=period, date=today, rank=rank, score=score,
+                    views=views, clicks=clicks
+                ))
+            elif (row.rank, row.score, row.views, row.clicks) != (rank, score, views, clicks):
+                row.rank, row.score, row.views, row.clicks = rank, score, views, clicks
+                snapshot_updates.append(row)
+
+        for (product_id, row_period), row in existing.items():
+            if row_period != period or product_id in seen:
+                continue
+            if period == 'daily':
+                # Sorti du classement: la ligne reste un compteur, sans rang
+                if row.rank:
+                    row.rank, row.score = 0, 0
+                    rank_updates.append(row)
+            else:
+                to_delete.append(row.pk)
+
+    retention = TRENDING_PERIODS['monthly']['days']
+    with transaction.atomic():
+        TrendingProduct.objects.bulk_create(to_create, ignore_conflicts=True)
+        TrendingProduct.objects.bulk_update(rank_updates, ['rank', 'score'], batch_size=500)
+        TrendingProduct.objects.bulk_update(snapshot_updates, ['rank', 'score', 'views', 'clicks'], batch_size=500)
+        deleted, _ = TrendingProduct.objects.filter(pk__in=to_delete).delete()
+        # Compteurs quotidiens hors de la plus longue fenêtre, instantanés des jours précédents
+        pruned, _ = TrendingProduct.objects.filter(
+            period='daily', date__lte=today - timedelta(days=retention)
+        ).delete()
+        pruned_snapshots, _ = TrendingProduct.objects.exclude(period='daily').filter(date__lt=today).delete()
+
+        written = len(to_create) + len(rank_updates) + len(snapshot_updates) + deleted
+        if written:
+            # Les opérations groupées n'émettent pas post_save: invalider l'accueil ici
+            bump_catalog_version()
+        # Début du passage: un signal écrit pendant le calcul sera relu au suivant
+        transaction.on_commit(lambda: cache.set(TRENDING_LAST_RUN_KEY, (today, started), None))
+
+    return {
+        'created': len(to_create),
+        'updated': len(rank_updates) + len(snapshot_updates),
+        'deleted': deleted,
+        'pruned': pruned + pruned_snapshots,
+    }
@@ -18,6 +18,10 @@ urlpatterns = [
     path('products/category/<slug:category_slug>/', views.ProductListView.as_view(), name='product_list_by_category'),
     path('products/<slug:slug>/', views.ProductDetailView.as_view(), name='product_detail'),
 
+    path('api/products/', views.ProductListJsonView.as_view(), name='product_list_json'),
+    path('api/products/category/<slug:category_slug>/', views.ProductListJsonView.as_view(), name='product_list_json_by_category'),
+    path('api/suggest/', views.search_suggestions, name='search_suggestions'),
+    path('api/products/<int:product_id>/click/', views.track_product_click, name='track_product_click'),
     path('api/toggle-favorite/<int:product_id>/', views.toggle_favorite, name='toggle_favorite'),
     path('api/add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('api/submit-review/<int:product_id>/', views.submit_review, name='submit_review'),
@@ -35,6 +39,7 @@ urlpatterns = [
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('cart/remove/<int:item_id>/', views.remove_cart_item, name='remove_cart_item'),
+    path('cart/batch/', views.batch_update_cart, name='batch_update_cart'),
     path('cart/apply-coupon/', views.apply_coupon, name='apply_coupon'),
     
     # Checkout
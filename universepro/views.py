@@ -3,14 +3,15 @@ from django.urls import reverse
 from django.views.generic import ListView, DetailView, TemplateView
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponseBadRequest, Http404
 from django.db.models import Q, Count, Avg
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import F, Sum
+from django.db.models import F, Sum, Prefetch
 from django.db import models
 import json
 from decimal import Decimal
@@ -19,7 +20,7 @@ from django.utils import timezone
 import requests
 
 from .models import (
-    Product, Category, ProductReview, Favorite, Cart, CartItem,
+    Product, Category, ProductReview, ProductReviewStats, Favorite, Cart, CartItem,
     Order, OrderItem, Coupon, Address, ShippingMethod, TrendingProduct,
     Wishlist, WishlistItem, Notification, Payment
 )
@@ -27,6 +28,19 @@ from .forms import (
     ProductReviewForm, AddressForm, CheckoutForm, 
     NewsletterSubscriptionForm, ContactForm
 )
+from .search import search_products
+from .pagination import paginate_keyset, encode_cursor, InvalidCursor
+from .catalog_cache import get_catalog_data
+from .cart import (
+    SessionCart, materialize_session_cart, parse_cart_operations, apply_cart_operations, add_cart_line
+)
+from .counters import record_view, record_click, record_cart_add
+from .suggest import suggest
+from .shipping import apply_quote, cart_quotes
+from .promotions import best_coupon, coupon_saving
+from .coupons import code_filter
+from .orders import place_order, reserve_order, confirm_order, cancel_order
+from .facets import parse_filters, apply_filters, has_filters, compute_facets, FILTER_PARAMS
 
 # Classe helper pour PayGateGlobal
 class PayGatePayment:
@@ -93,122 +107,222 @@ class PayGatePayment:
             return {'status': 'error', 'message': str(e)}
 
 # Vues existantes (conservées)
-def home(request):
-    featured_products = Product.objects.filter(
-        featured=True, 
-        is_active=True
-    ).order_by('-created_at').prefetch_related('images', 'reviews')[:8]
+def build_home_data():
+    """Assemble les blocs de la page d'accueil (mis en cache par version du catalogue)"""
+    cards = Product.objects.for_cards().filter(is_active=True)
     
-    new_products = Product.objects.filter(
-        is_active=True
-    ).order_by('-created_at').prefetch_related('images', 'reviews')[:8]
+    featured_products = cards.filter(featured=True).order_by('-created_at')[:8]
     
-    discounted_products = Product.objects.filter(
-        is_active=True,
+    new_products = cards.order_by('-created_at')[:8]
+    
+    discounted_products = cards.filter(
         original_price__isnull=False
-    ).exclude(original_price=0).prefetch_related('images', 'reviews')[:8]
+    ).exclude(original_price=0)[:8]
     
-    trending_products = TrendingProduct.objects.filter(
+    # Rangs calculés par la commande compute_trending (0 = non classé)
+    trending_ids = list(TrendingProduct.objects.filter(
         date=timezone.now().date(),
-        period='daily'
-    ).select_related('product').order_by('rank')[:8]
+        period='daily',
+        rank__gt=0
+    ).order_by('rank').values_list('product_id', flat=True)[:8])
+    trending_by_id = cards.in_bulk(trending_ids)
     
     main_categories = Category.objects.filter(
         parent__isnull=True,
         is_active=True
     )[:6]
     
-    context = {
-        'featured_products': featured_products,
-        'new_products': new_products,
-        'discounted_products': discounted_products,
-        'trending_products': [tp.product for tp in trending_products],
-        'main_categories': main_categories,
+    return {
+        'featured_products': list(featured_products),
+        'new_products': list(new_products),
+        'discounted_products': list(discounted_products),
+        'trending_products': [trending_by_id[pk] for pk in trending_ids if pk in trending_by_id],
+        'main_categories': list(main_categories),
     }
-    
+
+def home(request):
+    # La date fait partie de la clé: les tendances du jour changent à minuit
+    context = get_catalog_data(f'home:{timezone.now().date()}', build_home_data)
     return render(request, 'index.html', context)
 
+# Tris du catalogue: colonnes dénormalisées couvertes par les index de Product.Meta
+PRODUCT_SORTS = {
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'rating': ('-rating', '-id'),
+    'name': ('name', 'id'),
+    'newest': ('-created_at', '-id'),
+    'popular': ('-reviews_count', '-id'),
+    'best_selling': ('-sales_count', '-id'),
+}
+# Pages numérotées (OFFSET) servies au plus; au-delà, le lien Suivant passe au curseur
+OFFSET_PAGE_LIMIT = 5
+
 class ProductListView(ListView):
     model = Product
     template_name = 'products/product_list.html'
     context_object_name = 'products'
     paginate_by = 12
+    use_cursor = False
     
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
+        queryset = Product.objects.for_cards().filter(is_active=True)
         
+        self.category = None
         category_slug = self.kwargs.get('category_slug')
         if category_slug:
-            category = get_object_or_404(Category, slug=category_slug)
-            subcategories = category.children.all()
-            if subcategories.exists():
-                queryset = queryset.filter(
-                    Q(category=category) | Q(category__in=subcategories)
-                )
-            else:
-                queryset = queryset.filter(category=category)
+            self.category = get_object_or_404(Category, slug=category_slug)
+            # Tous les produits du sous-arbre, quelle que soit la profondeur
+            queryset = queryset.filter(self.category.subtree_q('category__'))
         
         search_query = self.request.GET.get('q')
         if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(short_description__icontains=search_query)
-            )
+            # Index plein texte: résultats classés par pertinence
+            queryset = search_products(queryset, search_query)
+        
+        self.filters = parse_filters(self.request.GET)
+        queryset = apply_filters(queryset, self.filters)
+        self.facet_queryset = queryset
         
         sort_by = self.request.GET.get('sort_by')
-        if sort_by == 'price_asc':
-            queryset = queryset.order_by('price')
-        elif sort_by == 'price_desc':
-            queryset = queryset.order_by('-price')
-        elif sort_by == 'rating':
-            queryset = queryset.annotate(
-                avg_rating=Avg('reviews__rating')
-            ).order_by('-avg_rating')
-        elif sort_by == 'name':
-            queryset = queryset.order_by('name')
-        elif sort_by == 'newest':
-            queryset = queryset.order_by('-created_at')
-        elif sort_by == 'popular':
-            queryset = queryset.annotate(
-                review_count=Count('reviews')
-            ).order_by('-review_count')
+        if sort_by in PRODUCT_SORTS:
+            self.ordering_fields = PRODUCT_SORTS[sort_by]
+        elif 'search_rank' in queryset.query.annotations:
+            self.ordering_fields = ('search_rank', 'id')
+        else:
+            self.ordering_fields = ('-created_at', '-id')
         
-        return queryset
+        return queryset.order_by(*self.ordering_fields)
+    
+    def get_cursor_scope(self):
+        # Un curseur n'est valable que pour le tri, la recherche et les filtres qui l'ont produit
+        params = ('sort_by', 'q') + FILTER_PARAMS
+        return '|'.join(','.join(self.request.GET.getlist(param)) for param in params)
+    
+    def get_facets(self):
+        """
+        Compteurs de facettes du jeu de résultats courant (2 requêtes). Sans recherche ni
+        filtre, ils ne dépendent que de la catégorie: précalculés par version du catalogue.
+        """
+        if self.request.GET.get('q') or has_filters(self.filters):
+            return compute_facets(self.facet_queryset, self.filters)
+        name = 'facets:%s' % (self.category.pk if self.category else 'all')
+        return get_catalog_data(name, lambda: compute_facets(self.facet_queryset))
+    
+    def get_paginator(self, queryset, per_page, **kwargs):
+        paginator = super().get_paginator(queryset, per_page, **kwargs)
+        # Total déjà compté par les facettes (en cache sans recherche ni filtre): pas de COUNT(*) en plus
+        paginator.count = self.facets['total']
+        return paginator
+    
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Pagination classique (numéros de page) sur les OFFSET_PAGE_LIMIT premières
+        pages; pagination par curseur dès que le paramètre `cursor` est présent (pages
+        profondes, défilement infini). Une page numérotée plus profonde (ou `last`)
+        n'est pas servie: son OFFSET croîtrait avec la profondeur.
+        """
+        self.next_cursor = None
+        if not self.use_cursor and 'cursor' not in self.request.GET:
+            page_number = self.request.GET.get(self.page_kwarg) or 1
+            if not str(page_number).isdigit() or int(page_number) > OFFSET_PAGE_LIMIT:
+                raise Http404("Page trop profonde: poursuivre avec le lien Suivant (curseur)")
+            paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+            if page.has_next():
+                self.next_cursor = encode_cursor(
+                    page[-1],
+                    self.ordering_fields,
+                    self.get_cursor_scope()
+                )
+            return paginator, page, object_list, is_paginated
+        
+        try:
+            page = paginate_keyset(
+                queryset, self.ordering_fields, self.request.GET.get('cursor'),
+                page_size, self.get_cursor_scope()
+            )
+        except InvalidCursor:
+            raise Http404("Curseur de pagination invalide")
+        self.next_cursor = page.next_cursor
+        return None, None, page.object_list, page.has_next
     
     def get_context_data(self, **kwargs):
+        # Avant la pagination: le total des facettes sert de compte au paginateur
+        self.facets = self.get_facets()
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(
-            parent__isnull=True,
-            is_active=True
-        )
+        paginator = context.get('paginator')
+        if paginator is not None:
+            context['page_range'] = range(1, min(paginator.num_pages, OFFSET_PAGE_LIMIT) + 1)
+        context['offset_page_limit'] = OFFSET_PAGE_LIMIT
+        # Racines de l'arbre (avec `tree_children`) pour le menu latéral
+        context['categories'] = Category.get_tree()
         context['current_category'] = self.kwargs.get('category_slug')
+        context['breadcrumbs'] = list(self.category.get_ancestors(include_self=True)) if self.category else []
         context['search_query'] = self.request.GET.get('q', '')
         context['sort_by'] = self.request.GET.get('sort_by', '')
+        context['next_cursor'] = self.next_cursor
+        context['facets'] = self.facets
         return context
 
+class ProductListJsonView(ProductListView):
+    """Variante JSON de la liste produits pour le défilement infini (toujours par curseur)"""
+    use_cursor = True
+    
+    def get_context_data(self, **kwargs):
+        paginator, page, products, has_next = self.paginate_queryset(self.object_list, self.paginate_by)
+        return {'products': products, 'next_cursor': self.next_cursor}
+    
+    def render_to_response(self, context, **response_kwargs):
+        return JsonResponse({
+            'products': [
+                {
+                    'id': product.id,
+                    'name': product.name,
+                    'url': reverse('core:product_detail', args=[product.slug]),
+                    'image': product.card_image.image.url if product.card_image else None,
+                    'category': product.category.name if product.category else None,
+                    'price': str(product.price),
+                    'original_price': str(product.original_price) if product.original_price else None,
+                    'discount_percentage': product.discount_badge,
+                    'rating': product.rating,
+                    'reviews_count': product.reviews_count,
+                    'is_available': product.is_available(),
+                }
+                for product in context['products']
+            ],
+            'next_cursor': context['next_cursor'],
+        })
+
 class ProductDetailView(DetailView):
     model = Product
     template_name = 'products/product_detail.html'
     context_object_name = 'product'
     slug_url_kwarg = 'slug'
     
+    def get_queryset(self):
+        return Product.objects.select_related('category', 'review_stats').prefetch_related('features', 'images')
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         product = self.object
         
-        images = product.images.all().order_by('order')
-        context['main_image'] = images.filter(is_featured=True).first() or images.first()
-        context['other_images'] = images.exclude(id=context['main_image'].id) if context['main_image'] else []
+        # Images préchargées: image principale choisie en Python
+        images = list(product.images.all())
+        main_image = next((image for image in images if image.is_featured), images[0] if images else None)
+        context['main_image'] = main_image
+        context['other_images'] = [image for image in images if image is not main_image]
         
         reviews = product.reviews.filter(is_approved=True).select_related('user')
         context['reviews'] = reviews
         
-        rating_stats = {}
-        for i in range(5, 0, -1):
-            rating_stats[i] = reviews.filter(rating=i).count()
-        context['rating_stats'] = rating_stats
-        context['total_reviews'] = reviews.count()
+        # Histogramme précalculé (ProductReviewStats), aucune agrégation à l'affichage
+        try:
+            stats = product.review_stats
+        except ProductReviewStats.DoesNotExist:
+            stats = ProductReviewStats(product=product)
+        context['rating_histogram'] = stats.histogram
+        context['rating_stats'] = dict(stats.histogram)
+        context['total_reviews'] = stats.total
         
         if self.request.user.is_authenticated:
             user_review = reviews.filter(user=self.request.user).first()
@@ -216,10 +330,15 @@ class ProductDetailView(DetailView):
         else:
             context['review_form'] = ProductReviewForm()
         
-        similar_products = Product.objects.filter(
-            category=product.category,
-            is_active=True
-        ).exclude(id=product.id)[:4]
+        # Voisins précalculés (build_similarities), complétés par la catégorie si besoin
+        cards = Product.objects.for_cards().filter(is_active=True)
+        similar_products = list(
+            cards.filter(similar_to__product=product).order_by('similar_to__rank')[:4]
+        )
+        if len(similar_products) < 4 and product.category_id:
+            similar_products += cards.filter(category_id=product.category_id).exclude(
+                id__in=[product.id] + [similar.id for similar in similar_products]
+            ).order_by('-sales_count', '-id')[:4 - len(similar_products)]
         context['similar_products'] = similar_products
         
         if self.request.user.is_authenticated:
@@ -230,42 +349,33 @@ class ProductDetailView(DetailView):
         else:
             context['is_favorite'] = False
         
-        if self.request.user.is_authenticated:
-            today = timezone.now().date()
-            try:
-                trending_product = TrendingProduct.objects.get(
-                    product=product,
-                    period='daily',
-                    date=today
-                )
-                trending_product.views = F('views') + 1
-                trending_product.save()
-            except TrendingProduct.DoesNotExist:
-                TrendingProduct.objects.create(
-                    product=product,
-                    period='daily',
-                    date=today,
-                    views=1
-                )
+        # Compteur en mémoire (anonymes compris), écrit en base par lots
+        record_view(product.id)
         
         return context
 
+def search_suggestions(request):
+    """Suggestions de recherche instantanée (index en mémoire, aucune requête SQL par frappe)"""
+    return JsonResponse({'suggestions': suggest(request.GET.get('q', ''))})
+
+@csrf_exempt
+@require_POST
+def track_product_click(request, product_id):
+    """Compte un clic sur une carte produit (envoyé par navigator.sendBeacon)"""
+    record_click(product_id)
+    return JsonResponse({'success': True})
+
 @require_POST
 def clear_cart(request):
     if request.user.is_authenticated:
         cart = get_object_or_404(Cart, user=request.user)
+        cart.items.all().delete()
+        cart.coupon = None
+        cart.coupon_discount = Decimal('0.00')
+        cart.shipping_cost = Decimal('0.00')
+        cart.save()
     else:
-        session_key = request.session.session_key
-        if not session_key:
-            return JsonResponse({'status': 'error', 'message': 'Session invalide'})
-        
-        cart = get_object_or_404(Cart, session_key=session_key)
-    
-    cart.items.all().delete()
-    cart.coupon = None
-    cart.coupon_discount = Decimal('0.00')
-    cart.shipping_cost = Decimal('0.00')
-    cart.save()
+        SessionCart(request.session).clear()
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
@@ -304,40 +414,67 @@ class FavoriteListView(ListView):
         return super().dispatch(*args, **kwargs)
     
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user).select_related('product')
+        return Favorite.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('product', queryset=Product.objects.for_cards())
+        )
 
 def cart_view(request):
     if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart = Cart.objects.filter(user=request.user).first() or Cart(user=request.user)
+        # Devis mémorisé par version du panier: lecture pure, aucune écriture
+        quote = apply_quote(cart)
+        cart_items = cart.items.select_related('product').prefetch_related('product__images') if cart.pk else []
+        # Meilleur coupon automatique proposé (appliqué à la commande), sans écriture ici
+        suggested_coupon = best_coupon(cart, request.user) if cart.pk and not cart.coupon_id else None
     else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    
-    cart.calculate_shipping()
+        # Visiteur anonyme: panier en session, aucune écriture en base
+        cart = SessionCart(request.session)
+        cart_items = cart.get_items()
+        quote = cart_quotes(cart)[0]
+        suggested_coupon = None
     
+    free_shipping_threshold = quote.free_shipping_threshold or settings.FREE_SHIPPING_THRESHOLD
     context = {
         'cart': cart,
-        'free_shipping_threshold': settings.FREE_SHIPPING_THRESHOLD,
+        'cart_items': cart_items,
+        'free_shipping_threshold': free_shipping_threshold,
+        'remaining_for_free_shipping': max(free_shipping_threshold - cart.subtotal, 0),
+        'suggested_coupon': suggested_coupon,
+        'suggested_saving': coupon_saving(suggested_coupon, cart) if suggested_coupon else None,
     }
     
     return render(request, 'cart/cart.html', context)
 
 @require_POST
 def update_cart_item(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id)
+    quantity = int(request.POST.get('quantity', 1))
     
-    if request.user.is_authenticated:
-        if cart_item.cart.user != request.user:
-            return HttpResponseBadRequest("Accès non autorisé")
-    else:
-        if cart_item.cart.session_key != request.session.session_key:
-            return HttpResponseBadRequest("Accès non autorisé")
+    if not request.user.is_authenticated:
+        # Panier de session: item_id est l'id du produit
+        cart = SessionCart(request.session)
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
+            raise Http404("Article introuvable")
+        if quantity >= 1 and cart_item.product.stock_quantity and quantity > cart_item.product.stock_quantity:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Quantité demandée supérieure au stock disponible'
+            }, status=400)
+        cart.set(item_id, quantity)
+        if quantity < 1:
+            return JsonResponse({'status': 'removed'})
+        cart_item.quantity = quantity
+        return JsonResponse({
+            'status': 'updated',
+            'subtotal': str(cart.subtotal),
+            'shipping': str(cart.shipping_cost),
+            'total': str(cart.total),
+            'item_total': str(cart_item.total_price)
+        })
     
-    quantity = int(request.POST.get('quantity', 1))
+    cart_item = get_object_or_404(CartItem, id=item_id)
+    if cart_item.cart.user != request.user:
+        return HttpResponseBadRequest("Accès non autorisé")
     
     if quantity < 1:
         cart_item.delete()
@@ -353,6 +490,7 @@ def update_cart_item(request, item_id):
     cart_item.save()
     
     cart = cart_item.cart
+    cart.reload_totals()
     cart.calculate_shipping()
     
     return JsonResponse({
@@ -365,19 +503,20 @@ def update_cart_item(request, item_id):
 
 @require_POST
 def remove_cart_item(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id)
-    
     if request.user.is_authenticated:
+        cart_item = get_object_or_404(CartItem, id=item_id)
         if cart_item.cart.user != request.user:
             return HttpResponseBadRequest("Accès non autorisé")
+        
+        cart_item.delete()
+        
+        cart = cart_item.cart
+        cart.reload_totals()
+        cart.calculate_shipping()
     else:
-        if cart_item.cart.session_key != request.session.session_key:
-            return HttpResponseBadRequest("Accès non autorisé")
-    
-    cart_item.delete()
-    
-    cart = cart_item.cart
-    cart.calculate_shipping()
+        # Panier de session: item_id est l'id du produit
+        cart = SessionCart(request.session)
+        cart.remove(item_id)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
@@ -391,21 +530,81 @@ def remove_cart_item(request, item_id):
     return redirect('core:view')
 
 @require_POST
-def apply_coupon(request):
-    coupon_code = request.POST.get('coupon_code', '').strip()
+def batch_update_cart(request):
+    """
+    Applique plusieurs modifications du panier en une requête et une transaction.
+    Corps JSON: {"operations": [{"op": "add"|"set"|"remove", "product_id": 3, "quantity": 2}, ...]}
+    """
+    try:
+        operations = parse_cart_operations(json.loads(request.body).get('operations'))
+    except (ValueError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Requête invalide'}, status=400)
+    except ValidationError as error:
+        return JsonResponse({'status': 'error', 'message': error.message}, status=400)
     
     if request.user.is_authenticated:
-        cart = get_object_or_404(Cart, user=request.user)
+        cart, created = Cart.objects.get_or_create(user=request.user)
     else:
-        session_key = request.session.session_key
-        if not session_key:
-            return JsonResponse({'status': 'error', 'message': 'Session invalide'})
-        
-        cart = get_object_or_404(Cart, session_key=session_key)
+        cart = SessionCart(request.session)
+    
+    try:
+        quantities = apply_cart_operations(cart, operations)
+    except ValidationError as error:
+        return JsonResponse({
+            'status': 'error',
+            'message': error.message,
+            'errors': error.params['errors']
+        }, status=400)
+    
+    if request.user.is_authenticated:
+        # Frais de livraison recalculés une seule fois pour tout le lot
+        cart.calculate_shipping()
+    for op, product_id, _ in operations:
+        if op == 'add':
+            record_cart_add(product_id)
+    
+    # Totaux des lignes modifiées, par id de ligne (data-id du template): id produit en session
+    if request.user.is_authenticated:
+        item_totals = {
+            item_id: price * quantity
+            for item_id, price, quantity in cart.items.filter(product_id__in=quantities).values_list('id', 'price', 'quantity')
+        }
+    else:
+        item_totals = {item.id: item.total_price for item in cart.get_items() if item.product.pk in quantities}
+    
+    return JsonResponse({
+        'status': 'updated',
+        'items': {str(product_id): quantity for product_id, quantity in quantities.items()},
+        'item_totals': {str(item_id): str(total) for item_id, total in item_totals.items()},
+        'cart_items_count': cart.quantity_total,
+        'subtotal': str(cart.subtotal),
+        'shipping': str(cart.shipping_cost),
+        'total': str(cart.total)
+    })
+
+@require_POST
+def apply_coupon(request):
+    coupon_code = request.POST.get('coupon_code', '').strip()
+    
+    if not request.user.is_authenticated:
+        # Le panier anonyme vit en session: les coupons s'appliquent après connexion
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Connectez-vous pour appliquer un code promo'
+        }, status=400)
+    
+    # Code inconnu (faute de frappe, force brute): refusé sans requête
+    if not code_filter.might_exist(coupon_code):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Coupon invalide ou expiré'
+        }, status=400)
+    
+    cart = get_object_or_404(Cart, user=request.user)
     
     try:
         coupon = Coupon.objects.get(code=coupon_code, is_active=True)
-        if cart.apply_coupon(coupon_code):
+        if cart.apply_coupon(coupon):
             return JsonResponse({
                 'status': 'success',
                 'message': 'Coupon appliqué avec succès',
@@ -552,46 +751,40 @@ def add_to_cart(request, product_id):
             'message': "Ce produit n'est pas disponible"
         }, status=400)
     
-    # Gestion du panier pour utilisateur connecté ou anonyme
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    
     # Gestion de la quantité (par défaut 1)
     quantity = int(request.POST.get('quantity', 1))
+    if quantity < 1:
+        return JsonResponse({'status': 'error', 'message': "Quantité invalide"}, status=400)
     
-    # Création ou mise à jour de l'article du panier
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={
-            'quantity': quantity, 
-            'price': product.price
-        }
-    )
-    
-    if not created:
-        new_quantity = cart_item.quantity + quantity
-        # Vérification du stock
+    if not request.user.is_authenticated:
+        # Visiteur anonyme: panier en session jusqu'à la connexion ou la commande
+        cart = SessionCart(request.session)
+        new_quantity = cart.lines.get(product.id, 0) + quantity
         if product.stock_quantity and new_quantity > product.stock_quantity:
             return JsonResponse({
                 'status': 'error', 
                 'message': "Quantité demandée supérieure au stock disponible",
                 'available_quantity': product.stock_quantity
             }, status=400)
-        
-        cart_item.quantity = new_quantity
-        cart_item.save()
+        cart.add(product.id, quantity)
+        record_cart_add(product.id)
+        return cart_added_response(request, product, cart.quantity_total)
+    
+    cart, created = Cart.objects.get_or_create(user=request.user)
     
-    # Mise à jour du compteur du panier
-    cart_items_count = cart.items.aggregate(total=Sum('quantity'))['total'] or 0
+    # Incrément atomique, vérification du stock incluse dans la requête
+    if not add_cart_line(cart, product, quantity):
+        return JsonResponse({
+            'status': 'error', 
+            'message': "Quantité demandée supérieure au stock disponible",
+            'available_quantity': product.stock_quantity
+        }, status=400)
     
+    record_cart_add(product.id)
+    # Compteur lu avec le panier, plus la quantité ajoutée: pas de relecture après l'ajout
+    return cart_added_response(request, product, cart.quantity_total + quantity)
+
+def cart_added_response(request, product, cart_items_count):
     # Réponse JSON pour requêtes AJAX
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
@@ -699,11 +892,8 @@ def check_payment_status(request, payment_id):
             payment.status = 'completed'
             payment.save()
             
-            payment.order.payment_status = True
-            payment.order.save()
-            
-            # Envoyer une confirmation
-            if settings.WHATSAPP_ENABLED:
+            # Réservations converties en décrément de stock (une seule fois, voir orders.confirm_order)
+            if confirm_paid_order(payment.order) and settings.WHATSAPP_ENABLED:
                 payment.order.send_whatsapp_confirmation()
             
             return JsonResponse({
@@ -713,6 +903,18 @@ def check_payment_status(request, payment_id):
     
     return JsonResponse({'status': 'pending'})
 
+def confirm_paid_order(order):
+    """
+    Confirme une commande payée; retourne True à la première confirmation.
+    Stock épuisé depuis l'expiration de la réservation: la commande reste en
+    attente, marquée payée, pour traitement par l'équipe.
+    """
+    try:
+        return confirm_order(order)
+    except ValidationError:
+        Order.objects.filter(pk=order.pk).update(payment_status=True)
+        return False
+
 @csrf_exempt
 def paygate_callback(request):
     """
@@ -742,11 +944,8 @@ def paygate_callback(request):
                 payment.payment_details['callback_data'] = data
                 payment.save()
                 
-                order.payment_status = True
-                order.save()
-                
-                # Envoyer une confirmation
-                if settings.WHATSAPP_ENABLED:
+                # Réservations converties en décrément de stock (une seule fois, voir orders.confirm_order)
+                if confirm_paid_order(order) and settings.WHATSAPP_ENABLED:
                     order.send_whatsapp_confirmation()
                 
                 return JsonResponse({'status': 'success'})
@@ -755,6 +954,9 @@ def paygate_callback(request):
                 payment.payment_details['callback_data'] = data
                 payment.save()
                 
+                # Stock retenu libéré sans attendre l'expiration
+                cancel_order(order)
+                
                 return JsonResponse({
                     'status': 'error',
                     'message': data.get('message', 'Paiement échoué')
@@ -887,26 +1089,12 @@ def finalize_order(request):
                 'message': 'Votre panier est vide'
             }, status=400)
 
-        if not cart.items.exists():
+        if not cart.item_count:
             return JsonResponse({
                 'status': 'error', 
                 'message': 'Votre panier est vide'
             }, status=400)
 
-        # Vérifier la disponibilité des produits
-        for item in cart.items.all():
-            if not item.product.is_available():
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f"{item.product.name} n'est plus disponible"
-                }, status=400)
-            
-            if item.product.stock_quantity and item.quantity > item.product.stock_quantity:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f"Stock insuffisant pour {item.product.name}"
-                }, status=400)
-
         # Récupérer les données JSON
         try:
             data = json.loads(request.body)
@@ -973,64 +1161,22 @@ def finalize_order(request):
                     'message': f'Erreur lors de la création de l\'adresse: {str(e)}'
                 }, status=500)
 
-        # Créer la commande
+        # Commande, articles, stock, coupon et panier en une transaction (voir orders.py)
         try:
-            order = Order.objects.create(
-                user=request.user,
-                cart=cart,
-                shipping_address=shipping_address,
-                billing_address=shipping_address,
-                subtotal=cart.subtotal,
-                coupon_discount=cart.coupon_discount,
-                shipping_cost=cart.shipping_cost,
-                total=cart.total,
+            order = place_order(
+                cart, request.user, shipping_address,
                 payment_method=data.get('payment_method', 'mobile_money'),
                 payment_status=data.get('payment_method') == 'cash_on_delivery',
-                status='confirmed',
                 note=data.get('note', '')
             )
             print(f"Commande créée: {order.order_number}")
-        except Exception as e:
-            print(f"Erreur création commande: {str(e)}")
+        except ValidationError as e:
+            if e.code == 'coupon':
+                cart.clear_coupon()
             return JsonResponse({
                 'status': 'error',
-                'message': f'Erreur lors de la création de la commande: {str(e)}'
-            }, status=500)
-
-        # Créer les articles de la commande
-        try:
-            for cart_item in cart.items.all():
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.price,
-                    total_price=cart_item.total_price
-                )
-                
-                # Mettre à jour le stock
-                if cart_item.product.stock_quantity:
-                    cart_item.product.stock_quantity -= cart_item.quantity
-                    if cart_item.product.stock_quantity <= 0:
-                        cart_item.product.in_stock = False
-                        cart_item.product.stock_quantity = 0
-                    cart_item.product.save()
-            
-            print("Articles de commande créés et stocks mis à jour")
-        except Exception as e:
-            print(f"Erreur création articles: {str(e)}")
-            return JsonResponse({
-                'status': 'error',
-                'message': f'Erreur lors de la création des articles: {str(e)}'
-            }, status=500)
-
-        # Utiliser le coupon s'il y en a un
-        if cart.coupon:
-            try:
-                cart.coupon.use_coupon()
-                print("Coupon utilisé")
-            except Exception as e:
-                print(f"Erreur utilisation coupon: {str(e)}")
+                'message': e.messages[0]
+            }, status=400)
 
         # Envoyer le reçu WhatsApp
         try:
@@ -1053,17 +1199,6 @@ def finalize_order(request):
         except Exception as e:
             print(f"Erreur création notification: {str(e)}")
 
-        # Vider le panier
-        try:
-            cart.items.all().delete()
-            cart.coupon = None
-            cart.coupon_discount = Decimal('0.00')
-            cart.shipping_cost = Decimal('0.00')
-            cart.save()
-            print("Panier vidé")
-        except Exception as e:
-            print(f"Erreur vidage panier: {str(e)}")
-
         print("=== FIN FINALIZE_ORDER - SUCCÈS ===")
         
         return JsonResponse({
@@ -1152,6 +1287,8 @@ Pour toute question, contactez-nous au {site_settings.phone}
 # Mettre à jour la vue checkout_view pour utiliser la nouvelle logique
 @login_required
 def checkout_view(request):
+    # Panier de session restant (la connexion le fusionne déjà): matérialisé en une opération groupée
+    materialize_session_cart(request)
     cart = get_object_or_404(Cart, user=request.user)
     
     if not cart.items.exists():
@@ -1168,38 +1305,43 @@ def checkout_view(request):
             return redirect('core:cart_view')
     
     addresses = Address.objects.filter(user=request.user)
-    shipping_methods = ShippingMethod.objects.filter(is_active=True)
+    # Devis de chaque méthode active pour l'adresse par défaut (poids, seuils, régions)
+    default_address = next((address for address in addresses if address.is_default), None)
+    shipping_methods = cart_quotes(cart, default_address)
+    cart.calculate_shipping(default_address)  # écrit seulement si le devis a changé
+    if not cart.coupon_id:
+        # Meilleur coupon automatique, sans saisie de code
+        coupon = best_coupon(cart, request.user)
+        if coupon:
+            cart.apply_coupon(coupon)
     
     if request.method == 'POST':
         form = CheckoutForm(request.POST, user=request.user)
         if form.is_valid():
             # Pour les paiements mobiles, utiliser PayGate
             if form.cleaned_data['payment_method'] == 'mobile_money':
-                # Logique PayGate existante...
                 phone_number = form.cleaned_data['mobile_money_phone']
                 network = form.cleaned_data['mobile_money_network']
                 
-                # Sauvegarder les données temporaires en session
-                request.session['checkout_data'] = {
-                    'shipping_address_id': form.cleaned_data.get('shipping_address'),
-                    'shipping_first_name': form.cleaned_data.get('shipping_first_name'),
-                    'shipping_last_name': form.cleaned_data.get('shipping_last_name'),
-                    'shipping_phone': form.cleaned_data.get('shipping_phone'),
-                    'shipping_address_line1': form.cleaned_data.get('shipping_address_line1'),
-                    'shipping_address_line2': form.cleaned_data.get('shipping_address_line2'),
-                    'shipping_city': form.cleaned_data.get('shipping_city'),
-                    'shipping_postal_code': form.cleaned_data.get('shipping_postal_code'),
-                    'shipping_country': form.cleaned_data.get('shipping_country'),
-                    'payment_method': form.cleaned_data['payment_method'],
-                    'note': form.cleaned_data.get('note', '')
-                }
+                # Commande en attente, stock retenu le temps de la validation sur le téléphone
+                try:
+                    order = reserve_order(
+                        cart, request.user, checkout_shipping_address(request, form),
+                        payment_method='mobile_money', note=form.cleaned_data.get('note', '')
+                    )
+                except ValidationError as e:
+                    if e.code == 'coupon':
+                        cart.clear_coupon()
+                    messages.error(request, e.messages[0])
+                    return redirect('core:cart_view')
                 
-                success, result = PayGatePayment.initiate_payment(cart, phone_number, network)
+                success, result = PayGatePayment.initiate_payment(order, phone_number, network)
                 
                 if success:
                     payment = result
                     return redirect('core:payment_processing', payment_id=payment.id)
                 else:
+                    cancel_order(order)
                     messages.error(request, f"Erreur de paiement: {result}")
                     return redirect('core:checkout')
             
@@ -1219,77 +1361,49 @@ def checkout_view(request):
     return render(request, 'checkout/checkout.html', context)
     
 
+def checkout_shipping_address(request, form):
+    """Adresse choisie dans le formulaire de commande, ou nouvelle adresse saisie"""
+    if form.cleaned_data.get('shipping_address'):
+        return form.cleaned_data['shipping_address']
+    return Address.objects.create(
+        user=request.user,
+        first_name=form.cleaned_data['shipping_first_name'],
+        last_name=form.cleaned_data['shipping_last_name'],
+        phone=form.cleaned_data['shipping_phone'],
+        address_line1=form.cleaned_data['shipping_address_line1'],
+        address_line2=form.cleaned_data.get('shipping_address_line2', ''),
+        city=form.cleaned_data['shipping_city'],
+        postal_code=form.cleaned_data['shipping_postal_code'],
+        country=form.cleaned_data.get('shipping_country', 'Togo'),
+        is_default=not Address.objects.filter(user=request.user, is_default=True).exists()
+    )
+
+
 def finalize_order_direct(request, form):
     """
     Crée la commande directement pour les méthodes de paiement non-mobiles
     """
     try:
         cart = get_object_or_404(Cart, user=request.user)
+        shipping_address = checkout_shipping_address(request, form)
         
-        # Créer l'adresse
-        shipping_address = None
-        if form.cleaned_data.get('shipping_address'):
-            shipping_address = form.cleaned_data['shipping_address']
-        else:
-            shipping_address = Address.objects.create(
-                user=request.user,
-                first_name=form.cleaned_data['shipping_first_name'],
-                last_name=form.cleaned_data['shipping_last_name'],
-                phone=form.cleaned_data['shipping_phone'],
-                address_line1=form.cleaned_data['shipping_address_line1'],
-                address_line2=form.cleaned_data.get('shipping_address_line2', ''),
-                city=form.cleaned_data['shipping_city'],
-                postal_code=form.cleaned_data['shipping_postal_code'],
-                country=form.cleaned_data.get('shipping_country', 'Togo'),
-                is_default=not Address.objects.filter(user=request.user, is_default=True).exists()
-            )
-        
-        # Créer la commande
-        order = Order.objects.create(
-            user=request.user,
-            cart=cart,
-            shipping_address=shipping_address,
-            billing_address=shipping_address,
-            subtotal=cart.subtotal,
-            coupon_discount=cart.coupon_discount,
-            shipping_cost=cart.shipping_cost,
-            total=cart.total,
-            payment_method=form.cleaned_data['payment_method'],
-            payment_status=form.cleaned_data['payment_method'] == 'cash_on_delivery',  # Paiement à la livraison
-            status='confirmed',
-            note=form.cleaned_data.get('note', '')
-        )
-        
-        # Créer les articles et mettre à jour le stock
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.price,
-                total_price=cart_item.total_price
+        # Commande, articles, stock, coupon et panier en une transaction (voir orders.py)
+        try:
+            order = place_order(
+                cart, request.user, shipping_address,
+                payment_method=form.cleaned_data['payment_method'],
+                payment_status=form.cleaned_data['payment_method'] == 'cash_on_delivery',  # Paiement à la livraison
+                note=form.cleaned_data.get('note', '')
             )
-            
-            if cart_item.product.stock_quantity:
-                cart_item.product.stock_quantity -= cart_item.quantity
-                if cart_item.product.stock_quantity <= 0:
-                    cart_item.product.in_stock = False
-                cart_item.product.save()
-        
-        # Utiliser le coupon
-        if cart.coupon:
-            cart.coupon.use_coupon()
+        except ValidationError as e:
+            if e.code == 'coupon':
+                cart.clear_coupon()
+            messages.error(request, e.messages[0])
+            return redirect('core:checkout')
         
         # Envoyer WhatsApp
         send_whatsapp_receipt(order)
         
-        # Vider le panier
-        cart.items.all().delete()
-        cart.coupon = None
-        cart.coupon_discount = Decimal('0.00')
-        cart.shipping_cost = Decimal('0.00')
-        cart.save()
-        
         messages.success(request, f"Commande #{order.order_number} créée avec succès!")
         return redirect('core:order_confirmation', order_number=order.order_number)
         